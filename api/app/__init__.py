@@ -7,6 +7,13 @@ from flask_sqlalchemy import SQLAlchemy
 from config import config
 from flask_login import LoginManager
 from flask_pagedown import PageDown
+from .pubsub import Events
+from .cache import TaskCache, AuthCache, FragmentCache
+from .encoding import ResponseEncoder
+from .hashing import PasswordHasher
+from .tokens import TokenSigner
+from .revocation import TokenRevocations
+from .outbox import EmailOutbox
 
 # Create Bootstrap object for styling.
 bootstrap = Bootstrap()
@@ -26,6 +33,33 @@ login_manager = LoginManager()
 # Create pagdown object.
 pagedown = PageDown()
 
+# Create events object to stream family task changes.
+events = Events()
+
+# Create cache object for serialized task lists.
+task_cache = TaskCache()
+
+# Create cache object for encoded task and subtask fragments.
+fragment_cache = FragmentCache()
+
+# Create encoder object for API responses.
+response_encoder = ResponseEncoder()
+
+# Create cache object for verified auth tokens.
+auth_cache = AuthCache()
+
+# Create password hasher object to hash passwords off the request workers.
+password_hasher = PasswordHasher()
+
+# Create token signer object to issue and verify signed tokens.
+tokens = TokenSigner()
+
+# Create revocation object for the auth tokens revoked before they expire.
+token_revocations = TokenRevocations()
+
+# Create outbox object to send queued emails.
+email_outbox = EmailOutbox()
+
 # App factory.
 def create_app(config_name):
     app = Flask(__name__,static_folder="../build", static_url_path='/')
@@ -38,6 +72,15 @@ def create_app(config_name):
     db.init_app(app)
     login_manager.init_app(app)
     pagedown.init_app(app)
+    events.init_app(app)
+    task_cache.init_app(app)
+    fragment_cache.init_app(app)
+    response_encoder.init_app(app)
+    auth_cache.init_app(app)
+    password_hasher.init_app(app)
+    tokens.init_app(app)
+    token_revocations.init_app(app)
+    email_outbox.init_app(app)
 
     # Import and register blueprints.
     from .api import api as api_blueprint
@@ -3,4 +3,4 @@ from flask import Blueprint
 
 api = Blueprint('api', __name__)
 
-from . import tasks, authentication, users
+from . import tasks, authentication, users, admin, analytics
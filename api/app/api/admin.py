@@ -0,0 +1,22 @@
+from ..encoding import jsonify
+from .. import task_cache, auth_cache, fragment_cache, token_revocations, \
+        email_outbox
+from . import api
+from .decorators import admin_required, login_required
+
+
+# Route to report the in-process cache counters of the serving worker, and
+#   the email outbox depth.
+@api.route('/admin/stats', methods=['GET', 'POST'])
+@login_required
+@admin_required
+def get_stats():
+    response = jsonify({
+        'taskCache':task_cache.stats(),
+        'fragmentCache':fragment_cache.stats(),
+        'authCache':auth_cache.stats(),
+        'tokenRevocations':token_revocations.stats(),
+        'emailOutbox':email_outbox.stats()
+        })
+    response.status_code = 200
+    return response
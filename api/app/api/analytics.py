@@ -0,0 +1,48 @@
+from datetime import date, timedelta
+from flask import g, request
+from ..encoding import jsonify
+from . import api
+from ..models import TaskCompletionDay
+from .decorators import login_required, family_etag
+
+# Longest ranges served by the analytics routes.
+MAX_DAYS = 366
+MAX_WEEKS = 53
+
+
+# Route to get the number of tasks completed by each family member over the
+#   last days, 30 by default.
+# Counts are summed from the daily rollups in SQL.
+@api.route('/analytics/members', methods=['GET', 'POST'])
+@login_required
+@family_etag('analytics-members')
+def get_member_completions():
+    days = max(1, min(request.args.get('days', 30, type=int), MAX_DAYS))
+    since = date.today() - timedelta(days=days - 1)
+    members = []
+    if g.current_user.family:
+        members = [{'id':user_id, 'username':username, 'completions':count}
+                   for user_id, username, count
+                   in g.current_user.family.completions_by_member(since)]
+    response = jsonify({'since':since.isoformat(), 'members':members})
+    response.status_code = 200
+    return response
+
+
+# Route to get the number of tasks completed by the family in each of the
+#   last weeks, 12 by default, including the current week.
+# Weeks start on sunday, and weeks without completions are reported as 0.
+@api.route('/analytics/weeks', methods=['GET', 'POST'])
+@login_required
+@family_etag('analytics-weeks')
+def get_weekly_completions():
+    weeks = max(1, min(request.args.get('weeks', 12, type=int), MAX_WEEKS))
+    since = TaskCompletionDay.week_of(date.today()) - timedelta(weeks=weeks - 1)
+    counts = {}
+    if g.current_user.family:
+        counts = dict(g.current_user.family.completions_by_week(since))
+    response = jsonify({'weeks':[
+            {'week':week.isoformat(), 'completions':counts.get(week, 0)}
+            for week in (since + timedelta(weeks=i) for i in range(weeks))]})
+    response.status_code = 200
+    return response
@@ -1,12 +1,42 @@
 from . import api
-from .. import db
-import ast
-from flask import g, jsonify, current_app, request
+from .. import db, events, tokens
+from flask import g, request
+from ..encoding import jsonify
 from ..models import User, Role, Family
 from ..emails import send_email
-from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from .decorators import permission_required, leader_required, \
-        login_required
+        login_required, family_etag
+from .schemas import Schema, request_body
+
+
+# The request bodies of the routes below.
+REGISTRATION_BODY = Schema(username=str, email=str, password=str)
+USER_ID_BODY = Schema(id=(int, str))
+EMAIL_BODY = Schema(email=(str, None))
+RESET_BODY = Schema(token=(str, None), password=str)
+FAMILY_BODY = Schema(familyName=(str, None))
+PASSWORD_BODY = Schema(oldPass=str, newPass=str)
+
+
+# This returns the family name, family id, members and number of leaders of
+#   the user's family, as sent by login and getFamily, from one query.
+def family_summary(user):
+    roster = Family.roster(user.family_id) if user.family_id else []
+    if not roster:
+        return '', '', [], 0
+    leaders = roster[0].leaders
+    members = [{'name':member.username,
+                'id':member.id,
+                'isLeader': member.role_name == 'Leader',
+                'isOnlyLeader': leaders == 1 and member.role_name == 'Leader'}
+        for member in roster]
+    return roster[0].family_name, user.family_id, members, leaders
+
+
+# This determines if the user has the leader role, from the role registry.
+def is_leader(user):
+    role = Role.registry().by_id.get(user.role_id)
+    return role is not None and role.name == 'Leader'
 
 
 # Route for user login.
@@ -30,52 +60,27 @@ def login():
             return response
 
         # Generate the response.
-        if user.family:
-            family_name = user.family.family_name
-            family_id = user.family.id
-            leaders = user.family.count_leaders()
-            members = [{'name':member.username,
-                        'id':member.id,
-                        'isLeader': member.role.name == 'Leader',
-                        'isOnlyLeader': leaders == 1 and  member.role.name == 'Leader'
-                        }
-                for member in user.family.members.all()]
-        else:
-            family_name = ''
-            family_id = ''
-            members = []
-            leaders = 0
+        family_name, family_id, members, leaders = family_summary(user)
         response = jsonify({'token': user.generate_auth_token(),
                         'confirmed': user.confirmed,
                         'id': user.id,
                         'family_name': family_name,
                         'family_id': family_id,
                         'members': members,
-                        'isLeader': user.role.name == 'Leader',
+                        'isLeader': is_leader(user),
                         'leaders': leaders})
         response.status_code = 200
         return response
 
 
 # Route to retrieve a user's family info.
-@api.route('/auth/getFamily', methods=['POST'])
+# Response code 304 is sent if the family has not changed since the ETag.
+@api.route('/auth/getFamily', methods=['GET', 'POST'])
 @login_required
+@family_etag('family')
 def get_family():
-    if g.current_user.family:
-        family_name = g.current_user.family.family_name
-        family_id = g.current_user.family.id
-        leaders = g.current_user.family.count_leaders()
-        members = [{'name':member.username,
-                    'id':member.id,
-                    'isLeader': member.role.name == 'Leader',
-                    'isOnlyLeader': leaders == 1 and  member.role.name == 'Leader'}
-            for member in g.current_user.family.members.all()]
-    else:
-        family_name = ''
-        family_id = ''
-        members = []
-        leaders = 0
-    isLeader = g.current_user.role.name == 'Leader'
+    family_name, family_id, members, leaders = family_summary(g.current_user)
+    isLeader = is_leader(g.current_user)
     # Generate the response.
     response = jsonify({'family_name':family_name,
                     'family_id':family_id,
@@ -93,7 +98,7 @@ def get_family():
 @api.route('/auth/registration', methods=['POST'])
 def register_user():
     # Determine if user credentials are available.
-    user_json = ast.literal_eval(request.json.get('body'))
+    user_json = request_body(REGISTRATION_BODY)
     u_email = User.query.filter_by(email=user_json['email']).first()
     u_username = User.query.filter_by(username=user_json['username']).first()
     if u_email and u_username:
@@ -112,9 +117,9 @@ def register_user():
     # Create new user in the db.
     user = User.from_json(user_json)
     db.session.add(user)
-    db.session.commit()
+    db.session.flush()
 
-    # Send confirmation email and generate the response.
+    # Send confirmation email with the new user, and generate the response.
     token = user.generate_confirmation_token()
     send_email(
         user.email,
@@ -123,6 +128,7 @@ def register_user():
         user=user,
         token=token
         )
+    db.session.commit()
     response = jsonify({'message':f'Successfully created user {user_json["username"]}'})
     response.status_code = 201
     return response
@@ -131,7 +137,7 @@ def register_user():
 # Route to resend a user's confirmation email.
 @api.route('/auth/resendConfirmationEmail', methods=['POST'])
 def resend_confirmation_email():
-    user_id = ast.literal_eval(request.json.get('body'))['id']
+    user_id = request_body(USER_ID_BODY)['id']
     user = User.query.get_or_404(user_id)
 
     # Send confirmation email and generate the response.
@@ -143,6 +149,7 @@ def resend_confirmation_email():
         user=user,
         token=token
         )
+    db.session.commit()
     response = jsonify({'message':'Confirmation email sent.'})
     response.status_code = 200
     return response
@@ -152,14 +159,9 @@ def resend_confirmation_email():
 # Response code will be 200 for success, or 401 for unauthorized.
 @api.route('/auth/confirmUser/<token>', methods=['POST'])
 def confirm_user(token):
-    s = Serializer(
-        current_app._get_current_object().config['SECRET_KEY'],
-        expires_in=60)
-
     # Validate the token.
-    try:
-        data = s.loads(token.encode('utf-8'))
-    except:
+    data = tokens.verify('confirm', token)
+    if data is None:
         response = jsonify({'errMessage':'Invalid confirmation token.'})
         response.status_code = 401
         return response
@@ -183,7 +185,7 @@ def confirm_user(token):
 @api.route('/auth/sendFamilyInvite', methods=['POST'])
 @leader_required
 def send_family_invite():
-    email = ast.literal_eval(request.json.get('body'))['email']
+    email = request_body(EMAIL_BODY)['email']
     fam_id = g.current_user.family.id
     token = g.current_user.family.generate_family_token(email)
     send_email(
@@ -193,6 +195,7 @@ def send_family_invite():
         user=g.current_user,
         token=token
         )
+    db.session.commit()
     # Generate the response.
     response = jsonify({'message':f'Join request email sent to {email} for family {g.current_user.family.family_name}.'})
     response.status_code = 200
@@ -203,14 +206,9 @@ def send_family_invite():
 # Response code 200 for success.
 @api.route('/auth/confirmInviteToken/<token>', methods=['POST'])
 def confirm_join_family(token):
-    s = Serializer(
-        current_app._get_current_object().config['SECRET_KEY'],
-        expires_in=86400)
-
     # Validate the token.
-    try:
-        data = s.loads(token.encode('utf-8'))
-    except:
+    data = tokens.verify('family', token)
+    if data is None:
         response = jsonify({'errMessage':'Invalid confirmation token.'})
         response.status_code = 401
         return response
@@ -220,10 +218,13 @@ def confirm_join_family(token):
     # Update the user, and generate the response.
     if u:
         # BUGZ: Will reassign family no matter what.
+        old_family_id = u.family_id
         u.family_id = data['family_id']
-        u.role = Role.query.filter_by(name='User').first()
+        u.role = Role.named('User')
         db.session.add(u)
         db.session.commit()
+        events.publish_family(old_family_id, 'member-change', user_id=u.id)
+        events.publish_family(u.family_id, 'member-change', user_id=u.id)
         response = jsonify({'message':f'User ({u.username}) family updated.'})
         response.status_code = 200
         return response
@@ -238,11 +239,11 @@ def confirm_join_family(token):
 # Response code 200 always sent.
 @api.route('/auth/sendResetRequest', methods=['POST'])
 def send_reset_request():
-    email = ast.literal_eval(request.json.get('body'))['email']
+    email = request_body(EMAIL_BODY)['email']
     user = User.query.filter_by(email=email).first()
     # Send the password reset request.
     if user:
-        token = user.generate_confirmation_token()
+        token = user.generate_reset_token()
         send_email(
             email,
             'HunnyDU: Password Reset',
@@ -250,6 +251,7 @@ def send_reset_request():
             user=user,
             token=token
             )
+        db.session.commit()
     # Generate the response.
     response = jsonify({'message':f'Password reset email sent to {email}.'})
     response.status_code = 200
@@ -260,14 +262,9 @@ def send_reset_request():
 # Response is code 200 for valid, and 401 for invalid.
 @api.route('/auth/validateResetRequest/<token>', methods=['POST'])
 def validate_reset_request(token):
-    s = Serializer(
-        current_app._get_current_object().config['SECRET_KEY'],
-        expires_in=300)
-
     # Validate the token.
-    try:
-        data = s.loads(token.encode('utf-8'))
-    except:
+    data = tokens.verify('reset', token)
+    if data is None:
         response = jsonify({'errMessage':'Invalid token.'})
         response.status_code = 401
         return response
@@ -283,15 +280,11 @@ def validate_reset_request(token):
 # Response code is 200 for success, and 401 for invalid token.
 @api.route('/auth/processPasswordReset', methods=['POST'])
 def process_reset_request():
-    token = ast.literal_eval(request.json.get('body'))['token']
-    s = Serializer(
-        current_app._get_current_object().config['SECRET_KEY'],
-        expires_in=300)
-
+    body = request_body(RESET_BODY)
+    token = body['token']
     # Validate the token.
-    try:
-        data = s.loads(token.encode('utf-8'))
-    except:
+    data = tokens.verify('reset', token)
+    if data is None:
         response = jsonify({'errMessage':'Invalid token.'})
         response.status_code = 401
         return response
@@ -299,7 +292,7 @@ def process_reset_request():
     # Update user information, and generate the response.
     user = User.query.filter_by(id=data['confirm']).first()
     if user:
-        user.password = ast.literal_eval(request.json.get('body'))['password']
+        user.password = body['password']
         db.session.add(user)
         db.session.commit()
         response = jsonify({'message':'Success'})
@@ -315,14 +308,16 @@ def process_reset_request():
 @api.route('/auth/removeFamilyMember', methods=['POST'])
 @leader_required
 def remove_family_member():
-    id = ast.literal_eval(request.json.get('body'))['id']
+    id = request_body(USER_ID_BODY)['id']
     user = User.query.get_or_404(id)
     # Removes a user's tasks.
     for task in user.tasks:
         task.delete()
+    family_id = user.family_id
     user.family = None
     db.session.add(user)
     db.session.commit()
+    events.publish_family(family_id, 'member-change', user_id=user.id)
     # Generate the response.
     response = jsonify({'user_removed':f'{user.username}'})
     response.status_code = 200
@@ -334,11 +329,12 @@ def remove_family_member():
 @api.route('/auth/makeLeader', methods=['POST'])
 @leader_required
 def make_leader():
-    id = ast.literal_eval(request.json.get('body'))['id']
+    id = request_body(USER_ID_BODY)['id']
     user = User.query.get_or_404(id)
-    user.role = Role.query.filter_by(name='Leader').first()
+    user.role = Role.named('Leader')
     db.session.add(user)
     db.session.commit()
+    events.publish_family(user.family_id, 'member-change', user_id=user.id)
     # Generate the response.
     response = jsonify({'increased_privileges':f'{user.username}'})
     response.status_code = 200
@@ -351,11 +347,12 @@ def make_leader():
 @api.route('/auth/unmakeLeader', methods=['POST'])
 @leader_required
 def unmake_leader():
-    id = ast.literal_eval(request.json.get('body'))['id']
+    id = request_body(USER_ID_BODY)['id']
     user = User.query.get_or_404(id)
-    user.role = Role.query.filter_by(name='User').first()
+    user.role = Role.named('User')
     db.session.add(user)
     db.session.commit()
+    events.publish_family(user.family_id, 'member-change', user_id=user.id)
     # Generate the response.
     response = jsonify({'reduced_privileges':f'{user.username}'})
     response.status_code = 200
@@ -367,7 +364,7 @@ def unmake_leader():
 @api.route('/auth/changeEmailRequest', methods=['POST'])
 @login_required
 def send_change_email_request():
-    email = ast.literal_eval(request.json.get('body'))['email']
+    email = request_body(EMAIL_BODY)['email']
     if email:
         # Send email and generate the response.
         token = g.current_user.generate_email_token(email)
@@ -378,6 +375,7 @@ def send_change_email_request():
             user=g.current_user,
             token=token
             )
+        db.session.commit()
         response = jsonify({'message':'email sent'})
         response.status_code = 200
         return response
@@ -392,14 +390,9 @@ def send_change_email_request():
 # Response code 200 sent for successful update.
 @api.route('/auth/confirmChangeEmail/<token>', methods=['POST'])
 def confirm_change_email(token):
-    s = Serializer(
-        current_app._get_current_object().config['SECRET_KEY'],
-        expires_in=600)
-
     # Validate the token.
-    try:
-        data = s.loads(token.encode('utf-8'))
-    except:
+    data = tokens.verify('email', token)
+    if data is None:
         response = jsonify({'errMessage':'Invalid token.'})
         response.status_code = 401
         return response
@@ -427,14 +420,14 @@ def confirm_change_email(token):
 @api.route('/auth/createFamily', methods=['POST'])
 @login_required
 def create_family():
-    family_name = ast.literal_eval(request.json.get('body'))['familyName']
+    family_name = request_body(FAMILY_BODY)['familyName']
     if family_name:
         # Create new family, and assign current_user as the leader.
         fam = Family(family_name=family_name)
         db.session.add(fam)
         db.session.commit()
         g.current_user.family_id = fam.id
-        g.current_user.role = Role.query.filter_by(name='Leader').first()
+        g.current_user.role = Role.named('Leader')
         db.session.add(g.current_user)
         db.session.commit()
         response = jsonify({'message':'Successful family creation.'})
@@ -452,13 +445,16 @@ def create_family():
 @api.route('/auth/changePassword', methods = ['POST'])
 @login_required
 def change_password():
-    oldPass = ast.literal_eval(request.json.get('body'))['oldPass']
+    body = request_body(PASSWORD_BODY)
+    oldPass = body['oldPass']
     if g.current_user.verify_password(oldPass):
         # Update user's password, and generate the response.
-        g.current_user.password = ast.literal_eval(request.json.get('body'))['newPass']
+        # The change revokes the user's auth tokens, so a new one is sent.
+        g.current_user.password = body['newPass']
         db.session.add(g.current_user)
         db.session.commit()
-        response = jsonify({'message':'Successful password change.'})
+        response = jsonify({'message':'Successful password change.',
+                            'token':g.current_user.generate_auth_token()})
         response.status_code = 200
         return response
     else:
@@ -469,10 +465,33 @@ def change_password():
 
 # Function to run before auth routes.
 # This will set g for the current request.
+# The token is read from an "Authorization: Bearer" header when one is sent,
+#   and the body is only parsed for clients using the legacy auth field.
+# Bodies which are not a JSON object leave the request anonymous.
 @api.before_request
 def before_request():
-    user = User.verify_auth_token(request.get_json()['auth']['email_or_token'])
+    token = bearer_token()
+    if token is None:
+        payload = request.get_json(silent=True)
+        auth = payload.get('auth') if isinstance(payload, dict) else None
+        token = auth.get('email_or_token') if isinstance(auth, dict) else None
+    user = User.verify_auth_token(token)
     if user:
         g.current_user = user
     else:
         g.current_user = None
+
+
+# Responses depend on the Authorization header, so caches must key on it.
+@api.after_request
+def after_request(response):
+    response.vary.add('Authorization')
+    return response
+
+
+# Returns the token of an "Authorization: Bearer" header, or None.
+def bearer_token():
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() == 'bearer' and token.strip():
+        return token.strip()
+    return None
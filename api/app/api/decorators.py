@@ -1,9 +1,15 @@
+import hashlib
+from datetime import date
 from functools import wraps
-from flask import g, jsonify
+from flask import g, request, current_app
+from ..encoding import jsonify
+from .. import db
 from .errors import forbidden
 from ..models import User, Family, Role, Permission
 
 # Decorator to determine user permissions.
+# The user's role is resolved from the role registry, so the check does not
+#   query the db.
 def permission_required(permission):
     def decorator(f):
         @wraps(f)
@@ -41,3 +47,34 @@ def login_required_dec(login):
 
 def login_required(f):
     return login_required_dec('nothing')(f)
+
+
+# This decorator will answer conditional requests for family resources.
+# The ETag is built from the family version, which every write to the family's
+#   tasks or members increments, so a matching If-None-Match header is answered
+#   with a 304 before any tasks are loaded.
+# The date is included since the overdue flags change daily.
+def family_etag(scope):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            user = g.current_user
+            if user is None or user.family_id is None:
+                return f(*args, **kwargs)
+            version = db.session.query(Family.version)\
+                    .filter_by(id=user.family_id).scalar()
+            etag = hashlib.sha1(
+                f'{scope}:{user.family_id}:{version}:{user.id}:{user.role_id}:'
+                f'{date.today().isoformat()}:'.encode('utf-8')
+                + request.query_string).hexdigest()
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = f(*args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return decorated_function
+    return decorator
@@ -1,5 +1,13 @@
-from flask import jsonify
+from ..encoding import jsonify
 from . import api
+from ..exceptions import ValidationError
+
+
+# Error out for malformed requests.
+def bad_request(message):
+    response = jsonify({'error':'bad request','message':message})
+    response.status_code = 400
+    return response
 
 
 # Error out for insufficient permissions.
@@ -7,3 +15,9 @@ def forbidden(message):
     response = jsonify({'error':'forbidden','message':message})
     response.status_code = 403
     return response
+
+
+# Return a bad request for validation errors raised by the models.
+@api.errorhandler(ValidationError)
+def validation_error(e):
+    return bad_request(e.args[0])
@@ -0,0 +1,75 @@
+import ast
+import json
+from flask import request, current_app
+from ..exceptions import ValidationError
+
+
+# This is the shape expected of a request body, given as the type or types
+#   of each field, where None allows a null.
+# Fields are required unless named in optional, and fields not in the schema
+#   are passed through unchecked.
+# The field checks are built once, when the schema is defined with its route.
+class Schema:
+
+    def __init__(self, optional=(), **fields):
+        self.fields = tuple((name, field_types(types), name not in optional)
+                            for name, types in fields.items())
+
+    # Return the body if it matches the schema, or raise a ValidationError.
+    def validate(self, body):
+        if not isinstance(body, dict):
+            raise ValidationError('Request body must be an object.')
+        for name, types, required in self.fields:
+            if name not in body:
+                if required:
+                    raise ValidationError(f'Missing {name}.')
+            elif not isinstance(body[name], types) or \
+                    (isinstance(body[name], bool) and bool not in types):
+                raise ValidationError(f'Invalid {name}.')
+        return body
+
+
+# This returns the types accepted for a schema field as a tuple.
+# Integers are not accepted as bools, or bools as integers.
+def field_types(types):
+    if not isinstance(types, tuple):
+        types = (types,)
+    return tuple(type(None) if t is None else t for t in types)
+
+
+# This returns the body of the request validated against the schema.
+# The body is the JSON object of the request, or the body field of that
+#   object for clients which wrap it alongside their auth.
+# The body is decoded once per request, however many times it is read.
+def request_body(schema):
+    if not hasattr(request, 'decoded_body'):
+        payload = request.get_json(silent=True) or {}
+        if isinstance(payload, dict):
+            payload = payload.get('body', payload)
+        request.decoded_body = decode_body(payload)
+    return schema.validate(request.decoded_body)
+
+
+# This decodes a request body, which clients send as a JSON object.
+# Legacy clients send the body as a string instead, holding JSON or a python
+#   literal, which is decoded as JSON when possible.
+def decode_body(body):
+    if isinstance(body, str):
+        return decode_literal(body)
+    return body
+
+
+# This decodes a string of JSON or a python literal.
+# Python literals are limited to LEGACY_BODY_MAX_LENGTH characters, since
+#   parsing large crafted literals is slow.
+def decode_literal(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        pass
+    if len(value) > current_app.config['LEGACY_BODY_MAX_LENGTH']:
+        raise ValidationError('Request body is too large.')
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError):
+        raise ValidationError('Request body is malformed.')
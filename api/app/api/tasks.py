@@ -1,44 +1,154 @@
-from flask import jsonify, g, url_for, current_app, request
-import ast # This will be used to turn a string literl into a usable list
-from .. import db
+from flask import g, url_for, current_app, request, Response
+from ..encoding import jsonify
+from .. import db, events
 from . import api
-from ..models import Task, Subtask
-import json
+from ..models import User, Task, Subtask, task_family_id
+from ..exceptions import ValidationError
 from .decorators import permission_required, leader_required, \
-        login_required
+        login_required, family_etag
+from .schemas import Schema, request_body, decode_literal
+
+
+# The request bodies of the routes below.
+# Subtask names may be sent as a list, or a string of one.
+TASK_BODY = Schema(subtasks=(list, str))
+TASKS_BULK_BODY = Schema(tasks=list)
+SUBTASKS_COMPLETE_BODY = Schema(subtasks=list)
+SUBTASK_BODY = Schema(subtask_name=str)
+
+
+# This function will return the subtask names sent for a new task, or None
+#   unless they are a list of 1 to 5 non-empty strings.
+def subtask_names(names):
+    if isinstance(names, str):
+        try:
+            names = decode_literal(names)
+        except ValidationError:
+            return None
+    if not isinstance(names, list) or not 0 < len(names) <= 5 \
+            or not all(isinstance(name, str) and name for name in names):
+        return None
+    return names
 
 
 # Route to get a user's tasks and family's tasks.
+# Subtasks and assignees are loaded in bulk, so the number of queries does not
+#   grow with the number of tasks.
+# Response code 304 is sent if the family has not changed since the ETag.
+# Lists are paginated when per_page, tasks_cursor or family_cursor is provided,
+#   and the cursors for the following pages are returned.
 @api.route('/getTasks', methods=['GET', 'POST'])
 @login_required
+@family_etag('tasks')
 def get_tasks():
-    tasks = g.current_user.tasks.order_by(Task.next_due.asc()).all()
+    if not {'per_page', 'tasks_cursor', 'family_cursor'} & set(request.args):
+        if g.current_user.family:
+            family_tasks = g.current_user.family.get_family_tasks_json()
+        else:
+            family_tasks = []
+        response = jsonify({
+            'tasks':g.current_user.get_tasks_json(),
+            'familyTasks':family_tasks
+            })
+        response.status_code = 200
+        return response
+
+    per_page = request.args.get('per_page',
+            current_app.config['TASKS_PER_PAGE'], type=int)
+    per_page = max(1, min(per_page, current_app.config['TASKS_MAX_PER_PAGE']))
+    tasks, tasks_cursor = Task.keyset_page(g.current_user.tasks,
+            request.args.get('tasks_cursor'), per_page)
     if g.current_user.family:
-        family_tasks = [task.to_json() for task in g.current_user.family.get_family_tasks()]
+        family_tasks, family_cursor = Task.keyset_page(
+                g.current_user.family.family_tasks_query(),
+                request.args.get('family_cursor'), per_page)
     else:
-        family_tasks = []
+        family_tasks, family_cursor = [], None
     response = jsonify({
-        'tasks':[task.to_json() for task in tasks],
-        'familyTasks':family_tasks
+        'tasks':Task.list_to_json(tasks),
+        'tasksCursor':tasks_cursor,
+        'familyTasks':Task.list_to_json(family_tasks),
+        'familyTasksCursor':family_cursor
         })
     response.status_code = 200
     return response
 
 
+# Route to get the family task changes since a sync cursor.
+# The cursor is the family version returned by the previous call, so an idle
+#   client is answered from the family row alone.
+# A missing or stale cursor, or one older than the family's pruned tombstones,
+#   returns every family task with its subtasks and reset set, and the client
+#   should replace its copy.
+@api.route('/tasks/changes', methods=['GET', 'POST'])
+@login_required
+def get_task_changes():
+    family = g.current_user.family
+    if family is None:
+        response = jsonify({'errMessage':'User has no family.'})
+        response.status_code = 400
+        return response
+    since = request.args.get('since', '')
+    family_id, _, version = since.partition('-')
+    reset = family_id != str(family.id) or not version.isdigit() \
+            or not family.pruned_version <= int(version) <= family.version
+    version = None if reset else int(version)
+
+    cursor = f'{family.id}-{family.version}'
+    if version == family.version:
+        tasks, subtasks, tombstones = [], [], []
+    else:
+        tasks, subtasks, tombstones = family.get_changes_since(version)
+    response = jsonify({
+        'cursor':cursor,
+        'reset':reset,
+        'tasks':Task.list_to_json(tasks),
+        'subtasks':[subtask.to_fragment() for subtask in subtasks],
+        'deletedTasks':[t.object_id for t in tombstones if t.kind == 'tasks'],
+        'deletedSubtasks':[t.object_id for t in tombstones if t.kind == 'subtasks']
+        })
+    response.status_code = 200
+    return response
+
+
+# Route to stream the family's task changes as server-sent events.
+# Browsers cannot set a body or headers on an EventSource, so the token may be
+#   provided as a query parameter.
+@api.route('/tasks/stream', methods=['GET'])
+def stream_tasks():
+    if g.current_user is None and request.args.get('token'):
+        g.current_user = User.verify_auth_token(request.args.get('token'))
+    if g.current_user is None:
+        response = jsonify({'message':'Unauthorized'})
+        response.status_code = 401
+        return response
+    if g.current_user.family_id is None:
+        response = jsonify({'errMessage':'User has no family.'})
+        response.status_code = 400
+        return response
+    return Response(events.stream_family(g.current_user.family_id),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control':'no-cache',
+                             'X-Accel-Buffering':'no'})
+
+
 # Route to create a new task.
 # Task is created first, then subtasks are created.
+# Response code 400 is sent if the subtasks are not a list of at most 5 names.
 @api.route('/tasks', methods=['POST'])
 @leader_required
 def new_task():
-    t_json = ast.literal_eval(request.json.get('body'))
+    t_json = request_body(TASK_BODY)
     task = Task.from_json(t_json)
-    if task:
+    names = subtask_names(t_json['subtasks'])
+    if task and names is not None:
         db.session.add(task)
         db.session.commit()
-        for subtask in ast.literal_eval(t_json['subtasks']):
+        for subtask in names:
             st = Subtask.from_json(subtask, task.id)
             db.session.add(st)
         db.session.commit()
+        events.publish_family(task_family_id(task), 'task-created', task_id=task.id)
         response = jsonify({'message':'Task added.'})
         response.status_code = 201
         return response
@@ -48,6 +158,67 @@ def new_task():
         return response
 
 
+# Route to create a batch of tasks with their subtasks.
+# The tasks are inserted in one flush and the subtasks in one bulk insert,
+#   committed as a single transaction.
+# Response code 400 is sent, and nothing is created, if any task fails
+#   validation.
+@api.route('/tasks/bulk', methods=['POST'])
+@leader_required
+def new_tasks_bulk():
+    try:
+        tasks_json = request_body(TASKS_BULK_BODY)['tasks']
+    except ValidationError:
+        response = jsonify({'errMessage':'Failed task generation.'})
+        response.status_code = 400
+        return response
+    if not 0 < len(tasks_json) <= current_app.config['TASKS_BULK_LIMIT']:
+        response = jsonify({'errMessage':'Failed task generation.'})
+        response.status_code = 400
+        return response
+
+    # Validate every task before writing anything.
+    tasks = []
+    task_subtasks = []
+    for index, t_json in enumerate(tasks_json):
+        task = Task.from_json(t_json) if isinstance(t_json, dict) else None
+        names = subtask_names(t_json.get('subtasks')) if task else None
+        if task is None or names is None:
+            response = jsonify({'errMessage':'Failed task generation.',
+                                'index':index})
+            response.status_code = 400
+            return response
+        # The bulk insert below skips the counter listener.
+        task.subtask_count = len(names)
+        tasks.append(task)
+        task_subtasks.append(names)
+
+    db.session.add_all(tasks)
+    db.session.flush()
+    # The flush listeners expire the revisions and families they set, so
+    #   they are read back in one query rather than a query per task.
+    ids = [task.id for task in tasks]
+    stamps = {task_id:(revision, family_id) for task_id, revision, family_id
+              in db.session.query(Task.id, Task.revision, Task.family_id)
+                      .filter(Task.id.in_(ids))}
+    subtasks = []
+    for task_id, names in zip(ids, task_subtasks):
+        for name in names:
+            st = Subtask.from_json(name, task_id)
+            subtasks.append({'subtask_name':st.subtask_name,
+                             'task_id':st.task_id,
+                             'is_complete':False,
+                             'revision':stamps[task_id][0]})
+    db.session.bulk_insert_mappings(Subtask, subtasks)
+    db.session.commit()
+    for task_id in ids:
+        events.publish_family(stamps[task_id][1], 'task-created', task_id=task_id)
+    response = jsonify({'message':'Tasks added.',
+                        'ids':ids})
+    response.status_code = 201
+    return response
+
+
 # Route to mark/unmark a subtask as complete.
 @api.route('/change_subtask_complete/<int:id>', methods=['POST'])
 @login_required
@@ -62,6 +233,65 @@ def change_subtask_complete_subtask(id):
     return response
 
 
+# Route to set the completion of several subtasks in one transaction.
+# The body lists the subtask ids and their desired is_complete states.
+# Task completion is evaluated once per task with a newly completed subtask,
+#   and the updated tasks are returned.
+# Response code 404 is sent if any subtask is not in the user's family, or
+#   for a user without a family, not on one of their own tasks.
+@api.route('/subtasks/complete', methods=['POST'])
+@login_required
+def change_subtasks_complete():
+    try:
+        states = {int(change['id']):bool(change['is_complete'])
+                  for change in request_body(SUBTASKS_COMPLETE_BODY)['subtasks']}
+    except (ValidationError, ValueError, TypeError, KeyError):
+        states = {}
+    if not states or len(states) > current_app.config['TASKS_BULK_LIMIT']:
+        response = jsonify({'errMessage':'Failed subtask update.'})
+        response.status_code = 400
+        return response
+    if g.current_user.family_id is None:
+        owner = Task.assigned_user_id == g.current_user.id
+    else:
+        owner = Task.family_id == g.current_user.family_id
+    subtasks = Subtask.query.join(Task)\
+            .options(db.contains_eager(Subtask.task))\
+            .filter(Subtask.id.in_(states.keys()), owner).all()
+    if len(subtasks) != len(states):
+        response = jsonify({'errMessage':'Subtask not found.'})
+        response.status_code = 404
+        return response
+
+    tasks = {}
+    changed = []
+    completed_task_ids = set()
+    for st in subtasks:
+        tasks[st.task_id] = st.task
+        if st.is_complete != states[st.id]:
+            st.is_complete = states[st.id]
+            changed.append((st.id, st.task_id, st.is_complete))
+            if st.is_complete:
+                completed_task_ids.add(st.task_id)
+    db.session.flush()
+    completed = [tasks[task_id] for task_id in completed_task_ids
+                 if tasks[task_id].completed_count >= tasks[task_id].subtask_count]
+    for task in completed:
+        task.complete(commit=False)
+    db.session.commit()
+
+    for subtask_id, task_id, is_complete in changed:
+        events.publish_family(task_family_id(tasks[task_id]),
+                'subtask-complete' if is_complete else 'subtask-uncomplete',
+                task_id=task_id, subtask_id=subtask_id)
+    for task in completed:
+        task.announce_complete()
+    response = jsonify({'tasks':Task.list_to_json(
+            sorted(tasks.values(), key=lambda t: (t.next_due, t.id)))})
+    response.status_code = 200
+    return response
+
+
 # Route to delete a subtask.
 # Task is checked for completion upon subtask deletion.
 # Response code 400 is sent if attempting to delete the only subtask.
@@ -70,7 +300,7 @@ def change_subtask_complete_subtask(id):
 def delete_subtask(id):
     st = Subtask.query.get_or_404(id)
     t = st.task
-    if len(t.subtasks.all()) >= 2:
+    if t.subtask_count >= 2:
         db.session.delete(st)
         db.session.commit()
         t.determine_complete()
@@ -89,8 +319,8 @@ def delete_subtask(id):
 @leader_required
 def add_subtask(id):
     t = Task.query.get_or_404(id)
-    if len(t.subtasks.all()) < 5:
-        st_json = ast.literal_eval(request.json.get('body'))['subtask_name']
+    if t.subtask_count < 5:
+        st_json = request_body(SUBTASK_BODY)['subtask_name']
         st = Subtask.from_json(st_json, id)
         db.session.add(st)
         db.session.commit()
@@ -1,12 +1,21 @@
 from ..models import User
-from flask import jsonify, url_for
+from flask import g, url_for
+from ..encoding import jsonify
 from . import api
+from .errors import forbidden
+from .decorators import login_required
 
 
 # Route to return a users information.
-@api.route('/users/<int:id>', methods=['POST'])
+# Response code 403 is sent unless the user is the current user or in their
+#   family.
+@api.route('/users/<int:id>', methods=['GET', 'POST'])
+@login_required
 def get_user(id):
     user = User.query.get_or_404(id)
+    if user.id != g.current_user.id and (g.current_user.family_id is None
+            or user.family_id != g.current_user.family_id):
+        return forbidden('Insufficient permissions')
     if user:
         response = jsonify(user.to_json())
         response.status_code = 200
@@ -0,0 +1,295 @@
+import hashlib
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import date
+from threading import Lock
+
+
+# This defines the interface for task list cache backends.
+# A shared cache service is supported by registering another backend, which
+#   must implement every method below.
+class CacheBackend(ABC):
+
+    # Return the cached value for a key, or None if it is missing or expired.
+    @abstractmethod
+    def get(self, key):
+        pass
+
+    # Store a value which was measured at size bytes.
+    @abstractmethod
+    def set(self, key, value, size):
+        pass
+
+    # Remove keys from the cache.
+    @abstractmethod
+    def delete(self, *keys):
+        pass
+
+    # Remove every key from the cache.
+    @abstractmethod
+    def clear(self):
+        pass
+
+    # Return the cache counters.
+    @abstractmethod
+    def stats(self):
+        pass
+
+
+# This backend holds values in process memory.
+# Entries expire after ttl seconds, and the least recently used entries are
+#   evicted once either max_entries or max_bytes is exceeded.
+class MemoryCache(CacheBackend):
+
+    def __init__(self, ttl=300, max_entries=1000, max_bytes=32*1024*1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = (value, size, time.monotonic() + self.ttl)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self._remove(key)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits':self.hits,
+                    'misses':self.misses,
+                    'hitRate':self.hits / lookups if lookups else 0.0,
+                    'evictions':self.evictions,
+                    'entries':len(self.entries),
+                    'bytes':self.bytes}
+
+    # Remove a key and its size from the cache, the lock must be held.
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+
+# Backends available to the TASK_CACHE_BACKEND setting.
+backends = {
+    'memory':MemoryCache,
+}
+
+
+# This extension caches the serialized task lists of families and users.
+# Keys are invalidated by the session listeners in models.py once writes to
+#   the tasks they hold are committed.
+class TaskCache:
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = backends[app.config['TASK_CACHE_BACKEND']](
+                ttl=app.config['TASK_CACHE_TTL'],
+                max_entries=app.config['TASK_CACHE_MAX_ENTRIES'],
+                max_bytes=app.config['TASK_CACHE_MAX_BYTES'])
+        app.extensions['task_cache'] = self
+
+    # Return the cached task list for a key, building and storing it on a miss.
+    # Entries are tagged with the date since the overdue flags change daily,
+    #   and with the family version, which must be read before the list is
+    #   built. A list built before a commit but stored after its invalidation
+    #   then misses once the new version is read, instead of being served.
+    # Lists hold the encoded fragments of their tasks, so they are sized
+    #   without encoding them again.
+    def get_or_set(self, key, version, build):
+        today = date.today().isoformat()
+        entry = self.backend.get(key)
+        if entry is not None and entry[:2] == (today, version):
+            return entry[2]
+        value = build()
+        self.backend.set(key, (today, version, value),
+                         sum(len(fragment.encoded) for fragment in value))
+        return value
+
+    # Remove cached task lists.
+    def invalidate(self, keys):
+        if keys:
+            self.backend.delete(*keys)
+
+    def stats(self):
+        return self.backend.stats()
+
+
+# This extension caches the encoded fragments of tasks and subtasks, so list
+#   responses splice in the rows which have not changed.
+# Keys hold the revision of each row along with the other values its json is
+#   built from, so changed rows miss instead of being invalidated.
+class FragmentCache:
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.backend = MemoryCache(
+                ttl=app.config['FRAGMENT_CACHE_TTL'],
+                max_entries=app.config['FRAGMENT_CACHE_MAX_ENTRIES'],
+                max_bytes=app.config['FRAGMENT_CACHE_MAX_BYTES'])
+        app.extensions['fragment_cache'] = self
+
+    # Return the cached fragment for a key, or None on a miss.
+    # A key of None is never cached.
+    def get(self, key):
+        if key is None:
+            return None
+        return self.backend.get(key)
+
+    def set(self, key, fragment):
+        if key is not None:
+            self.backend.set(key, fragment, len(fragment.encoded))
+
+    # Return the cached fragment for a key, building and storing it on a miss.
+    def get_or_build(self, key, build):
+        fragment = self.get(key)
+        if fragment is None:
+            fragment = build()
+            self.set(key, fragment)
+        return fragment
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return self.backend.stats()
+
+
+# This extension caches the identity verified from API auth tokens, so a
+#   repeated token skips both the signature check and the user query.
+# Entries never outlive their token, and are dropped when the user changes by
+#   bumping the user's generation, which is checked on every hit.
+# Generations are held per process, so other workers may serve a changed user
+#   from their own cache until AUTH_CACHE_TTL expires.
+# A generation is kept with the time it was bumped, and dropped once no entry
+#   stored under an older generation can still be cached, which is after the
+#   TTL, and another TTL for verifications in flight when it was bumped.
+class AuthCache:
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.ttl = 60
+        self.generations = {}
+        self.pruned = time.monotonic()
+        self.stale = 0
+        self.lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ttl = app.config['AUTH_CACHE_TTL']
+        self.backend = backends[app.config['AUTH_CACHE_BACKEND']](
+                ttl=self.ttl,
+                max_entries=app.config['AUTH_CACHE_MAX_ENTRIES'],
+                max_bytes=app.config['AUTH_CACHE_MAX_BYTES'])
+        self.generations = {}
+        self.pruned = time.monotonic()
+        self.stale = 0
+        app.extensions['auth_cache'] = self
+
+    # Return the current generation of a user.
+    # It must be read before the user is loaded, so a change committed while
+    #   the user is being verified is not cached.
+    def generation(self, user_id):
+        return self.generations.get(user_id, (0, None))[0]
+
+    # Return the cached identity snapshot for a token, or None.
+    def get(self, token):
+        entry = self.backend.get(token_key(token))
+        if entry is None:
+            return None
+        generation, expires, snapshot = entry
+        if expires <= time.time() or generation != self.generation(snapshot['id']):
+            with self.lock:
+                self.stale += 1
+            return None
+        return snapshot
+
+    # Store the identity snapshot verified for a token, which expires at the
+    #   expires timestamp.
+    def set(self, token, snapshot, expires, generation):
+        self.backend.set(token_key(token), (generation, expires, snapshot),
+                         len(token) + len(json.dumps(snapshot)))
+
+    # Drop the cached identities of users.
+    def invalidate_users(self, user_ids):
+        now = time.monotonic()
+        with self.lock:
+            for user_id in user_ids:
+                self.generations[user_id] = (self.generation(user_id) + 1, now)
+            if now - self.pruned >= self.ttl:
+                self._prune(now)
+
+    # Drop the generations which no cached entry can be checked against, the
+    #   lock must be held.
+    def _prune(self, now):
+        self.generations = {user_id:generation
+                            for user_id, generation in self.generations.items()
+                            if now - generation[1] < 2 * self.ttl}
+        self.pruned = now
+
+    # Drop every cached identity.
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return dict(self.backend.stats(), stale=self.stale,
+                    generations=len(self.generations))
+
+
+# Return the cache key for an auth token.
+def token_key(token):
+    return 'auth:' + hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+# Return the cache key for a family's task list.
+def family_key(family_id):
+    return f'family:{family_id}'
+
+
+# Return the cache key for a user's task list.
+def user_key(user_id):
+    return f'user:{user_id}'
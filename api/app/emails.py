@@ -1,15 +1,5 @@
-from threading import Thread
 from flask import current_app
 from flask import render_template
-from flask_mail import Message
-from . import mail
-
-# Function to send emails asynchronously.
-def send_async_email(app, msg):
-    # Pass the provided app context.
-    with app.app_context():
-        mail.send(msg)
-
 
 def send_email(to, subject, template, **kwargs):
     """
@@ -18,17 +8,12 @@ def send_email(to, subject, template, **kwargs):
         subject is the actual subject of the email,
         and the body is a rendered html file or txt if you're barbarian.
         The kwargs are passed to the html file generation.
+        The email is added to the outbox in the current transaction, and is
+        sent by the outbox workers once it is committed.
     """
+    from .models import OutboxEmail
 
-    app = current_app._get_current_object()
-    msg = Message(app.config['MAIL_PREFIX'] + ' ' + subject,
-                  sender=app.config['MAIL_SENDER'], recipients=[to])
-    msg.body = render_template(template + '.txt', **kwargs)
-    msg.html = render_template(template + '.html', **kwargs)
-
-    # Create the thread to send the message.
-    thr = Thread(target=send_async_email, args=[app, msg])
-
-    # Start the thread.
-    thr.start()
-    return thr
+    return OutboxEmail.queue(to,
+                             current_app.config['MAIL_PREFIX'] + ' ' + subject,
+                             render_template(template + '.txt', **kwargs),
+                             render_template(template + '.html', **kwargs))
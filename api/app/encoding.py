@@ -0,0 +1,119 @@
+from flask import current_app
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# This is a JSON value which holds its own encoding.
+# Encoders splice the encoded bytes into responses instead of serializing the
+#   value again, so a fragment must not be changed once it is built.
+class Fragment(dict):
+
+    def __init__(self, value, encoded):
+        super(Fragment, self).__init__(value)
+        self.encoded = encoded
+
+
+# This encoder uses the standard library, with the Flask conversions for
+#   dates and other types.
+class StdlibEncoder:
+
+    def __init__(self, app):
+        self.encoder = app.json_encoder(separators=(',', ':'),
+                                        ensure_ascii=False,
+                                        check_circular=False,
+                                        sort_keys=app.config['JSON_SORT_KEYS'])
+
+    def encode(self, value):
+        return self.encoder.encode(value).encode('utf-8')
+
+
+# This encoder uses orjson, falling back to the Flask conversions for the
+#   types orjson would format differently.
+class OrjsonEncoder:
+
+    def __init__(self, app):
+        self.default = app.json_encoder().default
+        self.options = orjson.OPT_NON_STR_KEYS | \
+                orjson.OPT_PASSTHROUGH_DATETIME | \
+                orjson.OPT_PASSTHROUGH_DATACLASS
+        if app.config['JSON_SORT_KEYS']:
+            self.options |= orjson.OPT_SORT_KEYS
+
+    def encode(self, value):
+        return orjson.dumps(value, default=self.default, option=self.options)
+
+
+# Encoders available to the JSON_ENCODER setting.
+# 'auto' uses orjson when it is installed.
+encoders = {
+    'json':StdlibEncoder,
+    'orjson':OrjsonEncoder,
+}
+
+
+# This extension encodes the API responses with the configured encoder,
+#   splicing in the bytes of any fragments.
+class ResponseEncoder:
+
+    def __init__(self, app=None):
+        self.encoder = None
+        self.sort_keys = True
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        name = app.config['JSON_ENCODER']
+        if name == 'auto':
+            name = 'json' if orjson is None else 'orjson'
+        self.encoder = encoders[name](app)
+        self.sort_keys = app.config['JSON_SORT_KEYS']
+        app.extensions['response_encoder'] = self
+
+    # Return the encoding of a value.
+    def dumps(self, value):
+        if has_fragments(value):
+            return self.splice(value)
+        return self.encoder.encode(value)
+
+    # Return a fragment of a dict, encoded now to be spliced in later.
+    # The dict must not hold fragments itself.
+    def fragment(self, value):
+        return Fragment(value, self.encoder.encode(value))
+
+    # Encode the containers around fragments, and each of their other items.
+    def splice(self, value):
+        if isinstance(value, Fragment):
+            return value.encoded
+        if isinstance(value, dict):
+            items = sorted(value.items(), key=lambda item: str(item[0])) \
+                    if self.sort_keys else value.items()
+            return b'{' + b','.join(self.encoder.encode(str(key)) + b':'
+                                    + self.splice(item)
+                                    for key, item in items) + b'}'
+        if isinstance(value, (list, tuple)):
+            return b'[' + b','.join(self.splice(item) for item in value) + b']'
+        return self.encoder.encode(value)
+
+
+# Return True if fragments are held anywhere in a value.
+def has_fragments(value):
+    if isinstance(value, Fragment):
+        return True
+    if isinstance(value, dict):
+        value = value.values()
+    elif not isinstance(value, (list, tuple)):
+        return False
+    return any(isinstance(item, (Fragment, dict, list, tuple))
+               and has_fragments(item) for item in value)
+
+
+# Replaces flask.jsonify for the API, encoding with the response encoder.
+def jsonify(*args, **kwargs):
+    if args and kwargs:
+        raise TypeError('jsonify() behavior undefined when passed both args and kwargs')
+    data = args[0] if len(args) == 1 else (args or kwargs)
+    body = current_app.extensions['response_encoder'].dumps(data)
+    return current_app.response_class(body + b'\n',
+            mimetype=current_app.config['JSONIFY_MIMETYPE'])
@@ -0,0 +1,100 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock
+from werkzeug.security import generate_password_hash, check_password_hash, \
+        DEFAULT_PBKDF2_ITERATIONS
+try:
+    from gevent import monkey
+    from gevent.threadpool import ThreadPoolExecutor
+except ImportError:
+    monkey = None
+
+
+# This extension hashes and verifies passwords in a bounded pool of worker
+#   processes, so that bursts of logins and registrations do not hold the
+#   request workers on the CPU.
+# The hash method, such as 'pbkdf2:sha256:150000', and the salt length are
+#   set by PASSWORD_HASH_METHOD and PASSWORD_SALT_LENGTH.
+# PASSWORD_HASH_WORKERS sets the pool size, and 0 hashes on the calling
+#   thread.
+# Under the gevent workers run by the Procfile the pool holds native threads
+#   instead, since waiting on worker processes from a patched process would
+#   stall the hub, and with it every request of the worker. The werkzeug
+#   hashes release the GIL, so the threads still hash in parallel.
+# At most PASSWORD_HASH_QUEUE jobs wait for the pool, and further callers
+#   block until one finishes.
+class PasswordHasher:
+
+    def __init__(self, app=None):
+        self.method = 'pbkdf2:sha256'
+        self.salt_length = 8
+        self.workers = 0
+        self.slots = None
+        self.pool = None
+        self.pool_pid = None
+        self.lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = stored_method(app.config['PASSWORD_HASH_METHOD'])
+        self.salt_length = app.config['PASSWORD_SALT_LENGTH']
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.slots = BoundedSemaphore(
+                self.workers + app.config['PASSWORD_HASH_QUEUE'])
+        app.extensions['password_hasher'] = self
+
+    # Return a hash of the password with the configured method.
+    def hash(self, password):
+        return self.run(generate_password_hash, password, self.method,
+                        self.salt_length)
+
+    # Return True if the password matches the hash.
+    def verify(self, password_hash, password):
+        if not password_hash:
+            return False
+        return self.run(check_password_hash, password_hash, password)
+
+    # Return True if the hash was made with other parameters than the
+    #   configured method, and should be replaced on the next login.
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.method
+
+    # Run a hashing function in the pool, or inline without workers.
+    def run(self, f, *args):
+        if not self.workers:
+            return f(*args)
+        with self.slots:
+            return self.get_pool().submit(f, *args).result()
+
+    # Return the worker pool, starting it on first use in each process so
+    #   that forked servers do not share the parent's workers.
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None or self.pool_pid != os.getpid():
+                if gevent_patched():
+                    self.pool = ThreadPoolExecutor(max_workers=self.workers)
+                else:
+                    self.pool = ProcessPoolExecutor(max_workers=self.workers)
+                self.pool_pid = os.getpid()
+            return self.pool
+
+    # Stop the worker processes.
+    def shutdown(self):
+        with self.lock:
+            if self.pool is not None and self.pool_pid == os.getpid():
+                self.pool.shutdown()
+            self.pool = None
+
+
+# Returns True if gevent has patched the threading module.
+def gevent_patched():
+    return monkey is not None and monkey.is_module_patched('threading')
+
+
+# Returns a hash method as werkzeug records it in the hash, with the default
+#   iterations added to pbkdf2 methods which leave them out.
+def stored_method(method):
+    if method.startswith('pbkdf2:') and method.count(':') == 1:
+        return f'{method}:{DEFAULT_PBKDF2_ITERATIONS}'
+    return method
@@ -1,10 +1,23 @@
-from . import db
+from . import db, events, task_cache, auth_cache, password_hasher, tokens, \
+        fragment_cache, response_encoder, token_revocations, email_outbox
+from .revocation import ALL_USERS
+from .cache import family_key, user_key
+from . import recurrence
 import hashlib
-from datetime import datetime, timedelta
-from werkzeug.security import generate_password_hash, check_password_hash
+import json
+import time
+import uuid
+from collections import namedtuple
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import date, datetime, timedelta
+from types import MappingProxyType
 from flask_login import UserMixin, AnonymousUserMixin
-from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import flag_modified, set_committed_value
 from flask import current_app, request, flash, url_for, g
+from flask_mail import Message
 from .emails import send_email
 
 from app.exceptions import ValidationError
@@ -64,6 +77,56 @@ class Role(db.Model):
             role.default = (role.name == default_role)
             db.session.add(role)
         db.session.commit()
+        Role.load_registry()
+
+    # Return the registry of roles, loading it on first use.
+    # Role changes committed in this process drop the registry. It is also
+    #   loaded again once ROLE_REGISTRY_TTL seconds old, so roles changed by
+    #   other processes, such as the deploy running insert_roles, are picked
+    #   up.
+    @staticmethod
+    def registry():
+        registry = role_registry
+        if registry is None or time.monotonic() - registry.loaded >= \
+                current_app.config['ROLE_REGISTRY_TTL']:
+            return Role.load_registry()
+        return registry
+
+    # Load the roles into a new registry, replacing the current one.
+    # An empty roles table is not kept, so the roles are looked up again
+    #   once they are inserted.
+    @staticmethod
+    def load_registry():
+        global role_registry
+        registry = RoleRegistry(RoleInfo(*row) for row in db.session.query(
+                Role.id, Role.name, Role.default, Role.permissions))
+        role_registry = registry if registry.by_id else None
+        return registry
+
+    # Drop the registry, to be loaded again on next use.
+    @staticmethod
+    def clear_registry():
+        global role_registry
+        role_registry = None
+
+    # Return the role with the name from the registry, in the current
+    #   session without a query, or None if there is no such role.
+    @staticmethod
+    def named(name):
+        return Role.attach(Role.registry().by_name.get(name))
+
+    # Return the default role from the registry.
+    @staticmethod
+    def default_role():
+        return Role.attach(Role.registry().default)
+
+    # Return the role of a registry entry in the current session.
+    @staticmethod
+    def attach(info):
+        if info is None:
+            return None
+        return db.session.merge(detached_instance(Role, info._asdict()),
+                                load=False)
 
     # Add a permission to a role.
     def add_permission(self,perm):
@@ -88,9 +151,34 @@ class Role(db.Model):
         return '<Role %r>' % self.name
 
 
+# An immutable copy of a role kept in the registry.
+class RoleInfo(namedtuple('RoleInfo', 'id name default permissions')):
+
+    # Use bitwise to determine if the role has a specific permission.
+    def has_permission(self,perm):
+        return self.permissions & perm == perm
+
+
+# The roles by name and id, as loaded by Role.load_registry().
+class RoleRegistry:
+
+    def __init__(self, roles):
+        roles = tuple(roles)
+        self.by_name = MappingProxyType({role.name:role for role in roles})
+        self.by_id = MappingProxyType({role.id:role for role in roles})
+        self.default = next((role for role in roles if role.default), None)
+        self.loaded = time.monotonic()
+
+
+# The registry shared by every request of the process.
+role_registry = None
+
+
 # Create a user class.
 class User(UserMixin,db.Model):
     __tablename__ = 'users'
+    __table_args__ = (db.Index('ix_users_family_id_role_id',
+                               'family_id', 'role_id'),)
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(64), unique=True, index=True)
     username = db.Column(db.String(64), unique=True, index=True)
@@ -106,50 +194,56 @@ class User(UserMixin,db.Model):
         super(User,self).__init__(**kwargs)
         if self.role is None:
             if self.email == current_app.config['APP_ADMIN']:
-                self.role = Role.query.filter_by(name='Administrator').first()
+                self.role = Role.named('Administrator')
             else:
-                self.role = Role.query.filter_by(default=True).first()
+                self.role = Role.default_role()
 
     # Detemine if a user has a specific permission.
+    # The role is read from the registry unless it is already loaded or was
+    #   just assigned, so checks do not query the db.
     def can(self,perm):
-        return self.role is not None and self.role.has_permission(perm)
+        if 'role' in self.__dict__:
+            role = self.role
+        else:
+            role = Role.registry().by_id.get(self.role_id)
+        return role is not None and role.has_permission(perm)
 
     # Determine if the user is an administrator.
     def is_administrator(self):
-        return self.role.has_permission(Permission.ADMIN)
+        return self.can(Permission.ADMIN)
 
     # This creates the password property, which cannot be interacted with.
     @property
     def password(self):
         raise AttributeError('Password cannot be read.')
 
-    # This function sets the password_hash once a password is set, using werkzeug.
+    # This function sets the password_hash once a password is set, using the
+    #   configured method in the password hashing pool.
     @password.setter
     def password(self,password):
-        self.password_hash=generate_password_hash(password)
+        self.password_hash=password_hasher.hash(password)
 
     # This function verifies password input.
     def verify_password(self,password):
-        return check_password_hash(self.password_hash,password)
+        return password_hasher.verify(self.password_hash,password)
 
     # Provide a confirmation token for user email confirmation.
     def generate_confirmation_token(self,expires_in=300):
-        s = Serializer(current_app.config['SECRET_KEY'],expires_in)
-        return s.dumps({'confirm':self.id}).decode('utf-8')
+        return tokens.issue('confirm', {'confirm':self.id}, expires_in)
+
+    # Provide a token for a user password reset.
+    def generate_reset_token(self,expires_in=300):
+        return tokens.issue('reset', {'confirm':self.id}, expires_in)
 
     # Provide a confirmation token to verify a user email change.
     def generate_email_token(self, email, expires_in=600):
-        s = Serializer(current_app.config['SECRET_KEY'],expires_in)
-        return s.dumps({'email':email,'id':self.id}).decode('utf-8')
+        return tokens.issue('email', {'email':email,'id':self.id}, expires_in)
 
     # Confirm the email token, and update the db with the user.
     def confirm_email(self,token):
-        s = Serializer(current_app.config['SECRET_KEY'])
-
         # Reject invalid or expired tokens.
-        try:
-            data=s.loads(token.encode('utf-8'))
-        except:
+        data = tokens.verify('email', token)
+        if data is None:
             return False,'Code invalid or expired.'
 
         # Ensures the email address is still available.
@@ -168,32 +262,123 @@ class User(UserMixin,db.Model):
 
 
     # Provide an auth token for api clients.
+    # The token carries the user's role, permissions and family as claims, so
+    #   it is authorized without querying the db.
     def generate_auth_token(self, expires_in=86400):
-        s = Serializer(current_app.config['SECRET_KEY'], expires_in=expires_in)
-        return s.dumps({'id':self.id}).decode('utf-8')
+        if 'role' in self.__dict__:
+            role = self.role
+        else:
+            role = Role.registry().by_id.get(self.role_id)
+        return tokens.issue('auth', {'id':self.id,
+                                     'role_id':role.id if role else self.role_id,
+                                     'permissions':role.permissions if role else 0,
+                                     'family_id':self.family_id,
+                                     'issued':time.time()}, expires_in)
 
     # Generate a token to send to an email requesting to join their family.
     def generate_join_request_token(self,leader_id,expires_in=3600):
-        s = Serializer(current_app.config['SECRET_KEY'], expires_in=expires_in)
-        return s.dumps({'joiner_id':self.id,'leader_id':leader_id}).decode('utf-8')
+        return tokens.issue('join', {'joiner_id':self.id,'leader_id':leader_id},
+                            expires_in)
 
     # Verify an api clients token, and provide a user if valid.
+    # The user is built from the token claims without querying the db, and
+    #   verified tokens are kept in the auth cache, so a cached token is
+    #   answered without a signature check either.
+    # Tokens issued before their user was revoked are refused, and the user
+    #   is loaded from the db once if their role or family changed since.
     @staticmethod
     def verify_auth_token(token):
-        s = Serializer(current_app.config['SECRET_KEY'], expires_in=86400)
-        try:
-            data = s.loads(token) #RESERVED, why not .encode('utf-8')?
-        except:
+        if not token:
             return None
-        return User.query.get(data['id'])
+        snapshot = auth_cache.get(token)
+        if snapshot is None:
+            verified = tokens.verify('auth', token, return_header=True)
+            # Tokens issued before claims were added are refused.
+            if verified is None or 'issued' not in verified[0]:
+                return None
+            claims, header = verified
+            snapshot = User.claims_snapshot(claims, header['exp'])
+            auth_cache.set(token, snapshot, header['exp'],
+                           auth_cache.generation(claims['id']))
+        user_id, meta = snapshot['id'], snapshot['token']
+        if token_revocations.is_revoked(user_id, meta['issued']):
+            return None
+        if token_revocations.is_stale(user_id, meta['as_of']):
+            as_of = time.time()
+            generation = auth_cache.generation(user_id)
+            user = User.query.get(user_id)
+            if user is not None:
+                auth_cache.set(token, user.auth_snapshot(dict(meta, as_of=as_of)),
+                               meta['expires'], generation)
+            return user
+        return User.from_auth_snapshot(snapshot)
+
+    # This returns the identity, role and family of the user cached for their
+    #   auth tokens, with the token meta of when it was issued, when the
+    #   identity was read and when it expires.
+    def auth_snapshot(self, meta):
+        role = self.role
+        return {'id':self.id,
+                'email':self.email,
+                'username':self.username,
+                'confirmed':self.confirmed,
+                'role_id':self.role_id,
+                'family_id':self.family_id,
+                'role':{'id':role.id,
+                        'name':role.name,
+                        'default':role.default,
+                        'permissions':role.permissions} if role else None,
+                'token':meta}
+
+    # This returns the auth snapshot of a token's claims.
+    # The role name is read from the registry, and the user's other attributes
+    #   are loaded from the db if they are used.
+    @staticmethod
+    def claims_snapshot(claims, expires):
+        role_id = claims['role_id']
+        role = None
+        if role_id is not None:
+            role = {'id':role_id, 'permissions':claims['permissions']}
+            info = Role.registry().by_id.get(role_id)
+            if info is not None:
+                role.update(name=info.name, default=info.default)
+        return {'id':claims['id'],
+                'role_id':role_id,
+                'family_id':claims['family_id'],
+                'role':role,
+                'token':{'issued':claims['issued'],
+                         'as_of':claims['issued'],
+                         'expires':expires}}
+
+    # This rebuilds a user from an auth snapshot without querying the db.
+    # Attributes left out of the snapshot, such as the password hash, are
+    #   loaded from the db if they are used.
+    @staticmethod
+    def from_auth_snapshot(snapshot):
+        fields = dict(snapshot)
+        role = fields.pop('role')
+        fields.pop('token')
+        user = detached_instance(User, fields)
+        set_committed_value(user, 'role',
+                            detached_instance(Role, role) if role else None)
+        return db.session.merge(user, load=False)
 
     # This is the function used to confirm a user's credentials provided from
     #   the front end request.
     # Returns a user if validated, and None if incorrect.
+    # Hashes made with an older method or cost are replaced on a successful
+    #   login, while the password is at hand.
+    # The hash is replaced with a bulk update, which the session listeners do
+    #   not see, so the user's other auth tokens are not revoked.
     @staticmethod
     def verify_api_credentials(u_email, p_word):
         user = User.query.filter_by(email=u_email).first()
         if user and user.verify_password(p_word):
+            if password_hasher.needs_rehash(user.password_hash):
+                User.query.filter_by(id=user.id).update(
+                        {'password_hash':password_hasher.hash(p_word)},
+                        synchronize_session='evaluate')
+                db.session.commit()
             return user
         else:
             return None
@@ -203,13 +388,9 @@ class User(UserMixin,db.Model):
     # This will return a user
     @staticmethod
     def verify_api_token(token):
-        s = Serializer(
-        current_app._get_current_object().config['SECRET_KEY'])
-
         # Validate the provided token.
-        try:
-            data = s.loads(token.encode('utf-8'))
-        except:
+        data = tokens.verify('auth', token)
+        if data is None:
             return None
 
         # Troubleshooting aid.
@@ -218,6 +399,18 @@ class User(UserMixin,db.Model):
         # Return the user object.
         return User.query.get(data['user_id'])
 
+    # This function will return the serialized tasks assigned to the user,
+    #   from the task cache when available.
+    # Users without a family have no version to tag the entry with, so their
+    #   tasks are always read from the database.
+    def get_tasks_json(self):
+        build = lambda: Task.list_to_json(
+                self.tasks.order_by(Task.next_due.asc()).all())
+        if self.family is None:
+            return build()
+        return task_cache.get_or_set(user_key(self.id), self.family.version,
+                                     build)
+
     # This function will serialize json information is stored for the user.
     def to_json(self):
         json_user = {
@@ -244,97 +437,128 @@ class User(UserMixin,db.Model):
 # Create a task class
 class Task(db.Model):
     __tablename__='tasks'
+    __table_args__ = (
+        db.Index('ix_tasks_next_due_id', 'next_due', 'id'),
+        db.Index('ix_tasks_assigned_user_id_next_due_id',
+                 'assigned_user_id', 'next_due', 'id'),
+        db.Index('ix_tasks_family_id_next_due_id',
+                 'family_id', 'next_due', 'id'))
 
     id = db.Column(db.Integer,primary_key=True)
     taskname = db.Column(db.String(64))
     period = db.Column(db.String(7))
     assigned_user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    # Family of the assigned user, maintained by the flush listeners below.
+    family_id = db.Column(db.Integer, db.ForeignKey('families.id'))
     next_due = db.Column(db.DateTime())
     subtasks = db.relationship('Subtask', backref='task',lazy='dynamic')
+    # Family version of the last change to the task, or 0 before it was
+    #   changed in a family.
+    revision = db.Column(db.Integer, index=True, nullable=False, default=0,
+                         server_default='0')
+    # Counts of the task's subtasks, maintained by the flush listener below.
+    subtask_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    completed_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     # This establishes the due date based on when the task is assigned.
     # Midnight is assigned as the due time to aid in determining overdue tasks.
-    def __init__(self,
-                 today=datetime.today().replace(hour=23,minute=59,second=59),
-                 **kwargs):
+    def __init__(self, today=None, **kwargs):
         super(Task,self).__init__(**kwargs)
-        #today = datetime.today()
-        if self.period == "d":
-            self.next_due = today
-        elif self.period == "w":
-            weekday = 5 #due on saturdays
-            if today.weekday() == weekday:
-                self.next_due = today
-            elif today.weekday() < weekday:
-                self.next_due = today + timedelta(days = weekday - today.weekday())
-            else:
-                self.next_due = today + timedelta(days = (weekday + 7) - today.weekday())
-        elif self.period == "m":
-            if today.day == 1:
-                self.next_due = today
-            else:
-                if today.month == 12:
-                    self.next_due = today.replace(month = 1, year = today.year+1, day=1)
-                else:
-                    self.next_due = today.replace(month = today.month + 1, day = 1)
+        today = today or end_of_today()
+        if self.period is not None:
+            self.next_due = recurrence.first_due(self.period, today)
 
     # This function will update the completion date when a task is marked complete
     #   by completing all of its subtasks.
     # It retains the current due date for instances of reopening.
-    def update_next_due(self,
-                        today=datetime.today().replace(hour=23,minute=59,second=59, microsecond=0)):
-        if self.period == 'd':
-            self.next_due = today + timedelta(days=1)
-        elif self.period == 'w':
-            while self.next_due < today \
-                    or (self.next_due - today) < timedelta(days=7):
-                self.next_due = self.next_due + timedelta(days=7)
-        elif self.period == "m":
-            while ((self.next_due.year * 12 + self.next_due.month) \
-                  -(today.year * 12 + today.month)) <= 1:
-                self.add_month_to_due_date()
+    # The change is left uncommitted in the session when commit is False.
+    def update_next_due(self, today=None, commit=True):
+        today = today or end_of_today()
+        self.next_due = recurrence.next_due(self.period, self.next_due, today)
         db.session.add(self)
-        db.session.commit()
-
-    # Helper function to iterate a monthly task's due date.
-    def add_month_to_due_date(self):
-        if self.next_due.month == 2 and self.next_due.year % 4 == 0:
-            self.next_due += timedelta(days=29)
-            return
-        months_days = {1:31,2:28,3:31,4:30,5:31,6:30,7:31,8:31,9:30,10:31,11:30,12:31}
-        self.next_due += timedelta(months_days[self.next_due.month])
-
+        if commit:
+            db.session.commit()
 
     # This function will determine if all subtasks under a task are complete.
-    def determine_complete(self):
-        for subtask in self.subtasks:
-            if not subtask.is_complete:
-                return
-        self.complete()
+    # Returns True if the task was completed.
+    def determine_complete(self, commit=True):
+        if self.completed_count < self.subtask_count:
+            return False
+        self.complete(commit=commit)
+        return True
+
+    # This function will recompute the subtask counters of every task from the
+    #   subtasks table, batch_size tasks per transaction.
+    # Returns the number of tasks whose counters were wrong.
+    @staticmethod
+    def repair_counts(batch_size=1000):
+        subtasks = Subtask.__table__
+        subtask_count = db.select([db.func.count(subtasks.c.id)])\
+                .where(subtasks.c.task_id == Task.id).as_scalar()
+        completed_count = db.select([db.func.count(subtasks.c.id)])\
+                .where(db.and_(subtasks.c.task_id == Task.id,
+                               subtasks.c.is_complete == True)).as_scalar()
+        repaired = 0
+        last_id = 0
+        max_id = db.session.query(db.func.max(Task.id)).scalar() or 0
+        while last_id < max_id:
+            repaired += Task.query.filter(Task.id > last_id,
+                                          Task.id <= last_id + batch_size,
+                                          db.or_(Task.subtask_count != subtask_count,
+                                                 Task.completed_count != completed_count))\
+                    .update({Task.subtask_count:subtask_count,
+                             Task.completed_count:completed_count},
+                            synchronize_session=False)
+            db.session.commit()
+            last_id += batch_size
+        return repaired
 
     # This function is provided to remove a task and all of its subtasks from
     #   the db.
     # An associated function is not provided for subtasks since they are
     #   able to be deleted one by one.
     def delete(self):
+        family_id = task_family_id(self)
         for subtask in self.subtasks:
             db.session.delete(subtask)
         db.session.delete(self)
         db.session.commit()
+        events.publish_family(family_id, 'task-deleted', task_id=self.id)
 
     # This will do all the actions required to complete a task.
     # It will also send an email to the leaders in the family that
     #   the task has been complete.
-    def complete(self):
-        for subtask in self.subtasks:
-            subtask.is_complete = False
-            db.session.add(subtask)
+    # The subtasks are reset with a single UPDATE and committed together with
+    #   the new due date, and the leaders are only emailed after the commit.
+    # When commit is False the changes are left in the session, and the caller
+    #   must call announce_complete() once they are committed.
+    def complete(self, commit=True):
+        TaskCompletion.record(self)
+        self.update_next_due(commit=False)
+        # Flush the task even if the due date is unchanged, so the completion
+        #   bumps the family version and stamps the task revision.
+        flag_modified(self, 'next_due')
+        self.completed_count = 0
+        db.session.flush()
+        # Bulk updates skip the flush listeners, so the subtasks are stamped
+        #   with the task's new revision here, and the counter is reset above.
+        Subtask.query.filter_by(task_id=self.id).update(
+                {Subtask.is_complete:False, Subtask.revision:self.revision},
+                synchronize_session='evaluate')
+        if commit:
             db.session.commit()
-        self.update_next_due()
+            self.announce_complete()
+
+    # This will publish the completion of a task to the family, and email the
+    #   family leaders.
+    def announce_complete(self):
+        events.publish_family(task_family_id(self), 'task-complete', task_id=self.id)
         st = self
-        leader = Role.query.filter_by(name='Leader').first()
+        leader = Role.named('Leader')
         # Send the email to the leader, and flash a message unless in testing.
-        # Testing mode does not allow for threading or flash.
+        # Testing mode does not allow for flash.
+        # The emails are queued in the outbox after the completion commits,
+        #   so the completion is kept if they cannot be rendered.
         if current_app.config['TESTING']:
             pass
         else:
@@ -348,25 +572,115 @@ class Task(db.Model):
                     user = self.assigned_user,
                     task = self
                     )
+            db.session.commit()
 
     # This will return json data for the subject post.
-    def to_json(self):
+    # Preloaded subtasks may be provided to avoid the lazy subtask query, and
+    #   the current time to avoid reading the clock for each task of a list.
+    def to_json(self, subtasks=None, now=None):
+        if subtasks is None:
+            subtasks = self.subtasks
         json_task = {
             'id':self.id,
             'taskname':self.taskname,
             'next_due':self.next_due.strftime('%x'),
-            'subtasks':[subtask.to_json() for subtask in self.subtasks],
+            'subtasks':[subtask.to_json() for subtask in subtasks],
             'assignee':self.assigned_user.username,
-            'overdue':self.next_due < datetime.today()
+            'overdue':self.next_due < (now or datetime.today())
         }
         return json_task
 
+    # This returns the fragment cache key of the task, given the (id,
+    #   revision) pairs of its subtasks, or None if the task or a subtask has
+    #   no revision to key it by.
+    # Due dates and assignees are part of the key since they can change
+    #   without a new revision, by the rollover or a renamed user.
+    def fragment_key(self, subtask_revisions, now):
+        # Tasks outside a family are not stamped with revisions when changed.
+        if self.revision is None or self.family_id is None or \
+                any(revision is None for _, revision in subtask_revisions):
+            return None
+        return ('task', self.id, self.family_id, self.revision, self.next_due,
+                self.next_due < now, self.assigned_user.username,
+                tuple(subtask_revisions))
+
+    # This will return json data for a list of tasks using a fixed number of
+    #   queries.
+    # Tasks are returned as encoded fragments, and the tasks found in the
+    #   fragment cache are neither loaded again nor serialized.
+    # The subtask revisions are read with one query to build the cache keys,
+    #   and the subtasks of the other tasks are loaded with a single IN query
+    #   instead of one lazy query per task.
+    # The ids are sent as an expanding parameter, which is much cheaper to
+    #   build than an IN clause of one bound parameter per id.
+    @staticmethod
+    def list_to_json(tasks):
+        now = datetime.today()
+        revisions = {}
+        task_ids = [task.id for task in tasks]
+        in_task_ids = Subtask.task_id.in_(db.bindparam('task_ids', expanding=True))
+        if task_ids:
+            for task_id, subtask_id, revision in db.session.query(
+                    Subtask.task_id, Subtask.id, Subtask.revision)\
+                    .filter(in_task_ids).params(task_ids=task_ids)\
+                    .order_by(Subtask.id.asc()):
+                revisions.setdefault(task_id, []).append((subtask_id, revision))
+        keys = [task.fragment_key(revisions.get(task.id, ()), now) for task in tasks]
+        fragments = [fragment_cache.get(key) for key in keys]
+
+        subtasks = {}
+        missing = [task.id for task, fragment in zip(tasks, fragments)
+                   if fragment is None]
+        if missing:
+            for subtask in Subtask.query.filter(in_task_ids)\
+                    .params(task_ids=missing).order_by(Subtask.id.asc()).all():
+                subtasks.setdefault(subtask.task_id, []).append(subtask)
+        for i, task in enumerate(tasks):
+            if fragments[i] is None:
+                fragments[i] = response_encoder.fragment(
+                        task.to_json(subtasks.get(task.id, []), now))
+                fragment_cache.set(keys[i], fragments[i])
+        return fragments
+
+    # This will return a page of tasks ordered by due date, and an opaque
+    #   cursor for the next page, or None on the last page.
+    # Pages seek past the last (next_due, id) seen rather than using an offset,
+    #   so every page costs the same no matter how deep into the list it is.
+    @staticmethod
+    def keyset_page(query, cursor=None, per_page=20):
+        if cursor:
+            next_due, task_id = Task.decode_cursor(cursor)
+            query = query.filter(db.or_(Task.next_due > next_due,
+                    db.and_(Task.next_due == next_due, Task.id > task_id)))
+        tasks = query.order_by(Task.next_due.asc(), Task.id.asc())\
+                .limit(per_page + 1).all()
+        if len(tasks) > per_page:
+            tasks = tasks[:per_page]
+            return tasks, Task.encode_cursor(tasks[-1])
+        return tasks, None
+
+    # Encode the sort key of a task as a page cursor.
+    @staticmethod
+    def encode_cursor(task):
+        key = json.dumps([task.next_due.isoformat(), task.id])
+        return urlsafe_b64encode(key.encode('utf-8')).decode('utf-8')
+
+    # Decode a page cursor into the sort key it was built from.
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            next_due, task_id = json.loads(urlsafe_b64decode(cursor.encode('utf-8')))
+            return datetime.fromisoformat(next_due), int(task_id)
+        except (ValueError, TypeError):
+            raise ValidationError('Invalid cursor.')
+
     # This will create a task and commit it to the db.
     def from_json(json_task):
         taskname = json_task.get('taskname')
         period = json_task.get('period')
         assigned_user_id = json_task.get('assignee')
-        if taskname is None or assigned_user_id is None or period is None:
+        if taskname is None or assigned_user_id is None or \
+                not recurrence.is_valid_period(period):
             return None
         else:
             return Task(taskname=taskname,
@@ -377,11 +691,16 @@ class Task(db.Model):
 # This defines the subtask class, which holds subtasks identified under tasks.
 class Subtask(db.Model):
     __tablename__='subtasks'
+    __table_args__ = (db.Index('ix_subtasks_task_id_id', 'task_id', 'id'),)
 
     id = db.Column(db.Integer,primary_key=True)
     subtask_name = db.Column(db.String(64))
     task_id = db.Column(db.Integer, db.ForeignKey('tasks.id'))
     is_complete = db.Column(db.Boolean,default=False)
+    # Family version of the last change to the subtask, or 0 before it was
+    #   changed in a family.
+    revision = db.Column(db.Integer, index=True, nullable=False, default=0,
+                         server_default='0')
 
     # This will mark the subtask as complete.
     # It will also kick the parent task to determine if it is complete.
@@ -392,8 +711,13 @@ class Subtask(db.Model):
             return
         self.is_complete = True
         db.session.add(self)
+        db.session.flush()
+        completed = self.task.determine_complete(commit=False)
         db.session.commit()
-        self.task.determine_complete()
+        events.publish_family(task_family_id(self.task), 'subtask-complete',
+                              task_id=self.task_id, subtask_id=self.id)
+        if completed:
+            self.task.announce_complete()
 
     def uncomplete(self):
         if not self.is_complete:
@@ -403,6 +727,8 @@ class Subtask(db.Model):
             self.is_complete = False
             db.session.add(self)
             db.session.commit()
+            events.publish_family(task_family_id(self.task), 'subtask-uncomplete',
+                                  task_id=self.task_id, subtask_id=self.id)
 
     # This function returns all pertinent info for a subtask.
     def to_json(self):
@@ -415,6 +741,14 @@ class Subtask(db.Model):
         }
         return json_subtask
 
+    # This function returns the json of the subtask as an encoded fragment,
+    #   from the fragment cache when its revision has been seen.
+    def to_fragment(self):
+        key = None if self.revision is None else \
+                ('subtask', self.id, self.task_id, self.revision)
+        return fragment_cache.get_or_build(key,
+                lambda: response_encoder.fragment(self.to_json()))
+
     # This function receives data from the application api, and creates a
     #   a subtask.
     # The input to this function is handled in the api/tasks.py file in order
@@ -430,6 +764,13 @@ class Family(db.Model):
     id = db.Column(db.Integer,primary_key=True)
     family_name = db.Column(db.String(64))
     members = db.relationship('User', backref='family',lazy='dynamic')
+    tasks = db.relationship('Task', backref='family',lazy='dynamic')
+    # Incremented by every write to the family's tasks, subtasks or members.
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # The newest revision of the family's pruned tombstones. Clients synced to
+    #   an older version may have missed a deletion, and must reset.
+    pruned_version = db.Column(db.Integer, nullable=False, default=0,
+                               server_default='0')
 
     def add_member(user):
         if user.family_id == self.id:
@@ -439,20 +780,434 @@ class Family(db.Model):
             db.session.add(user)
             db.session.commit()
 
+    # This function will return the serialized family tasks, from the task
+    #   cache when available.
+    def get_family_tasks_json(self):
+        return task_cache.get_or_set(family_key(self.id), self.version,
+                lambda: Task.list_to_json(self.get_family_tasks()))
+
+    # The assigned users are loaded in the same query to avoid a lazy load
+    #   per task when serializing.
     def get_family_tasks(self):
-        tasks = Task.query.join(User, User.id == Task.assigned_user_id)\
-                .filter(User.family_id == self.id).order_by(Task.next_due.asc()).all()
-        return tasks
+        return self.family_tasks_query().order_by(Task.next_due.asc()).all()
+
+    # This function will return an unordered query of the family's tasks.
+    def family_tasks_query(self):
+        return Task.query.options(db.joinedload(Task.assigned_user, innerjoin=True))\
+                .filter(Task.family_id == self.id)
+
+    # This function will return a query of the family's overdue tasks, most
+    #   overdue first.
+    def overdue_tasks_query(self, now=None):
+        now = now or datetime.today()
+        return self.family_tasks_query().filter(Task.next_due < now)\
+                .order_by(Task.next_due.asc(), Task.id.asc())
+
+    # This function will return a query of the family's tasks falling due in
+    #   the next days, soonest first.
+    # Overdue tasks are not included.
+    def tasks_due_within_query(self, days, now=None):
+        now = now or datetime.today()
+        return self.family_tasks_query()\
+                .filter(Task.next_due >= now,
+                        Task.next_due < now + timedelta(days=days))\
+                .order_by(Task.next_due.asc(), Task.id.asc())
 
     def generate_family_token(self,email,expires_in=86400):
-        s = Serializer(current_app.config['SECRET_KEY'],expires_in)
-        return s.dumps({'family_id':self.id,'email':email}).decode('utf-8')
+        return tokens.issue('family', {'family_id':self.id,'email':email},
+                            expires_in)
+
+    # This function will increment the version of each provided family and
+    #   return a dictionary of the new versions keyed by family id.
+    # The versions are updated in SQL so concurrent writers cannot lose an
+    #   increment, and families are locked in id order to avoid deadlocks.
+    @staticmethod
+    def bump_versions(session, family_ids):
+        families = Family.__table__
+        versions = {}
+        for family_id in sorted(family_ids):
+            session.execute(families.update()\
+                    .where(families.c.id == family_id)\
+                    .values(version=families.c.version + 1))
+            versions[family_id] = session.execute(
+                    db.select([families.c.version])\
+                    .where(families.c.id == family_id)).scalar()
+            family = session.identity_map.get(
+                    db.inspect(Family).identity_key_from_primary_key((family_id,)))
+            if family is not None:
+                session.expire(family, ['version'])
+        return versions
+
+    # This function will return the tasks, subtasks and deletions made since
+    #   the provided family version.
+    # A version of None returns every task of the family, which carry their
+    #   subtasks, without deletions, for clients replacing their copy.
+    def get_changes_since(self, version):
+        tasks = self.family_tasks_query()
+        if version is None:
+            return tasks.order_by(Task.next_due.asc()).all(), [], []
+        subtasks = Subtask.query.join(Task).filter(Task.family_id == self.id)
+        tasks = tasks.filter(Task.revision > version)\
+                .order_by(Task.next_due.asc()).all()
+        subtasks = subtasks.filter(Subtask.revision > version)\
+                .order_by(Subtask.id.asc()).all()
+        tombstones = Tombstone.query.filter(Tombstone.family_id == self.id,
+                                            Tombstone.revision > version)\
+                .order_by(Tombstone.revision.asc()).all()
+        return tasks, subtasks, tombstones
+
+    # This function will return the number of task completions by each member
+    #   since the provided day, including members without any.
+    def completions_by_member(self, since):
+        return db.session.query(User.id, User.username,
+                db.func.coalesce(db.func.sum(TaskCompletionDay.count), 0))\
+                .outerjoin(TaskCompletionDay, db.and_(
+                        TaskCompletionDay.user_id == User.id,
+                        TaskCompletionDay.family_id == self.id,
+                        TaskCompletionDay.day >= since))\
+                .filter(User.family_id == self.id)\
+                .group_by(User.id, User.username)\
+                .order_by(User.username.asc()).all()
+
+    # This function will return the number of task completions in each week
+    #   since the provided day, as (week start, count) pairs.
+    # Weeks without completions are left out.
+    def completions_by_week(self, since):
+        return db.session.query(TaskCompletionDay.week,
+                                db.func.sum(TaskCompletionDay.count))\
+                .filter(TaskCompletionDay.family_id == self.id,
+                        TaskCompletionDay.day >= since)\
+                .group_by(TaskCompletionDay.week)\
+                .order_by(TaskCompletionDay.week.asc()).all()
 
     # This function will return an integer with the nubmer of leaders.
     def count_leaders(self):
-        leader_role = Role.query.filter_by(name='Leader').first()
-        leaders = len(self.members.filter_by(role=leader_role).all())
-        return leaders
+        leader_role = Role.named('Leader')
+        return self.members.filter_by(role=leader_role).count()
+
+    # This function will return the family name and the members of the
+    #   family with their role names, each alongside the number of leaders,
+    #   in one query.
+    # Rows are (family_name, user id, username, role name, leaders), ordered
+    #   by user id.
+    @staticmethod
+    def roster(family_id):
+        # The leaders are counted in a scalar subquery rather than a window
+        #   function, which SQLite only supports from 3.25.
+        members = User.__table__.alias('members')
+        roles = Role.__table__.alias('member_roles')
+        leaders = db.select([db.func.count(members.c.id)])\
+                .select_from(members.join(roles, roles.c.id == members.c.role_id))\
+                .where(db.and_(members.c.family_id == family_id,
+                               roles.c.name == 'Leader'))\
+                .correlate(None).as_scalar()
+        return db.session.query(Family.family_name, User.id, User.username,
+                                Role.name.label('role_name'),
+                                leaders.label('leaders'))\
+                .select_from(User)\
+                .join(Family, Family.id == User.family_id)\
+                .outerjoin(Role, Role.id == User.role_id)\
+                .filter(User.family_id == family_id)\
+                .order_by(User.id.asc()).all()
+
+
+# This records a deleted task or subtask so that clients syncing changes
+#   learn of the deletion.
+# Tombstones older than TOMBSTONE_RETENTION seconds are pruned, and clients
+#   synced before them are reset.
+class Tombstone(db.Model):
+    __tablename__='tombstones'
+    __table_args__ = (db.Index('ix_tombstones_family_id_revision',
+                               'family_id', 'revision'),)
+
+    id = db.Column(db.Integer,primary_key=True)
+    family_id = db.Column(db.Integer, db.ForeignKey('families.id'))
+    kind = db.Column(db.String(16))
+    object_id = db.Column(db.Integer)
+    revision = db.Column(db.Integer)
+    created = db.Column(db.DateTime(), default=datetime.today, index=True)
+
+    # Deletes the tombstones older than retention seconds, raising the pruned
+    #   version of their families to the newest revision deleted.
+    # Returns the number of tombstones deleted.
+    @staticmethod
+    def expire(retention):
+        cutoff = datetime.today() - timedelta(seconds=retention)
+        families = Family.__table__
+        for family_id, revision in db.session.query(
+                Tombstone.family_id, db.func.max(Tombstone.revision))\
+                .filter(Tombstone.created < cutoff)\
+                .group_by(Tombstone.family_id):
+            db.session.execute(families.update()\
+                    .where(db.and_(families.c.id == family_id,
+                                   families.c.pruned_version < revision))\
+                    .values(pruned_version=revision))
+        pruned = Tombstone.query.filter(Tombstone.created < cutoff)\
+                .delete(synchronize_session=False)
+        db.session.commit()
+        return pruned
+
+
+# This records when a user's auth tokens were last revoked, and when their
+#   role or family last changed, so every worker can act on it before the
+#   tokens expire.
+# The row of user id 0 applies to every user, and rows are removed once no
+#   token issued before them can still be valid.
+class TokenRevocation(db.Model):
+    __tablename__='token_revocations'
+
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    revoked_at = db.Column(db.Float)
+    changed_at = db.Column(db.Float)
+    updated_at = db.Column(db.Float, index=True)
+
+    # Returns the (user_id, revoked_at, changed_at, updated_at) rows updated
+    #   after the timestamp.
+    @staticmethod
+    def since(timestamp):
+        return db.session.query(TokenRevocation.user_id,
+                                TokenRevocation.revoked_at,
+                                TokenRevocation.changed_at,
+                                TokenRevocation.updated_at) \
+                .filter(TokenRevocation.updated_at > timestamp).all()
+
+
+# This is an email waiting to be sent, written in the transaction of the
+#   change which sends it, and sent by the email outbox.
+# Sent emails are deleted, and emails which could not be sent after
+#   EMAIL_OUTBOX_MAX_ATTEMPTS attempts are kept as failed.
+class OutboxEmail(db.Model):
+    __tablename__='email_outbox'
+    __table_args__ = (db.Index('ix_email_outbox_status_next_attempt',
+                               'status', 'next_attempt'),)
+
+    id = db.Column(db.Integer,primary_key=True)
+    recipient = db.Column(db.String(64))
+    subject = db.Column(db.String(256))
+    body = db.Column(db.Text)
+    html = db.Column(db.Text)
+    created = db.Column(db.DateTime())
+    next_attempt = db.Column(db.DateTime())
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    status = db.Column(db.String(16), nullable=False, default='pending')
+    claimed_by = db.Column(db.String(32), index=True)
+    error = db.Column(db.String(256))
+
+    # Adds an email to the session, to be sent once it is committed.
+    @staticmethod
+    def queue(recipient, subject, body, html):
+        now = datetime.today()
+        email = OutboxEmail(recipient=recipient, subject=subject, body=body,
+                            html=html, created=now, next_attempt=now)
+        db.session.add(email)
+        db.session.info['email_outbox'] = True
+        return email
+
+    # Claims up to limit due emails for the lease in seconds, and returns
+    #   them.
+    # Emails claimed by another worker are not due until their lease ends,
+    #   so each is sent by one worker at a time.
+    # Due emails which already had max_attempts attempts, such as those whose
+    #   worker stopped while sending them, are failed instead.
+    @staticmethod
+    def claim(limit, lease, max_attempts):
+        now = datetime.today()
+        claimed_by = uuid.uuid4().hex
+        OutboxEmail.query.filter(OutboxEmail.status == 'pending',
+                                 OutboxEmail.next_attempt <= now,
+                                 OutboxEmail.attempts >= max_attempts) \
+                .update({OutboxEmail.status:'failed',
+                         OutboxEmail.error:'Too many attempts.'},
+                        synchronize_session=False)
+        due = [id for id, in db.session.query(OutboxEmail.id).filter(
+                OutboxEmail.status == 'pending',
+                OutboxEmail.next_attempt <= now,
+                OutboxEmail.attempts < max_attempts)
+                .order_by(OutboxEmail.next_attempt.asc()).limit(limit)]
+        if not due:
+            db.session.commit()
+            return []
+        OutboxEmail.query.filter(OutboxEmail.id.in_(due),
+                                 OutboxEmail.status == 'pending',
+                                 OutboxEmail.next_attempt <= now) \
+                .update({OutboxEmail.claimed_by:claimed_by,
+                         OutboxEmail.attempts:OutboxEmail.attempts + 1,
+                         OutboxEmail.next_attempt:now + timedelta(seconds=lease)},
+                        synchronize_session=False)
+        db.session.commit()
+        return OutboxEmail.query.filter_by(claimed_by=claimed_by) \
+                .order_by(OutboxEmail.id.asc()).all()
+
+    # Returns the number of emails of each status.
+    @staticmethod
+    def depth():
+        counts = dict(db.session.query(OutboxEmail.status, db.func.count())
+                      .group_by(OutboxEmail.status).all())
+        return {'pending':counts.get('pending', 0),
+                'failed':counts.get('failed', 0)}
+
+    # Returns the email as a message for the mail server.
+    def message(self):
+        return Message(self.subject, sender=current_app.config['MAIL_SENDER'],
+                       recipients=[self.recipient], body=self.body,
+                       html=self.html)
+
+    # Schedules another attempt at the time given, or fails the email.
+    def retry(self, next_attempt, error):
+        self.error = str(error)[:256]
+        if next_attempt is None:
+            self.status = 'failed'
+        else:
+            self.next_attempt = next_attempt
+        db.session.add(self)
+
+
+# This is an event published to a family channel by the database event
+#   broker, kept for the brokers of every process to deliver.
+# Ids are never reused on SQLite, so brokers reading by id do not miss events
+#   once the newest rows expire.
+class FamilyEvent(db.Model):
+    __tablename__='family_events'
+    __table_args__ = {'sqlite_autoincrement':True}
+
+    id = db.Column(db.Integer,primary_key=True)
+    channel = db.Column(db.String(64))
+    message = db.Column(db.Text)
+    created = db.Column(db.DateTime(), index=True)
+
+    # Stores an event in a transaction of its own.
+    @staticmethod
+    def publish(channel, message):
+        with db.engine.begin() as connection:
+            connection.execute(FamilyEvent.__table__.insert().values(
+                    channel=channel, message=message, created=datetime.today()))
+
+    # Returns the id of the newest event, or 0 without events.
+    @staticmethod
+    def newest_id():
+        return db.session.query(db.func.max(FamilyEvent.id)).scalar() or 0
+
+    # Returns the events after an id, oldest first.
+    @staticmethod
+    def since(event_id):
+        return FamilyEvent.query.filter(FamilyEvent.id > event_id)\
+                .order_by(FamilyEvent.id.asc()).all()
+
+    # Deletes the events older than retention seconds.
+    @staticmethod
+    def expire(retention):
+        FamilyEvent.query.filter(FamilyEvent.created <
+                                 datetime.today() - timedelta(seconds=retention))\
+                .delete(synchronize_session=False)
+        db.session.commit()
+
+
+# This records each completion of a task, and is only ever appended to.
+# Rows outlive their task, so the task is referenced by id alone.
+class TaskCompletion(db.Model):
+    __tablename__='task_completions'
+    __table_args__ = (db.Index('ix_task_completions_family_id_completed_at',
+                               'family_id', 'completed_at'),)
+
+    id = db.Column(db.Integer,primary_key=True)
+    task_id = db.Column(db.Integer)
+    family_id = db.Column(db.Integer, db.ForeignKey('families.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    completed_at = db.Column(db.DateTime())
+    # The due date the completion was made against.
+    due = db.Column(db.DateTime())
+
+    # This will record the completion of a task and count it in the daily
+    #   rollup, in the current transaction.
+    @staticmethod
+    def record(task, completed_at=None):
+        completed_at = completed_at or datetime.today()
+        db.session.add(TaskCompletion(task_id=task.id,
+                                      family_id=task.family_id,
+                                      user_id=task.assigned_user_id,
+                                      completed_at=completed_at,
+                                      due=task.next_due))
+        TaskCompletionDay.increment(task.family_id, task.assigned_user_id,
+                                    completed_at.date())
+
+
+# This holds the number of completions per member per day, so analytics over
+#   long ranges read one row per member per day rather than every completion.
+class TaskCompletionDay(db.Model):
+    __tablename__='task_completion_days'
+    __table_args__ = (db.Index('ix_task_completion_days_family_id_day_user_id',
+                               'family_id', 'day', 'user_id', unique=True),)
+
+    id = db.Column(db.Integer,primary_key=True)
+    family_id = db.Column(db.Integer, db.ForeignKey('families.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    day = db.Column(db.Date())
+    # First day of the week holding the day, weeks start on sunday.
+    week = db.Column(db.Date())
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    # Returns the sunday starting the week of a day.
+    @staticmethod
+    def week_of(day):
+        return day - timedelta(days=(day.weekday() + 1) % 7)
+
+    # This will add completions to a member's day, creating the row for the
+    #   first completion of the day.
+    # The count is incremented in SQL so concurrent completions are not lost.
+    # On PostgreSQL the row is upserted in one statement. Elsewhere the row is
+    #   updated, or else inserted in a savepoint, and an insert which loses
+    #   the unique index to a concurrent completion is retried as an update.
+    # Rows without a family or user are not covered by the unique index, so
+    #   they always take the second path.
+    @staticmethod
+    def increment(family_id, user_id, day, count=1):
+        days = TaskCompletionDay.__table__
+        values = {'family_id':family_id, 'user_id':user_id, 'day':day,
+                  'week':TaskCompletionDay.week_of(day), 'count':count}
+        if db.engine.dialect.name == 'postgresql' and \
+                family_id is not None and user_id is not None:
+            insert = postgresql.insert(days).values(values)
+            db.session.execute(insert.on_conflict_do_update(
+                    index_elements=['family_id', 'day', 'user_id'],
+                    set_={'count':days.c.count + insert.excluded.count}))
+            return
+        update = days.update().where(db.and_(days.c.family_id == family_id,
+                                             days.c.user_id == user_id,
+                                             days.c.day == day))\
+                .values(count=days.c.count + count)
+        if db.session.execute(update).rowcount:
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.execute(days.insert().values(values))
+        except IntegrityError:
+            db.session.execute(update)
+
+    # This function will rebuild every daily rollup from the completion
+    #   history, batch_size rows per insert.
+    # Returns the number of rollup rows written.
+    @staticmethod
+    def rebuild(batch_size=1000):
+        TaskCompletionDay.query.delete(synchronize_session=False)
+        day = db.func.date(TaskCompletion.completed_at)
+        rows = db.session.query(TaskCompletion.family_id, TaskCompletion.user_id,
+                                day, db.func.count(TaskCompletion.id))\
+                .group_by(TaskCompletion.family_id, TaskCompletion.user_id, day)\
+                .all()
+        mappings = []
+        for family_id, user_id, completed_on, count in rows:
+            if not isinstance(completed_on, date):
+                completed_on = date.fromisoformat(completed_on)
+            mappings.append({'family_id':family_id,
+                             'user_id':user_id,
+                             'day':completed_on,
+                             'week':TaskCompletionDay.week_of(completed_on),
+                             'count':count})
+        for start in range(0, len(mappings), batch_size):
+            db.session.bulk_insert_mappings(TaskCompletionDay,
+                                            mappings[start:start + batch_size])
+        db.session.commit()
+        return len(mappings)
 
 
 # Create an anonymous user class.
@@ -464,6 +1219,382 @@ class AnonymousUser(AnonymousUserMixin):
         return False
 
 
+# Returns the last second of the current day, the time tasks fall due.
+def end_of_today():
+    return datetime.today().replace(hour=23, minute=59, second=59, microsecond=0)
+
+
+# Returns a detached instance of a model with the provided column values,
+#   without calling its constructor.
+def detached_instance(cls, values):
+    obj = db.inspect(cls).class_manager.new_instance()
+    for key, value in values.items():
+        set_committed_value(obj, key, value)
+    make_transient_to_detached(obj)
+    return obj
+
+
+# Returns the task a subtask belongs to, including pending subtasks.
+def subtask_task(subtask):
+    if subtask.task is not None:
+        return subtask.task
+    return Task.query.get(subtask.task_id)
+
+
+# Returns the id of the user assigned to a task, including pending tasks.
+def task_user_id(task):
+    if task.assigned_user_id is None and task.assigned_user is not None:
+        return task.assigned_user.id
+    return task.assigned_user_id
+
+
+# Returns the family id of the user assigned to a task.
+def task_family_id(task):
+    user = task.assigned_user
+    if user is None and task.assigned_user_id is not None:
+        user = User.query.get(task.assigned_user_id)
+    return user.family_id if user else None
+
+
+# User attributes which appear in family rosters and task lists.
+USER_FAMILY_ATTRIBUTES = ('family_id', 'family', 'role_id', 'role', 'username')
+
+# Task attributes which are not serialized, and so do not change the family.
+TASK_COUNTER_ATTRIBUTES = ('subtask_count', 'completed_count')
+
+
+# Returns the pending writes in a session which change a family's tasks or
+#   roster, as a list of (object, family ids) pairs.
+def changed_family_objects(session):
+    changes = []
+    for obj in session.new | session.dirty | session.deleted:
+        changed = obj in session.new or obj in session.deleted or \
+                session.is_modified(obj, include_collections=False)
+        if not changed:
+            continue
+        family_ids = set()
+        if isinstance(obj, Subtask):
+            task = subtask_task(obj)
+            if task is not None:
+                family_ids.add(task_family_id(task))
+        elif isinstance(obj, Task):
+            state = db.inspect(obj)
+            if obj not in session.new and obj not in session.deleted and \
+                    not any(attr.history.has_changes() for attr in state.attrs
+                            if attr.key not in TASK_COUNTER_ATTRIBUTES):
+                continue
+            family_ids.add(task_family_id(obj))
+        elif isinstance(obj, User):
+            attrs = db.inspect(obj).attrs
+            if obj not in session.new and obj not in session.deleted and \
+                    not any(attrs[a].history.has_changes() for a in USER_FAMILY_ATTRIBUTES):
+                continue
+            family_ids.update(attrs.family_id.load_history().sum())
+            family_ids.update(f.id for f in attrs.family.load_history().sum()
+                              if f is not None)
+        family_ids.discard(None)
+        if family_ids:
+            changes.append((obj, family_ids))
+    return changes
+
+
+# Record the tasks whose family may change with a flush, because they were
+#   assigned to another user or their user moved family.
+@db.event.listens_for(db.session, 'before_flush')
+def record_task_family_changes(session, flush_context, instances):
+    tasks = session.info.setdefault('task_family_tasks', set())
+    users = session.info.setdefault('task_family_users', set())
+    for obj in session.new | session.dirty:
+        if obj in session.deleted:
+            continue
+        attrs = db.inspect(obj).attrs
+        if isinstance(obj, Task):
+            if obj in session.new or attrs.assigned_user_id.history.has_changes() \
+                    or attrs.assigned_user.history.has_changes():
+                tasks.add(obj)
+                if obj in session.new:
+                    session.info.setdefault('task_family_new', set()).add(obj)
+        elif isinstance(obj, User) and obj not in session.new:
+            if attrs.family_id.history.has_changes() or \
+                    attrs.family.history.has_changes():
+                users.add(obj)
+
+
+# Copy the family of the assigned user onto the recorded tasks, once the
+#   flush has written the tasks and users.
+# Tasks moved from one family to another are synced to both, see
+#   record_task_moves() below.
+# Tasks held by the session have their family expired to be reloaded.
+@db.event.listens_for(db.session, 'after_flush_postexec')
+def assign_task_families(session, flush_context):
+    task_ids = {task.id for task in session.info.pop('task_family_tasks', ())}
+    user_ids = {user.id for user in session.info.pop('task_family_users', ())}
+    new_ids = {task.id for task in session.info.pop('task_family_new', ())}
+    if not task_ids and not user_ids:
+        return
+    tasks = Task.__table__
+    users = User.__table__
+    affected = db.or_(tasks.c.id.in_(task_ids),
+                      tasks.c.assigned_user_id.in_(user_ids))
+    family_id = db.select([users.c.family_id])\
+            .where(users.c.id == tasks.c.assigned_user_id).as_scalar()
+    # New tasks were stamped with their family's version when inserted.
+    moves = [(task_id, old, new) for task_id, old, new in session.execute(
+                    db.select([tasks.c.id, tasks.c.family_id, family_id])
+                    .where(affected))
+             if old != new and task_id not in new_ids]
+    session.execute(tasks.update().where(affected).values(family_id=family_id))
+    moved_ids = record_task_moves(session, moves)
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Task) and (obj.id in task_ids or
+                obj.assigned_user_id in user_ids):
+            session.expire(obj, ['family_id', 'family', 'revision'])
+        elif isinstance(obj, Subtask) and obj.task_id in moved_ids:
+            session.expire(obj, ['revision'])
+
+
+# Stamp tasks moved to another family, and their subtasks, with the new
+#   family's version, and leave tombstones for them in the old family, so
+#   clients of both families sync the move.
+# Takes (task id, old family id, new family id) triples, and returns the ids
+#   of the moved tasks.
+def record_task_moves(session, moves):
+    if not moves:
+        return set()
+    tasks = Task.__table__
+    subtasks = Subtask.__table__
+    versions = Family.bump_versions(session,
+            {f for _, old, new in moves for f in (old, new) if f is not None})
+    task_subtasks = {}
+    for subtask_id, task_id in session.execute(
+            db.select([subtasks.c.id, subtasks.c.task_id])
+            .where(subtasks.c.task_id.in_([task_id for task_id, _, _ in moves]))):
+        task_subtasks.setdefault(task_id, []).append(subtask_id)
+    tombstones = []
+    stamped = {}
+    for task_id, old, new in moves:
+        if old is not None:
+            tombstones.append({'family_id':old, 'kind':'tasks',
+                               'object_id':task_id, 'revision':versions[old]})
+            tombstones.extend({'family_id':old, 'kind':'subtasks',
+                               'object_id':subtask_id, 'revision':versions[old]}
+                              for subtask_id in task_subtasks.get(task_id, ()))
+        if new is not None:
+            stamped.setdefault(new, []).append(task_id)
+    if tombstones:
+        session.execute(Tombstone.__table__.insert(), tombstones)
+    for family_id, task_ids in stamped.items():
+        session.execute(tasks.update().where(tasks.c.id.in_(task_ids))
+                        .values(revision=versions[family_id]))
+        session.execute(subtasks.update().where(subtasks.c.task_id.in_(task_ids))
+                        .values(revision=versions[family_id]))
+    session.info.setdefault('task_cache_keys', set()).update(
+            family_key(family_id) for family_id in versions)
+    return {task_id for task_id, _, _ in moves}
+
+
+# Keep the subtask counters of tasks in step with subtasks added, deleted,
+#   completed or uncompleted by a flush.
+# Counters of persisted tasks are changed in SQL so concurrent ticks on the
+#   same task cannot lose an update.
+# Bulk inserts and updates skip this listener and must set the counters
+#   themselves.
+@db.event.listens_for(db.session, 'before_flush')
+def count_subtasks(session, flush_context, instances):
+    deltas = {}
+    for obj in session.new | session.dirty | session.deleted:
+        if not isinstance(obj, Subtask):
+            continue
+        attr = db.inspect(obj).attrs.is_complete
+        if obj in session.new:
+            delta = (1, 1 if obj.is_complete else 0)
+        elif obj in session.deleted:
+            history = attr.load_history()
+            delta = (-1, -1 if (history.unchanged or history.deleted or [False])[0] else 0)
+        elif attr.history.has_changes():
+            history = attr.history
+            was_complete = bool(history.deleted[0]) if history.deleted else False
+            delta = (0, int(bool(obj.is_complete)) - int(was_complete))
+        else:
+            continue
+        task = subtask_task(obj)
+        if task is None or task in session.deleted:
+            continue
+        counts = deltas.setdefault(task, [0, 0])
+        counts[0] += delta[0]
+        counts[1] += delta[1]
+    for task, (subtasks, completed) in deltas.items():
+        if task in session.new:
+            task.subtask_count = (task.subtask_count or 0) + subtasks
+            task.completed_count = (task.completed_count or 0) + completed
+            continue
+        if subtasks:
+            task.subtask_count = Task.subtask_count + subtasks
+        if completed:
+            task.completed_count = Task.completed_count + completed
+
+
+# Bump the version of every family affected by a flush, in the same
+#   transaction as the writes themselves.
+# Changed tasks and subtasks are stamped with the new version as their
+#   revision, and deleted ones leave a tombstone, so clients can sync only the
+#   changes made since a previous version.
+@db.event.listens_for(db.session, 'before_flush')
+def bump_family_versions(session, flush_context, instances):
+    changes = changed_family_objects(session)
+    if not changes:
+        return
+    record_task_cache_keys(session, changes)
+    versions = Family.bump_versions(session,
+            set().union(*[family_ids for obj, family_ids in changes]))
+    for obj, family_ids in changes:
+        if not isinstance(obj, (Task, Subtask)):
+            continue
+        family_id = family_ids.pop()
+        if obj in session.deleted:
+            session.add(Tombstone(family_id=family_id,
+                                  kind=obj.__tablename__,
+                                  object_id=obj.id,
+                                  revision=versions[family_id]))
+        else:
+            obj.revision = versions[family_id]
+
+
+# Record the task cache keys changed by a flush, to be invalidated once the
+#   transaction commits.
+def record_task_cache_keys(session, changes):
+    keys = session.info.setdefault('task_cache_keys', set())
+    for obj, family_ids in changes:
+        keys.update(family_key(family_id) for family_id in family_ids)
+        if isinstance(obj, User):
+            keys.add(user_key(obj.id))
+            continue
+        task = subtask_task(obj) if isinstance(obj, Subtask) else obj
+        if task is not None and task_user_id(task) is not None:
+            keys.add(user_key(task_user_id(task)))
+
+
+# Invalidate the cached task lists changed by a committed transaction.
+@db.event.listens_for(db.session, 'after_commit')
+def invalidate_task_cache(session):
+    if ending_savepoint(session):
+        return
+    task_cache.invalidate(session.info.pop('task_cache_keys', None))
+
+
+# Record the users and roles changed by a flush, whose cached auth tokens
+#   must be dropped once the transaction commits.
+@db.event.listens_for(db.session, 'before_flush')
+def record_auth_changes(session, flush_context, instances):
+    for obj in session.dirty | session.deleted:
+        if obj not in session.deleted and \
+                not session.is_modified(obj, include_collections=False):
+            continue
+        if isinstance(obj, User):
+            session.info.setdefault('auth_users', set()).add(obj.id)
+        elif isinstance(obj, Role):
+            session.info['auth_roles'] = True
+
+
+# User attributes carried by auth tokens as claims.
+USER_CLAIM_ATTRIBUTES = ('role_id', 'role', 'family_id', 'family')
+
+
+# Record the auth tokens revoked by a flush, of users who were deleted or
+#   whose password changed, and the tokens whose claims went stale, of users
+#   whose role or family changed.
+# A role change makes the claims of every token stale.
+# The revocations are written with the flush, so other workers read them once
+#   the transaction commits.
+@db.event.listens_for(db.session, 'before_flush')
+def record_token_revocations(session, flush_context, instances):
+    now = time.time()
+    revocations = {}
+    for obj in session.dirty | session.deleted:
+        if isinstance(obj, User):
+            if obj in session.deleted or \
+                    db.inspect(obj).attrs.password_hash.history.has_changes():
+                revocations[obj.id] = (now, now)
+            elif any(db.inspect(obj).attrs[a].history.has_changes()
+                     for a in USER_CLAIM_ATTRIBUTES):
+                revocations.setdefault(obj.id, (None, now))
+        elif isinstance(obj, Role) and (obj in session.deleted or
+                session.is_modified(obj, include_collections=False)):
+            revocations[ALL_USERS] = (None, now)
+    if not revocations:
+        return
+    with session.no_autoflush:
+        session.query(TokenRevocation).filter(
+                TokenRevocation.updated_at < now - token_revocations.ttl,
+                ~TokenRevocation.user_id.in_(list(revocations))) \
+                .delete(synchronize_session=False)
+        for user_id, (revoked_at, changed_at) in revocations.items():
+            row = session.query(TokenRevocation).get(user_id)
+            if row is None:
+                row = TokenRevocation(user_id=user_id)
+                session.add(row)
+            if revoked_at is not None:
+                row.revoked_at = revoked_at
+            row.changed_at = changed_at
+            row.updated_at = now
+    session.info.setdefault('token_revocations', []).extend(
+            (user_id, revoked_at, changed_at, now)
+            for user_id, (revoked_at, changed_at) in revocations.items())
+
+
+# Drop the cached auth tokens of users changed by a committed transaction.
+# A role change drops every token, since any user may hold the role, and the
+#   role registry.
+@db.event.listens_for(db.session, 'after_commit')
+def invalidate_auth_cache(session):
+    if ending_savepoint(session):
+        return
+    if session.info.pop('auth_roles', False):
+        auth_cache.clear()
+        Role.clear_registry()
+    auth_cache.invalidate_users(session.info.pop('auth_users', ()))
+    token_revocations.apply(session.info.pop('token_revocations', ()))
+
+
+# Wake the email outbox once emails are committed.
+@db.event.listens_for(db.session, 'after_commit')
+def wake_email_outbox(session):
+    if ending_savepoint(session):
+        return
+    if session.info.pop('email_outbox', False):
+        email_outbox.wake()
+
+
+# Discard the task cache keys, task family changes, auth changes and queued
+#   emails of a rolled back transaction.
+# Rolling back a savepoint keeps them, since the enclosing transaction may
+#   still commit.
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_task_cache_keys(session):
+    if ending_savepoint(session):
+        return
+    session.info.pop('task_cache_keys', None)
+    session.info.pop('task_family_tasks', None)
+    session.info.pop('task_family_users', None)
+    session.info.pop('task_family_new', None)
+    session.info.pop('auth_users', None)
+    session.info.pop('auth_roles', None)
+    session.info.pop('token_revocations', None)
+    session.info.pop('email_outbox', None)
+
+
+# Returns True if the commit or rollback in progress ends a savepoint rather
+#   than the outermost transaction, which SQLAlchemy reports with the same
+#   events.
+def ending_savepoint(session):
+    transaction = session.transaction
+    while transaction is not None:
+        if transaction.nested:
+            return True
+        transaction = transaction.parent
+    return False
+
+
 from . import login_manager
 
 
@@ -0,0 +1,175 @@
+import os
+from collections import deque
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+from flask import current_app
+
+
+# This extension sends the emails queued in the email_outbox table.
+# EMAIL_OUTBOX_WORKERS threads per process send the emails once they are
+#   committed, and poll every EMAIL_OUTBOX_POLL seconds for emails due a
+#   retry, and 0 leaves them to the send-emails command.
+# Each worker claims up to EMAIL_OUTBOX_BATCH emails for EMAIL_OUTBOX_LEASE
+#   seconds and sends them over one connection, so emails are not sent twice
+#   by workers of other processes.
+# A failed email is retried after EMAIL_OUTBOX_BACKOFF seconds, doubling with
+#   each attempt, and fails after EMAIL_OUTBOX_MAX_ATTEMPTS attempts.
+class EmailOutbox:
+
+    def __init__(self, app=None):
+        self.app = None
+        self.workers = 0
+        self.batch = 20
+        self.lease = 300
+        self.poll = 15
+        self.backoff = 30
+        self.max_attempts = 5
+        self.threads = []
+        self.pid = None
+        self.wakeup = Event()
+        self.stopping = Event()
+        self.lock = Lock()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=1000)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config['EMAIL_OUTBOX_WORKERS']
+        self.batch = app.config['EMAIL_OUTBOX_BATCH']
+        self.lease = app.config['EMAIL_OUTBOX_LEASE']
+        self.poll = app.config['EMAIL_OUTBOX_POLL']
+        self.backoff = app.config['EMAIL_OUTBOX_BACKOFF']
+        self.max_attempts = app.config['EMAIL_OUTBOX_MAX_ATTEMPTS']
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=1000)
+        app.extensions['email_outbox'] = self
+
+    # Wake the workers to send newly committed emails.
+    def wake(self):
+        if not self.workers:
+            return
+        self.start()
+        self.wakeup.set()
+
+    # Start the worker threads on first use in each process, so that forked
+    #   servers do not share the parent's workers.
+    def start(self):
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.stopping.clear()
+            self.threads = [Thread(target=self.run, daemon=True)
+                            for i in range(self.workers)]
+            for thread in self.threads:
+                thread.start()
+
+    # Stop the worker threads once their current batch is sent.
+    def shutdown(self):
+        with self.lock:
+            threads, self.threads = self.threads, []
+            self.pid = None
+            self.stopping.set()
+            self.wakeup.set()
+        for thread in threads:
+            thread.join()
+
+    # Send emails until stopped, waiting to be woken or for the poll interval
+    #   whenever none are due.
+    def run(self):
+        from . import db
+        with self.app.app_context():
+            while not self.stopping.is_set():
+                try:
+                    attempted = self.drain()
+                except Exception:
+                    current_app.logger.exception('Email outbox worker failed.')
+                    attempted = 0
+                finally:
+                    db.session.remove()
+                if not attempted:
+                    self.wakeup.wait(self.poll)
+                    self.wakeup.clear()
+
+    # Claim and send a batch of due emails, and return how many were
+    #   attempted.
+    # Each email is settled as soon as it is sent or fails, so an email which
+    #   cannot be sent does not hold back the rest of the batch, and a sent
+    #   email is not sent again.
+    def drain(self):
+        from . import db
+        from .models import OutboxEmail
+        emails = OutboxEmail.claim(self.batch, self.lease, self.max_attempts)
+        if not emails:
+            return 0
+        settled = set()
+        try:
+            with current_app.extensions['mail'].connect() as connection:
+                for email in emails:
+                    try:
+                        connection.send(email.message())
+                    except Exception as e:
+                        self.settle(email, e)
+                    else:
+                        self.settle(email)
+                    settled.add(email.id)
+        except Exception as e:
+            # The connection failed, so the emails not sent yet are retried.
+            db.session.rollback()
+            for email in emails:
+                if email.id not in settled:
+                    self.settle(email, e)
+        return len(emails)
+
+    # Delete a sent email, or schedule another attempt at an email which
+    #   failed with the error, and commit it.
+    def settle(self, email, error=None):
+        from . import db
+        now = datetime.today()
+        if error is None:
+            self.record(now - email.created)
+            db.session.delete(email)
+        elif email.attempts >= self.max_attempts:
+            email.retry(None, error)
+            self.record(failed=True)
+        else:
+            email.retry(now + timedelta(
+                    seconds=self.backoff * 2 ** (email.attempts - 1)), error)
+            self.record(retried=True)
+        db.session.commit()
+
+    # Record an email sent after waiting latency in the outbox, or an email
+    #   which failed or will be retried.
+    def record(self, latency=None, failed=False, retried=False):
+        with self.lock:
+            if latency is not None:
+                self.sent += 1
+                self.latencies.append(latency.total_seconds())
+            self.failed += failed
+            self.retried += retried
+
+    # Return the outbox depth, and the counters and send latencies of this
+    #   process.
+    def stats(self):
+        from .models import OutboxEmail
+        latencies = sorted(self.latencies)
+        return dict(OutboxEmail.depth(),
+                    sent=self.sent,
+                    retried=self.retried,
+                    failures=self.failed,
+                    latency={'p50':percentile(latencies, 0.5),
+                             'p95':percentile(latencies, 0.95),
+                             'max':latencies[-1] if latencies else None})
+
+
+# Returns the percentile of sorted values, or None without values.
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(len(values) * fraction))]
@@ -0,0 +1,210 @@
+import json
+import os
+import time
+from queue import Queue, Empty, Full
+from threading import Lock, Thread
+from flask import current_app
+
+
+# This broker fans messages out to subscribers in the current process.
+# Each subscriber gets a bounded queue, and messages for a full queue are
+#   dropped since clients resync with the changes route on reconnect.
+# Blocking on the queues is cooperative under gevent workers, so idle stream
+#   connections do not hold a thread each.
+class LocalBroker:
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self.channels = {}
+        self.lock = Lock()
+
+    def init_app(self, app):
+        pass
+
+    # Deliver a message to every subscriber of a channel.
+    def publish(self, channel, message):
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except Full:
+                pass
+
+    # Provide a queue which will receive the messages published to a channel.
+    def subscribe(self, channel):
+        subscriber = Queue(self.queue_size)
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(subscriber)
+        return subscriber
+
+    # Stop delivering messages to a subscriber.
+    def unsubscribe(self, channel, subscriber):
+        with self.lock:
+            subscribers = self.channels.get(channel)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.channels[channel]
+
+    # Return the number of subscribers to a channel.
+    def subscriber_count(self, channel):
+        with self.lock:
+            return len(self.channels.get(channel, ()))
+
+
+# This broker fans messages out across worker processes through the
+#   family_events table.
+# Publishing inserts a row on a connection of its own, as publishing to a
+#   pub/sub service would, and a thread per process polls the table every
+#   EVENT_POLL seconds while the process has subscribers, delivering the new
+#   rows to them. An EVENT_POLL of None leaves polling to the caller.
+# Rows are read by id, and an id missing below newer rows is read again for
+#   EVENT_GAP_GRACE seconds, since the transaction which took it may commit
+#   after them. Rows older than EVENT_RETENTION seconds are deleted.
+class DatabaseBroker(LocalBroker):
+
+    def __init__(self, queue_size=100):
+        super(DatabaseBroker, self).__init__(queue_size)
+        self.app = None
+        self.poll = 1
+        self.gap_grace = 5
+        self.retention = 60
+        self.floor = None
+        self.delivered = {}
+        self.gaps = {}
+        self.pid = None
+
+    def init_app(self, app):
+        self.app = app
+        self.poll = app.config['EVENT_POLL']
+        self.gap_grace = app.config['EVENT_GAP_GRACE']
+        self.retention = app.config['EVENT_RETENTION']
+
+    # Store a message for the pollers of every process to deliver.
+    # Events are best effort, since clients resync with the changes route,
+    #   so a message which cannot be stored is logged and dropped.
+    def publish(self, channel, message):
+        from .models import FamilyEvent
+        try:
+            FamilyEvent.publish(channel, json.dumps(message))
+        except Exception:
+            current_app.logger.exception('Failed to publish an event.')
+
+    def subscribe(self, channel):
+        self.start()
+        return super(DatabaseBroker, self).subscribe(channel)
+
+    # Start the polling thread on first use in each process, so that forked
+    #   servers do not share the parent's thread.
+    def start(self):
+        if self.poll is None:
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.floor = None
+        Thread(target=self.run, daemon=True).start()
+
+    # Deliver new events every poll interval.
+    def run(self):
+        from . import db
+        with self.app.app_context():
+            while True:
+                try:
+                    self.deliver()
+                except Exception:
+                    current_app.logger.exception('Failed to deliver events.')
+                finally:
+                    db.session.remove()
+                time.sleep(self.poll)
+
+    # Deliver the events stored since the last poll to the subscribers of
+    #   this process, and delete expired events.
+    # Without subscribers nothing is read, and the next poll with subscribers
+    #   starts from the newest event.
+    def deliver(self):
+        from .models import FamilyEvent
+        with self.lock:
+            subscribed = bool(self.channels)
+        if not subscribed:
+            self.floor = None
+            return
+        if self.floor is None:
+            self.floor = FamilyEvent.newest_id()
+            self.delivered, self.gaps = {}, {}
+        now = time.monotonic()
+        for event in FamilyEvent.since(self.floor):
+            if event.id not in self.delivered:
+                self.delivered[event.id] = now
+                LocalBroker.publish(self, event.channel, json.loads(event.message))
+
+        # Raise the floor past delivered ids, and past missing ids once their
+        #   grace has passed.
+        floor = self.floor
+        newest = max(self.delivered, default=floor)
+        while floor < newest:
+            if floor + 1 not in self.delivered and \
+                    now - self.gaps.setdefault(floor + 1, now) < self.gap_grace:
+                break
+            floor += 1
+        self.floor = floor
+        self.delivered = {i:t for i, t in self.delivered.items() if i > floor}
+        self.gaps = {i:t for i, t in self.gaps.items() if i > floor}
+        FamilyEvent.expire(self.retention)
+
+
+# Brokers available to the EVENT_BROKER setting.
+# 'local' only reaches clients connected to the publishing process, so
+#   servers running several worker processes use 'database'.
+brokers = {
+    'local':LocalBroker,
+    'database':DatabaseBroker,
+}
+
+
+# This extension publishes family task events and streams them to clients as
+#   server-sent events.
+class Events:
+
+    def __init__(self, app=None):
+        self.broker = None
+        self.heartbeat = 15
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.broker = brokers[app.config['EVENT_BROKER']](
+                queue_size=app.config['EVENT_QUEUE_SIZE'])
+        self.broker.init_app(app)
+        self.heartbeat = app.config['EVENT_STREAM_HEARTBEAT']
+        app.extensions['events'] = self
+
+    # Publish an event to every connected member of a family.
+    def publish_family(self, family_id, event, **data):
+        if family_id is None or self.broker is None:
+            return
+        data['type'] = event
+        self.broker.publish(f'family:{family_id}', data)
+
+    # Generate the server-sent event stream for a family.
+    # A comment is sent when no events arrive within the heartbeat interval,
+    #   which keeps proxies from closing the connection and lets the server
+    #   notice clients that have gone away.
+    def stream_family(self, family_id):
+        channel = f'family:{family_id}'
+        broker = self.broker
+        heartbeat = self.heartbeat
+        subscriber = broker.subscribe(channel)
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    message = subscriber.get(timeout=heartbeat)
+                except Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f'event: {message["type"]}\ndata: {json.dumps(message)}\n\n'
+        finally:
+            broker.unsubscribe(channel, subscriber)
@@ -0,0 +1,121 @@
+import re
+from calendar import monthrange
+from collections import namedtuple
+from datetime import timedelta
+from .exceptions import ValidationError
+
+
+# A task period is an optional count, a unit and an optional anchor, such as
+#   'd', '3d', 'w', '2w@0' or 'm@15', to fit the 7 character period column.
+# Weekly anchors are weekdays with monday as 0, and monthly anchors are days
+#   of the month, clamped to the length of shorter months.
+PERIOD_PATTERN = re.compile(r'^([1-9][0-9]?)?([dwm])(?:@([0-9]{1,2}))?$')
+
+# Weekly tasks default to saturdays, and monthly tasks to the first.
+DEFAULT_ANCHORS = {'d':None, 'w':5, 'm':1}
+
+Recurrence = namedtuple('Recurrence', ['count', 'unit', 'anchor'])
+
+
+# This function will parse a task period, raising ValidationError if it is
+#   not valid.
+def parse_period(period):
+    match = PERIOD_PATTERN.match(period or '')
+    if match is None:
+        raise ValidationError(f'Invalid period {period!r}.')
+    count, unit, anchor = match.groups()
+    if anchor is None:
+        anchor = DEFAULT_ANCHORS[unit]
+    else:
+        anchor = int(anchor)
+        if unit == 'd' or (unit == 'w' and anchor > 6) or \
+                (unit == 'm' and not 1 <= anchor <= 31):
+            raise ValidationError(f'Invalid period {period!r}.')
+    return Recurrence(int(count or 1), unit, anchor)
+
+
+# Returns True if the period is valid.
+def is_valid_period(period):
+    try:
+        parse_period(period)
+    except ValidationError:
+        return False
+    return True
+
+
+# This function will return the first due date of a task assigned today.
+# The task is due on the first anchor day on or after today, at the time of
+#   day of today.
+def first_due(period, today):
+    recurrence = parse_period(period)
+    if recurrence.unit == 'd':
+        return today
+    if recurrence.unit == 'w':
+        return today + timedelta(days=(recurrence.anchor - today.weekday()) % 7)
+    month = month_index(today)
+    if today.day > month_day(month, recurrence.anchor):
+        month += 1
+    return at_month(today, month, recurrence.anchor)
+
+
+# This function will return the due date following the completion of a task
+#   due on due, completed today.
+# The next due date is the earliest date in the task's series, which starts
+#   at its current due date, that is at least one period after today.
+# A monthly occurrence falls due at the start of the month it closes, so it
+#   must fall strictly after today plus the period.
+# The result is computed in constant time however far behind the task is.
+def next_due(period, due, today):
+    recurrence = parse_period(period)
+    if recurrence.unit in ('d', 'w'):
+        step = recurrence.count * (7 if recurrence.unit == 'w' else 1)
+        behind = (today.date() - due.date()).days + step
+        if behind <= 0:
+            return due
+        return due + timedelta(days=-(-behind // step) * step)
+
+    count, anchor = recurrence.count, recurrence.anchor
+    target = month_index(today) + count
+    target_day = min(today.day, month_day(target, 31))
+    start = month_index(due)
+    steps = max(0, -(-(target - start) // count))
+    month = start + steps * count
+    if month == target and month_day(month, anchor) <= target_day:
+        month += count
+    return at_month(due, month, anchor)
+
+
+# This function will return the due date an overdue task rolls forward to,
+#   as of today.
+# It is the earliest date in the task's series, which starts at its current
+#   due date, that falls on or after today, so today's occurrence is kept.
+def roll_forward(period, due, today):
+    recurrence = parse_period(period)
+    if recurrence.unit in ('d', 'w'):
+        step = recurrence.count * (7 if recurrence.unit == 'w' else 1)
+        behind = max(0, (today.date() - due.date()).days)
+        return due + timedelta(days=-(-behind // step) * step)
+
+    count, anchor = recurrence.count, recurrence.anchor
+    start, target = month_index(due), month_index(today)
+    month = start + -(-max(0, target - start) // count) * count
+    if month == target and month_day(month, anchor) < today.day:
+        month += count
+    return at_month(due, month, anchor)
+
+
+# Returns the number of months from year 0 to the month of a date.
+def month_index(day):
+    return day.year * 12 + day.month - 1
+
+
+# Returns the anchor day clamped to the length of a month.
+def month_day(month, anchor):
+    return min(anchor, monthrange(month // 12, month % 12 + 1)[1])
+
+
+# Returns a datetime on the anchor day of a month, at the time of day of a
+#   datetime.
+def at_month(moment, month, anchor):
+    return moment.replace(year=month // 12, month=month % 12 + 1,
+                          day=month_day(month, anchor))
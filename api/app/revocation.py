@@ -0,0 +1,88 @@
+import time
+from threading import Lock
+
+
+# The user id whose revocations apply to every user.
+ALL_USERS = 0
+
+# Rows are read again this many seconds before the newest one seen, so rows
+#   committed late by a slow transaction are not missed.
+SYNC_OVERLAP = 60
+
+
+# This extension holds the auth token revocations of the last
+#   TOKEN_REVOCATION_TTL seconds, the longest an auth token lives.
+# Tokens are refused if issued before their user's revocation, as after a
+#   password reset or the removal of the user.
+# The claims of tokens issued before their user's role or family changed are
+#   stale, and the user is loaded from the db instead.
+# Revocations are written to the token_revocations table by the session
+#   listeners in models.py, and each worker reads the new rows at most every
+#   TOKEN_REVOCATION_SYNC seconds, so the set is shared across workers.
+# A sync interval of None reads them only when a sync is forced, for a single
+#   process which applies its own revocations as they commit.
+class TokenRevocations:
+
+    def __init__(self, app=None):
+        self.revoked = {}
+        self.changed = {}
+        self.interval = 5
+        self.ttl = 86400
+        self.synced = None
+        self.newest = 0.0
+        self.lock = Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.revoked = {}
+        self.changed = {}
+        self.interval = app.config['TOKEN_REVOCATION_SYNC']
+        self.ttl = app.config['TOKEN_REVOCATION_TTL']
+        self.synced = None
+        self.newest = 0.0
+        app.extensions['token_revocations'] = self
+
+    # Return True if the user's tokens issued at the issued timestamp are
+    #   revoked.
+    def is_revoked(self, user_id, issued):
+        self.sync()
+        return issued < self.revoked.get(user_id, 0.0)
+
+    # Return True if the user's role or family changed after the as_of
+    #   timestamp.
+    def is_stale(self, user_id, as_of):
+        self.sync()
+        return as_of < max(self.changed.get(user_id, 0.0),
+                           self.changed.get(ALL_USERS, 0.0))
+
+    # Apply revocation rows of (user_id, revoked_at, changed_at, updated_at).
+    def apply(self, rows):
+        with self.lock:
+            for user_id, revoked_at, changed_at, updated_at in rows:
+                if revoked_at is not None:
+                    self.revoked[user_id] = max(revoked_at,
+                                                self.revoked.get(user_id, 0.0))
+                if changed_at is not None:
+                    self.changed[user_id] = max(changed_at,
+                                                self.changed.get(user_id, 0.0))
+                self.newest = max(self.newest, updated_at)
+
+    # Read the revocations written since the last sync, once the sync interval
+    #   has passed, and forget those older than any live token.
+    def sync(self, force=False):
+        now = time.monotonic()
+        if not force and (self.interval is None or self.synced is not None
+                          and now - self.synced < self.interval):
+            return
+        self.synced = now
+        from .models import TokenRevocation
+        self.apply(TokenRevocation.since(self.newest - SYNC_OVERLAP))
+        cutoff = time.time() - self.ttl
+        with self.lock:
+            for times in (self.revoked, self.changed):
+                for user_id in [u for u, at in times.items() if at < cutoff]:
+                    del times[user_id]
+
+    def stats(self):
+        return {'revoked':len(self.revoked), 'changed':len(self.changed)}
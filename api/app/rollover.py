@@ -0,0 +1,89 @@
+import numpy as np
+from datetime import date, datetime, time
+from . import db, recurrence
+from .cache import family_key, user_key
+from .models import Task, Family
+
+
+# This function will compute the due dates overdue tasks roll forward to as of
+#   today, following recurrence.roll_forward.
+# Periods are parsed by recurrence.parse_period. Daily and weekly series step
+#   a whole number of days from their due dates, and monthly series a whole
+#   number of months to their anchor day, clamped to shorter months. Each due
+#   date keeps its time of day.
+# periods and dues are sequences of the same length.
+def next_due_dates(periods, dues, today):
+    recurrences = [recurrence.parse_period(period) for period in periods]
+    counts = np.array([r.count for r in recurrences], dtype=np.int64)
+    units = np.array([r.unit for r in recurrences])
+    anchors = np.array([r.anchor or 0 for r in recurrences], dtype=np.int64)
+    dues = np.asarray(dues, dtype='datetime64[s]')
+    days = dues.astype('datetime64[D]')
+    today = np.datetime64(today, 'D')
+
+    steps = counts * np.where(units == 'w', 7, 1)
+    behind = np.maximum((today - days).astype(np.int64), 0)
+    stepped = days + -(-behind // steps) * steps
+
+    starts = days.astype('datetime64[M]')
+    target = today.astype('datetime64[M]')
+    months = starts + -(-np.maximum((target - starts).astype(np.int64), 0)
+                        // counts) * counts
+    months = np.where((months == target) & (anchor_days(months, anchors) < today),
+                      months + counts, months)
+
+    due = np.where(units == 'm', anchor_days(months, anchors), stepped)
+    return due + (dues - days)
+
+
+# Returns the anchor days of months, clamped to the length of each month.
+def anchor_days(months, anchors):
+    firsts = months.astype('datetime64[D]')
+    lengths = ((months + 1).astype('datetime64[D]') - firsts).astype(np.int64)
+    return firsts + np.minimum(anchors, lengths) - 1
+
+
+# This function will roll every overdue recurring task forward to its next due
+#   date as of today, chunk_size tasks per transaction.
+# Tasks whose period is not valid are left as they are.
+# Each chunk is written with a single executemany UPDATE, which skips the
+#   flush listeners, so the family versions, task revisions and task cache
+#   keys are handled here.
+# Returns the number of tasks rolled.
+def roll_overdue_tasks(today=None, chunk_size=5000):
+    today = today or date.today()
+    start = datetime.combine(today, time())
+    tasks = Task.__table__
+    update = tasks.update().where(tasks.c.id == db.bindparam('task_id'))\
+            .values(next_due=db.bindparam('next_due'),
+                    revision=db.func.coalesce(db.bindparam('revision'),
+                                              tasks.c.revision))
+    rolled = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(Task.id, Task.period, Task.next_due,
+                                Task.assigned_user_id, Task.family_id)\
+                .filter(Task.id > last_id, Task.next_due < start)\
+                .order_by(Task.id.asc()).limit(chunk_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        rows = [row for row in rows if recurrence.is_valid_period(row.period)]
+        if not rows:
+            continue
+        task_ids, periods, dues, user_ids, family_ids = zip(*rows)
+        due_dates = next_due_dates(periods, dues, today).astype(datetime)
+        versions = Family.bump_versions(db.session,
+                {family_id for family_id in family_ids if family_id is not None})
+        db.session.execute(update, [
+                {'task_id':task_id,
+                 'next_due':next_due,
+                 'revision':versions.get(family_id)}
+                for task_id, next_due, family_id
+                in zip(task_ids, due_dates, family_ids)])
+        keys = db.session.info.setdefault('task_cache_keys', set())
+        keys.update(family_key(family_id) for family_id in versions)
+        keys.update(user_key(user_id) for user_id in user_ids if user_id is not None)
+        db.session.commit()
+        rolled += len(rows)
+    return rolled
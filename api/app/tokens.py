@@ -0,0 +1,68 @@
+import hashlib
+import hmac
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer, \
+        BadData
+
+
+# This extension issues and verifies the signed tokens used for auth, email
+#   confirmation, email changes, password resets and family invitations.
+# Each token is signed for a purpose, such as 'auth' or 'reset', with a key
+#   derived once from SECRET_KEY and the purpose, so a token issued for one
+#   purpose is rejected for any other.
+# One serializer is kept per purpose and expiry, since building them and
+#   deriving their keys on every call is most of the cost of a token.
+class TokenSigner:
+
+    def __init__(self, app=None):
+        self.secret_key = None
+        self.keys = {}
+        self.serializers = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.secret_key = app.config['SECRET_KEY']
+        self.keys = {}
+        self.serializers = {}
+        app.extensions['tokens'] = self
+
+    # Return a token for the purpose carrying data, expiring after expires_in
+    #   seconds.
+    def issue(self, purpose, data, expires_in):
+        return self.serializer(purpose, expires_in).dumps(data).decode('utf-8')
+
+    # Return the data of a valid token issued for the purpose, and also its
+    #   header if return_header is set.
+    # Returns None for tokens which are malformed, expired, or signed for
+    #   another purpose.
+    def verify(self, purpose, token, return_header=False):
+        if not isinstance(token, (str, bytes)):
+            return None
+        # The expiry is read from the token header, so any serializer of the
+        #   purpose can check it.
+        try:
+            return self.serializer(purpose).loads(token,
+                                                  return_header=return_header)
+        except BadData:
+            return None
+
+    # Return the serializer of the purpose and expiry, building it on first
+    #   use.
+    def serializer(self, purpose, expires_in=None):
+        s = self.serializers.get((purpose, expires_in))
+        if s is None:
+            # A salt of None signs with the derived key as it is, instead of
+            #   deriving it again for every token.
+            s = Serializer(self.key(purpose), expires_in, salt=None)
+            self.serializers[(purpose, expires_in)] = s
+        return s
+
+    # Return the signing key of the purpose.
+    def key(self, purpose):
+        key = self.keys.get(purpose)
+        if key is None:
+            key = hmac.new(self.secret_key.encode('utf-8'),
+                           b'token:' + purpose.encode('utf-8'),
+                           hashlib.sha512).digest()
+            self.keys[purpose] = key
+        return key
@@ -0,0 +1,47 @@
+import os
+import tempfile
+import time
+from app import create_app, db
+from app.models import Role
+
+
+# Create an app backed by a temporary sqlite file, so commits pay for the
+#   same disk syncs as a deployed database.
+def bench_app():
+    app = create_app('testing')
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + path
+    app.app_context().push()
+    db.create_all()
+    Role.insert_roles()
+    return app
+
+
+# This will count the transactions committed while in use.
+class CommitCounter:
+
+    def __enter__(self):
+        self.count = 0
+        db.event.listen(db.engine, 'commit', self.on_commit)
+        return self
+
+    def __exit__(self, *args):
+        db.event.remove(db.engine, 'commit', self.on_commit)
+
+    def on_commit(self, conn):
+        self.count += 1
+
+
+# Time calls of f, returning the seconds taken by each.
+def timed(f, items):
+    times = []
+    for item in items:
+        start = time.perf_counter()
+        f(item)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+# Print a table row of results.
+def report(name, *columns):
+    print(f'{name:<28}' + ''.join(f'{column:>16}' for column in columns))
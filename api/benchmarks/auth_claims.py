@@ -0,0 +1,51 @@
+import argparse
+from flask_sqlalchemy import get_debug_queries
+from app import db, tokens, auth_cache
+from app.models import Family, User, Role, Permission
+from . import bench_app, timed, report
+
+
+# Authorize a token by loading its user, as the routes did before claims.
+def authorize_loaded(token):
+    user = User.query.get(tokens.verify('auth', token)['id'])
+    db.session.expunge_all()
+    return user.can(Permission.COMPLETE)
+
+
+# Authorize a token from its claims.
+def authorize_claims(token):
+    user = User.verify_auth_token(token)
+    db.session.expunge_all()
+    return user.can(Permission.COMPLETE)
+
+
+# Return the tokens per second and queries per token of f, with the auth cache
+#   cleared so every token is verified.
+def measure(f, items):
+    auth_cache.clear()
+    before = len(get_debug_queries())
+    seconds = sum(timed(f, items))
+    return len(items) / seconds, (len(get_debug_queries()) - before) / len(items)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark authorizing auth tokens.')
+    parser.add_argument('--users', type=int, default=2000)
+    args = parser.parse_args()
+    bench_app()
+    f = Family(family_name='bench')
+    users = [User(username=f'u{i}', family=f, role=Role.named('Leader'))
+             for i in range(args.users)]
+    db.session.add_all(users)
+    db.session.commit()
+    items = [u.generate_auth_token() for u in users]
+
+    report('authorization', 'tokens/sec', 'queries/token')
+    for name, f in (('user loaded', authorize_loaded),
+                    ('claims', authorize_claims)):
+        per_second, queries = measure(f, items)
+        report(name, f'{per_second:.0f}', f'{queries:.2f}')
+
+
+if __name__ == '__main__':
+    main()
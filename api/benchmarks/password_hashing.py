@@ -0,0 +1,67 @@
+import sys
+if '--gevent' in sys.argv:
+    # Patch before anything else is imported, as the gevent workers do.
+    from gevent import monkey
+    monkey.patch_all()
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Thread
+from app import create_app
+from app.hashing import PasswordHasher
+from . import report
+
+
+# Verify a password from each of clients threads, as concurrent logins would,
+#   returning the logins per second and the longest a ticking thread waited
+#   to run meanwhile, in milliseconds.
+# Under --gevent the threads are greenlets, and the wait is how long the other
+#   requests of a worker stall.
+def logins_per_second(hasher, password_hash, logins, clients):
+    ticks = [time.perf_counter()]
+    done = Event()
+    def tick():
+        while not done.is_set():
+            time.sleep(0.001)
+            ticks.append(time.perf_counter())
+    ticker = Thread(target=tick)
+    ticker.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        results = list(executor.map(lambda i: hasher.verify(password_hash, 'secret'),
+                                    range(logins)))
+    seconds = time.perf_counter() - start
+    done.set()
+    ticker.join()
+    assert all(results)
+    return logins / seconds, max(b - a for a, b in zip(ticks, ticks[1:])) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark password verification.')
+    parser.add_argument('--method', default='pbkdf2:sha256:150000')
+    parser.add_argument('--logins', type=int, default=64)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--pools', type=int, nargs='+', default=[0, 1, 2, 4])
+    parser.add_argument('--gevent', action='store_true',
+                        help='Run the clients as greenlets of a patched process.')
+    args = parser.parse_args()
+    app = create_app('testing')
+    app.config['PASSWORD_HASH_METHOD'] = args.method
+
+    report('pool size', 'logins/sec', 'max stall ms')
+    for workers in args.pools:
+        app.config['PASSWORD_HASH_WORKERS'] = workers
+        hasher = PasswordHasher(app)
+        password_hash = hasher.hash('secret')
+        # Start the pool before timing.
+        hasher.verify(password_hash, 'secret')
+        rate, stall = logins_per_second(hasher, password_hash, args.logins,
+                                        args.clients)
+        hasher.shutdown()
+        report('inline' if workers == 0 else str(workers), f'{rate:.1f}',
+               f'{stall:.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import argparse
+from statistics import mean, median
+from app import db
+from app.models import Family, User, Task, Subtask
+from . import bench_app, CommitCounter, timed, report
+
+
+# Completion as it was before it was collapsed into one transaction, with a
+#   commit per subtask and another for the due date.
+def legacy_complete(task):
+    for subtask in task.subtasks:
+        subtask.is_complete = False
+        db.session.add(subtask)
+        db.session.commit()
+    task.update_next_due()
+
+
+# Load tasks whose subtasks are all complete.
+def load_tasks(count, subtasks):
+    f = Family(family_name='bench')
+    db.session.add(f)
+    db.session.commit()
+    u = User(username=f'bench{f.id}', family=f)
+    db.session.add(u)
+    db.session.commit()
+    tasks = [Task(taskname=f't{i}', period='w', assigned_user=u) for i in range(count)]
+    db.session.add_all(tasks)
+    db.session.commit()
+    db.session.bulk_insert_mappings(Subtask, [
+        {'task_id':t.id, 'subtask_name':f's{i}', 'is_complete':True}
+        for t in tasks for i in range(subtasks)])
+    db.session.commit()
+    return tasks
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Task.complete().')
+    parser.add_argument('--tasks', type=int, default=200)
+    parser.add_argument('--subtasks', type=int, default=5)
+    args = parser.parse_args()
+    bench_app()
+
+    report('path', 'commits/task', 'mean ms', 'median ms')
+    for name, complete in (('before (commit per subtask)', legacy_complete),
+                           ('after (single transaction)', Task.complete)):
+        tasks = load_tasks(args.tasks, args.subtasks)
+        with CommitCounter() as commits:
+            times = timed(complete, tasks)
+        report(name, f'{commits.count / len(tasks):.1f}',
+               f'{mean(times) * 1000:.2f}', f'{median(times) * 1000:.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+import argparse
+from datetime import datetime
+from statistics import median
+from flask import json
+from app import db, fragment_cache, response_encoder
+from app.models import Family, User, Task, Subtask
+from . import bench_app, timed, report
+
+
+# Serialize tasks as they were before fragments, with the clock read for
+#   every task.
+def legacy_list_to_json(tasks):
+    subtasks = {}
+    for subtask in Subtask.query.filter(Subtask.task_id.in_([t.id for t in tasks]))\
+            .order_by(Subtask.id.asc()).all():
+        subtasks.setdefault(subtask.task_id, []).append(subtask)
+    return [{'id':task.id,
+             'taskname':task.taskname,
+             'next_due':task.next_due.strftime('%x'),
+             'subtasks':[subtask.to_json() for subtask in subtasks.get(task.id, [])],
+             'assignee':task.assigned_user.username,
+             'overdue':task.next_due < datetime.today()}
+            for task in tasks]
+
+
+# Load a family with tasks of several subtasks each.
+def load_family(count, subtasks):
+    f = Family(family_name='bench')
+    u = User(username='bench', family=f)
+    db.session.add_all([f, u])
+    db.session.commit()
+    tasks = [Task(taskname=f't{i}', period='w', assigned_user=u) for i in range(count)]
+    db.session.add_all(tasks)
+    db.session.commit()
+    db.session.add_all([Subtask(task_id=t.id, subtask_name=f's{i}')
+                        for t in tasks for i in range(subtasks)])
+    db.session.commit()
+    return f
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark getTasks payload encoding.')
+    parser.add_argument('--tasks', type=int, default=2000)
+    parser.add_argument('--subtasks', type=int, default=5)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+    bench_app()
+    f = load_family(args.tasks, args.subtasks)
+    tasks = f.get_family_tasks()
+    runs = range(args.runs)
+
+    # The payload is built from loaded rows, as on a task cache miss, and
+    #   encoded, as on every response.
+    def legacy(i):
+        json.dumps({'familyTasks':legacy_list_to_json(tasks)})
+
+    def fragments_cold(i):
+        fragment_cache.clear()
+        response_encoder.dumps({'familyTasks':Task.list_to_json(tasks)})
+
+    def fragments_warm(i):
+        response_encoder.dumps({'familyTasks':Task.list_to_json(tasks)})
+
+    cached = {'familyTasks':Task.list_to_json(tasks)}
+    cached_legacy = {'familyTasks':legacy_list_to_json(tasks)}
+
+    report(f'{args.tasks} tasks', 'median ms', 'payload KiB')
+    for name, f, payload in (
+            ('jsonify (before)', legacy, json.dumps(cached_legacy).encode()),
+            ('fragments, cold', fragments_cold, response_encoder.dumps(cached)),
+            ('fragments, warm', fragments_warm, response_encoder.dumps(cached))):
+        report(name, f'{median(timed(f, runs)) * 1000:.1f}', f'{len(payload) / 1024:.0f}')
+
+    # Task cache hits only encode the cached list.
+    report('cache hit, jsonify (before)',
+           f'{median(timed(lambda i: json.dumps(cached_legacy), runs)) * 1000:.1f}', '')
+    report('cache hit, fragments',
+           f'{median(timed(lambda i: response_encoder.dumps(cached), runs)) * 1000:.1f}', '')
+
+
+if __name__ == '__main__':
+    main()
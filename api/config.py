@@ -23,13 +23,49 @@ class Config:
     MAIL_PREFIX = os.environ.get('MAIL_PREFIX','hunnydu - ')
     MAIL_SENDER = 'hunnydu Admin <hunnydu.io>'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    POST_PER_PAGE = 20
+    TASKS_PER_PAGE = 20
+    TASKS_MAX_PER_PAGE = 100
+    TASKS_BULK_LIMIT = 100
     COMMENT_PER_PAGE = 50
     FLASK_FOLLOWERS_PER_PAGE = 50
     CHROME_DRIVER_URI = os.path.join(basedir,'venv/chromedriver')
     SQLALCHEMY_RECORD_QUERIES = True
     SLOW_DB_QUERY_TIME = 0.5
     SSL_REDIRECT = False
+    EVENT_BROKER = os.environ.get('EVENT_BROKER','local')
+    EVENT_QUEUE_SIZE = 100
+    EVENT_STREAM_HEARTBEAT = 15
+    EVENT_POLL = 1
+    EVENT_GAP_GRACE = 5
+    EVENT_RETENTION = 60
+    TOMBSTONE_RETENTION = 30 * 86400
+    TASK_CACHE_BACKEND = os.environ.get('TASK_CACHE_BACKEND','memory')
+    TASK_CACHE_TTL = 300
+    TASK_CACHE_MAX_ENTRIES = 1000
+    TASK_CACHE_MAX_BYTES = 32 * 1024 * 1024
+    AUTH_CACHE_BACKEND = os.environ.get('AUTH_CACHE_BACKEND','memory')
+    AUTH_CACHE_TTL = 60
+    AUTH_CACHE_MAX_ENTRIES = 10000
+    AUTH_CACHE_MAX_BYTES = 8 * 1024 * 1024
+    ROLE_REGISTRY_TTL = 60
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD',
+        'pbkdf2:sha256:150000')
+    PASSWORD_SALT_LENGTH = 8
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS','2'))
+    PASSWORD_HASH_QUEUE = 64
+    LEGACY_BODY_MAX_LENGTH = 64 * 1024
+    JSON_ENCODER = os.environ.get('JSON_ENCODER','auto')
+    FRAGMENT_CACHE_TTL = 3600
+    FRAGMENT_CACHE_MAX_ENTRIES = 50000
+    FRAGMENT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+    TOKEN_REVOCATION_SYNC = 5
+    TOKEN_REVOCATION_TTL = 86400
+    EMAIL_OUTBOX_WORKERS = int(os.environ.get('EMAIL_OUTBOX_WORKERS','2'))
+    EMAIL_OUTBOX_BATCH = 20
+    EMAIL_OUTBOX_LEASE = 300
+    EMAIL_OUTBOX_POLL = 15
+    EMAIL_OUTBOX_BACKOFF = 30
+    EMAIL_OUTBOX_MAX_ATTEMPTS = 5
 
     @staticmethod
     def init_app(app):
@@ -49,6 +85,10 @@ class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL',
         'sqlite://')
     WTF_CSRF_ENABLED = False
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    PASSWORD_HASH_WORKERS = 0
+    TOKEN_REVOCATION_SYNC = None
+    EMAIL_OUTBOX_WORKERS = 0
 
 
 # Create the production configuration.
@@ -56,6 +96,7 @@ class ProductionConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL',
         'sqlite:///'+ os.path.join(basedir,'data.sqlite'))
     SSL_REDIRECT = True
+    EVENT_BROKER = os.environ.get('EVENT_BROKER','database')
 
     # Provide for error logging.
     @classmethod
@@ -1,7 +1,8 @@
 import os
 
 from app import create_app, db
-from app.models import Permission, User, Task, Role, Subtask, Family
+from app.models import Permission, User, Task, Role, Subtask, Family, \
+        TaskCompletionDay, Tombstone
 from flask_migrate import Migrate, upgrade
 
 COV = None
@@ -51,6 +52,57 @@ def deploy():
     # Create/update user roles
     Role.insert_roles()
 
+# Recomputes the subtask counters of every task.
+@app.cli.command('repair-counts')
+@click.option('--batch-size',default=1000,
+    help='Number of tasks repaired per transaction.')
+def repair_counts(batch_size):
+    """Recompute the task subtask counters."""
+    repaired = Task.repair_counts(batch_size)
+    print(f'Repaired {repaired} tasks.')
+
+# Rebuilds the daily completion rollups from the completion history.
+@app.cli.command('rollup-completions')
+@click.option('--batch-size',default=1000,
+    help='Number of rollup rows inserted per statement.')
+def rollup_completions(batch_size):
+    """Rebuild the daily task completion rollups."""
+    written = TaskCompletionDay.rebuild(batch_size)
+    print(f'Wrote {written} rollup rows.')
+
+# Rolls every overdue task forward to its next due date, and prunes the
+#   expired tombstones.
+@app.cli.command()
+@click.option('--date','today',type=click.DateTime(formats=['%Y-%m-%d']),
+    default=None,help='Day to roll the tasks to, defaults to today.')
+@click.option('--chunk-size',default=5000,
+    help='Number of tasks rolled per transaction.')
+def rollover(today, chunk_size):
+    """Roll overdue tasks to their next due date."""
+    from app.rollover import roll_overdue_tasks
+    rolled = roll_overdue_tasks(today.date() if today else None, chunk_size)
+    print(f'Rolled {rolled} tasks.')
+    pruned = Tombstone.expire(app.config['TOMBSTONE_RETENTION'])
+    print(f'Pruned {pruned} tombstones.')
+
+# Sends the emails queued in the outbox.
+@app.cli.command('send-emails')
+@click.option('--watch/--no-watch',default=False,
+    help='Keep sending emails as they are queued.')
+def send_emails(watch):
+    """Send the emails queued in the outbox."""
+    from app import email_outbox
+    if watch:
+        email_outbox.run()
+        return
+    attempted = 0
+    while True:
+        batch = email_outbox.drain()
+        if not batch:
+            break
+        attempted += batch
+    print(f'Sent {email_outbox.sent} of {attempted} emails.')
+
 @app.cli.command()
 @click.option('--coverage/--no-coverage',default=False,
     help='Run tests under code coverage.')
@@ -0,0 +1,91 @@
+import email
+import socketserver
+from threading import Thread
+
+
+# This is a local SMTP server standing in for the mail server in tests.
+# It keeps the (sender, recipients, message) of each email it accepts, and
+#   refuses the recipients in reject.
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super(SMTPStandIn, self).__init__(('127.0.0.1', 0), SMTPHandler)
+        self.messages = []
+        self.reject = set()
+        self.thread = Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    # Point the app's mail settings at the stand-in, with sending enabled.
+    def configure(self, app, mail):
+        app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=self.port,
+                          MAIL_USE_TLS=False, MAIL_USE_SSL=False,
+                          MAIL_USERNAME=None, MAIL_PASSWORD=None,
+                          MAIL_SUPPRESS_SEND=False)
+        mail.init_app(app)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+# This answers one SMTP session.
+class SMTPHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        self.reply('220 localhost SMTP stand-in')
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8').strip()
+            verb = command[:4].upper()
+            if verb in ('HELO', 'EHLO'):
+                self.reply('250 localhost')
+            elif verb == 'MAIL':
+                sender, recipients = address(command), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                if address(command) in self.server.reject:
+                    self.reply('550 Mailbox unavailable')
+                else:
+                    recipients.append(address(command))
+                    self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                self.server.messages.append(
+                        (sender, recipients, email.message_from_bytes(self.data())))
+                self.reply('250 OK')
+            elif verb in ('RSET', 'NOOP'):
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+    # Returns the message lines up to the terminating dot.
+    def data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if line in (b'.\r\n', b'.\n', b''):
+                return b''.join(lines)
+            lines.append(line[1:] if line.startswith(b'..') else line)
+
+    def reply(self, text):
+        self.wfile.write(text.encode('utf-8') + b'\r\n')
+
+
+# Returns the address of a MAIL or RCPT command.
+def address(command):
+    return command.split(':', 1)[1].strip().split(' ')[0].strip('<>')
@@ -0,0 +1,136 @@
+import unittest
+import json
+from datetime import date, datetime, timedelta
+from app import create_app, db
+from app.models import User, Role, Family, Task, Subtask, TaskCompletion, \
+        TaskCompletionDay
+
+
+# Test the task completion history and analytics routes.
+class AnalyticsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client(use_cookies=True)
+        self.f = Family(family_name='f')
+        db.session.add(self.f)
+        db.session.commit()
+        self.u1 = User(username='u1', email='u1', password='u1', family=self.f)
+        self.u2 = User(username='u2', email='u2', password='u2', family=self.f)
+        db.session.add_all([self.u1, self.u2])
+        db.session.commit()
+        self.t1 = Task(taskname='t1', period='d', assigned_user=self.u1)
+        self.t2 = Task(taskname='t2', period='w', assigned_user=self.u2)
+        db.session.add_all([self.t1, self.t2])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    # Helper to post to the api as u1.
+    def post(self, url):
+        data = {'auth':{'email_or_token':self.u1.generate_auth_token()}}
+        return self.client.post(url, data=json.dumps(data),
+                                content_type='application/json')
+
+    # Test completions are recorded and rolled up with the completion.
+    def test_record_completion(self):
+        due = self.t1.next_due
+        st = Subtask(subtask_name='s', task_id=self.t1.id)
+        db.session.add(st)
+        db.session.commit()
+        st.complete()
+        self.t1.complete()
+        completions = TaskCompletion.query.order_by(TaskCompletion.id).all()
+        self.assertEqual(len(completions), 2)
+        self.assertEqual(completions[0].task_id, self.t1.id)
+        self.assertEqual(completions[0].family_id, self.f.id)
+        self.assertEqual(completions[0].user_id, self.u1.id)
+        self.assertEqual(completions[0].due, due)
+        day = TaskCompletionDay.query.one()
+        self.assertEqual((day.user_id, day.day, day.count),
+                         (self.u1.id, date.today(), 2))
+        self.assertEqual(day.week.weekday(), 6)
+
+        # Rolled back completions leave no history.
+        self.t2.complete(commit=False)
+        db.session.rollback()
+        self.assertEqual(TaskCompletion.query.count(), 2)
+
+    # Test a first completion which loses the insert to a concurrent one is
+    #   added to the row the other created.
+    # The savepoints leave the cache invalidations and outbox wake up pending
+    #   until the transaction commits.
+    def test_increment_race(self):
+        today = date.today()
+        self.t1.taskname = 'renamed'
+        db.session.flush()
+        db.session.info['email_outbox'] = True
+        keys = set(db.session.info['task_cache_keys'])
+
+        # Another completion creates the row just before the insert.
+        def concurrent(conn, name):
+            conn.connection.cursor().execute(
+                    'INSERT INTO task_completion_days '
+                    '(family_id, user_id, day, week, count) VALUES (?, ?, ?, ?, 1)',
+                    (self.f.id, self.u1.id, today.isoformat(),
+                     TaskCompletionDay.week_of(today).isoformat()))
+        db.event.listen(db.engine, 'savepoint', concurrent, once=True)
+        TaskCompletionDay.increment(self.f.id, self.u1.id, today, 2)
+        TaskCompletionDay.increment(self.f.id, self.u1.id, today)
+        TaskCompletionDay.increment(self.f.id, self.u2.id, today)
+        self.assertEqual(db.session.info['task_cache_keys'], keys)
+        self.assertTrue(db.session.info['email_outbox'])
+        db.session.commit()
+        self.assertNotIn('task_cache_keys', db.session.info)
+        self.assertNotIn('email_outbox', db.session.info)
+        self.assertEqual(sorted((d.user_id, d.count)
+                                for d in TaskCompletionDay.query.all()),
+                         [(self.u1.id, 4), (self.u2.id, 1)])
+
+    # Test rebuilding the rollups from the history.
+    def test_rebuild(self):
+        today = datetime.today()
+        for days_ago, task in ((0, self.t1), (0, self.t1), (1, self.t2), (9, self.t2)):
+            TaskCompletion.record(task, today - timedelta(days=days_ago))
+        db.session.commit()
+        before = sorted((d.user_id, d.day, d.week, d.count)
+                        for d in TaskCompletionDay.query.all())
+        self.assertEqual(len(before), 3)
+        TaskCompletionDay.query.update({TaskCompletionDay.count:0})
+        db.session.commit()
+        self.assertEqual(TaskCompletionDay.rebuild(batch_size=2), 3)
+        self.assertEqual(sorted((d.user_id, d.day, d.week, d.count)
+                                for d in TaskCompletionDay.query.all()), before)
+
+    # Test the per member and per week routes.
+    def test_routes(self):
+        today = datetime.today()
+        for days_ago, task in ((0, self.t1), (0, self.t1), (2, self.t2), (40, self.t2)):
+            TaskCompletion.record(task, today - timedelta(days=days_ago))
+        db.session.commit()
+
+        response = self.post('/api/analytics/members?days=7')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(m['username'], m['completions'])
+                          for m in response.get_json()['members']],
+                         [('u1', 2), ('u2', 1)])
+        response = self.post('/api/analytics/members?days=60')
+        self.assertEqual([m['completions'] for m in response.get_json()['members']],
+                         [2, 2])
+
+        response = self.post('/api/analytics/weeks?weeks=8')
+        weeks = response.get_json()['weeks']
+        self.assertEqual(len(weeks), 8)
+        self.assertEqual(weeks[-1]['week'],
+                         TaskCompletionDay.week_of(date.today()).isoformat())
+        self.assertEqual(sum(w['completions'] for w in weeks), 4)
+        counts = {w['week']:w['completions'] for w in weeks}
+        self.assertEqual(counts[TaskCompletionDay.week_of(
+                (today - timedelta(days=40)).date()).isoformat()], 1)
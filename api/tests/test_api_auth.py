@@ -3,7 +3,8 @@ import re
 from base64 import b64encode
 import json
 from flask import url_for
-from app import create_app, db
+from flask_sqlalchemy import get_debug_queries
+from app import create_app, db, auth_cache
 from app.models import User, Role, Family
 
 
@@ -154,6 +155,125 @@ class APITestCase(unittest.TestCase):
         self.assertEqual(response.get_json()['isLeader'],True)
 
 
+    # Test login and getFamily load the family in the same number of queries
+    #   for families of any size.
+    def test_family_summary_queries(self):
+        u,f,u2 = load_user(True, True, True)
+        token = u.generate_auth_token()
+        counts = []
+        for size in (2, 12):
+            db.session.add_all([User(username=f'm{size}-{i}', family_id=f.id)
+                                for i in range(size - len(f.members.all()))])
+            db.session.commit()
+            db.session.expire_all()
+            auth_cache.clear()
+
+            before = len(get_debug_queries())
+            response = self.client.post('/api/auth/login',
+                    data=json.dumps({
+                        'auth':{"email_or_token":"u", "password":"u"}
+                    }),
+                    content_type='application/json')
+            login_queries = len(get_debug_queries()) - before
+            self.assertEqual(len(response.get_json()['members']), size)
+            self.assertEqual(response.get_json()['leaders'], 1)
+
+            before = len(get_debug_queries())
+            response = self.client.post('/api/auth/getFamily',
+                    data=json.dumps({
+                        'auth':{"email_or_token":token}
+                    }),
+                    content_type='application/json')
+            family_queries = len(get_debug_queries()) - before
+            members = response.get_json()['members']
+            self.assertEqual(len(members), size)
+            self.assertEqual(members[0], {'name':'u', 'id':u.id,
+                    'isLeader':True, 'isOnlyLeader':True})
+            self.assertFalse(members[1]['isLeader'])
+            counts.append((login_queries, family_queries))
+        self.assertEqual(counts[0], counts[1])
+        # Login loads the user and the roster, and getFamily, authorized by
+        #   the token claims, reads the family version for its ETag and the
+        #   roster.
+        self.assertEqual(counts[0], (2, 2))
+
+
+    # Test ETags and 304 responses for the /api/auth/getFamily route.
+    def test_getFamily_etag(self):
+        u,f,u2 = load_user(True, True, True)
+        token = u.generate_auth_token()
+        data = json.dumps({'auth':{"email_or_token":token}})
+
+        response = self.client.post('/api/auth/getFamily', data=data,
+                content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+
+        # Test unchanged family.
+        response = self.client.post('/api/auth/getFamily', data=data,
+                content_type='application/json',
+                headers={'If-None-Match':etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b'')
+
+        # Test member change.
+        post_body = '{"id":' + f'{u2.id}' + '}'
+        response = self.client.post('/api/auth/makeLeader',
+                data=json.dumps({
+                    'auth':{"email_or_token":token},
+                    'body':post_body
+                }),
+                content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post('/api/auth/getFamily', data=data,
+                content_type='application/json',
+                headers={'If-None-Match':etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['leaders'], 2)
+
+
+    # Test reads over GET with an Authorization header.
+    def test_bearer_auth(self):
+        u,f,u2 = load_user(True, True, True)
+        headers = {'Authorization':f'Bearer {u.generate_auth_token()}'}
+
+        response = self.client.get('/api/auth/getFamily', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.get_json()['members']), 2)
+        self.assertIn('Authorization', response.headers['Vary'])
+        etag = response.headers['ETag']
+        response = self.client.get('/api/auth/getFamily',
+                headers=dict(headers, **{'If-None-Match':etag}))
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get('/api/getTasks', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(f'/api/users/{u2.id}', headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+        # The header takes precedence over the body.
+        response = self.client.post('/api/getTasks', headers=headers,
+                data=json.dumps({'auth':{'email_or_token':'bad'}}),
+                content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+        # Test invalid and missing tokens.
+        response = self.client.get('/api/getTasks',
+                headers={'Authorization':'Bearer bad'})
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get('/api/getTasks',
+                headers={'Authorization':'Basic dTp1'})
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get('/api/getTasks')
+        self.assertEqual(response.status_code, 401)
+
+        # Test JSON bodies which are not an object are anonymous.
+        for body in ('[]', '"auth"', '1', '{"auth":[]}', '{"auth":"t"}'):
+            response = self.client.post('/api/getTasks', data=body,
+                    content_type='application/json')
+            self.assertEqual(response.status_code, 401, body)
+
+
     # Test the /api/auth/registration route.
     def test_registerUser(self):
         u,f = load_user(True)
@@ -358,7 +478,7 @@ class APITestCase(unittest.TestCase):
     # Tests the /api/auth/validateResetRequest route.
     def test_validateResetRequest(self):
         u,f = load_user()
-        token = u.generate_confirmation_token()
+        token = u.generate_reset_token()
 
         # Test for invalid token.
         post_body = '{"email":"nobody"}'
@@ -383,7 +503,7 @@ class APITestCase(unittest.TestCase):
     # Tests the /api/auth/processPasswordReset route.
     def test_processPasswordReset(self):
         u,f = load_user()
-        token = u.generate_confirmation_token()
+        token = u.generate_reset_token()
 
         # Test for invalid token.
         post_body = '{"token":' + 'None' + ',"password":"new"}'
@@ -0,0 +1,456 @@
+import unittest
+import json
+from datetime import datetime
+from flask_sqlalchemy import get_debug_queries
+from app import create_app, db, auth_cache
+from app.models import User, Role, Family, Task, Subtask, Tombstone
+from benchmarks import CommitCounter
+
+
+# This will load a family with a leader and a second member for testing.
+def load_family():
+    f = Family(family_name='f')
+    db.session.add(f)
+    db.session.commit()
+    u = User(username='u', email='u', password='u', family_id=f.id,
+             role=Role.query.filter_by(name='Leader').first(),
+             confirmed=True)
+    u2 = User(username='u2', email='u2', password='u2', family_id=f.id,
+              confirmed=True)
+    db.session.add(u)
+    db.session.add(u2)
+    db.session.commit()
+    return u,f,u2
+
+
+# This will add tasks with two subtasks each, alternating assignees.
+def load_tasks(users, count):
+    tasks = []
+    for i in range(count):
+        t = Task(taskname=f't{i}', period='d', assigned_user=users[i % len(users)])
+        db.session.add(t)
+        tasks.append(t)
+    db.session.commit()
+    for t in tasks:
+        db.session.add(Subtask(subtask_name='s1', task_id=t.id))
+        db.session.add(Subtask(subtask_name='s2', task_id=t.id))
+    db.session.commit()
+    return tasks
+
+
+# This will test the task api functions of this app.
+class TaskAPITestCase(unittest.TestCase):
+
+    #  Setup for the test.
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client(use_cookies=True)
+
+
+    # Remove upon completion of the test.
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+
+    # Helper to post to the api with the provided token.
+    def post(self, url, token, body=None, headers=None):
+        data = {'auth':{"email_or_token":token}}
+        if body is not None:
+            data['body'] = body
+        return self.client.post(url, data=json.dumps(data),
+                content_type='application/json', headers=headers)
+
+
+    # Helper to count the queries issued by a request to /api/getTasks.
+    # The auth cache is cleared so every count includes verifying the token.
+    def count_get_tasks_queries(self, token):
+        auth_cache.clear()
+        before = len(get_debug_queries())
+        response = self.post('/api/getTasks', token)
+        self.assertEqual(response.status_code, 200)
+        return len(get_debug_queries()) - before, response
+
+
+    # Test the /api/getTasks route.
+    def test_get_tasks(self):
+        u,f,u2 = load_family()
+        load_tasks([u, u2], 4)
+        token = u.generate_auth_token()
+        db.session.expire_all()
+
+        response = self.post('/api/getTasks', token)
+        self.assertEqual(response.status_code, 200)
+        tasks = response.get_json()['tasks']
+        family_tasks = response.get_json()['familyTasks']
+        self.assertEqual(len(tasks), 2)
+        self.assertEqual(len(family_tasks), 4)
+        self.assertEqual({t['assignee'] for t in family_tasks}, {'u', 'u2'})
+        for t in family_tasks:
+            self.assertEqual([st['subtask_name'] for st in t['subtasks']],
+                             ['s1', 's2'])
+            self.assertTrue(all(st['task_id'] == t['id'] for st in t['subtasks']))
+
+
+    # Test that /api/getTasks uses a fixed number of queries as tasks grow.
+    def test_get_tasks_query_count(self):
+        u,f,u2 = load_family()
+        token = u.generate_auth_token()
+
+        load_tasks([u, u2], 2)
+        db.session.expire_all()
+        small, response = self.count_get_tasks_queries(token)
+        self.assertEqual(len(response.get_json()['familyTasks']), 2)
+
+        load_tasks([u, u2], 60)
+        db.session.expire_all()
+        large, response = self.count_get_tasks_queries(token)
+        self.assertEqual(len(response.get_json()['familyTasks']), 62)
+        self.assertEqual(small, large)
+
+
+    # Test ETags and 304 responses for /api/getTasks.
+    def test_get_tasks_etag(self):
+        u,f,u2 = load_family()
+        tasks = load_tasks([u, u2], 2)
+        token = u.generate_auth_token()
+
+        response = self.post('/api/getTasks', token)
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+
+        # Unchanged family is answered without a body or task queries.
+        before = len(get_debug_queries())
+        response = self.post('/api/getTasks', token, headers={'If-None-Match':etag})
+        queries = get_debug_queries()[before:]
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b'')
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertFalse(any('tasks' in q.statement for q in queries))
+
+        # Each write to the family's tasks changes the ETag.
+        writes = [
+            ('/api/change_subtask_complete/1', None),
+            ('/api/add_subtask/1', '{"subtask_name":"s3"}'),
+            ('/api/delete_subtask/3', None),
+            ('/api/tasks', '{"taskname":"t","period":"d","assignee":2,"subtasks":"[\'s\']"}'),
+            (f'/api/delete_task/{tasks[1].id}', None)]
+        for url, body in writes:
+            response = self.post(url, token, body)
+            self.assertIn(response.status_code, (200, 201), url)
+            response = self.post('/api/getTasks', token, headers={'If-None-Match':etag})
+            self.assertEqual(response.status_code, 200, url)
+            self.assertNotEqual(response.headers['ETag'], etag)
+            etag = response.headers['ETag']
+
+        # ETags are per user.
+        response = self.post('/api/getTasks', u2.generate_auth_token(),
+                             headers={'If-None-Match':etag})
+        self.assertEqual(response.status_code, 200)
+
+
+    # Test cursor pagination of /api/getTasks.
+    def test_get_tasks_pagination(self):
+        u,f,u2 = load_family()
+        tasks = load_tasks([u, u2], 25)
+        # Share due dates so pages must break ties on id.
+        for i, t in enumerate(tasks):
+            t.next_due = t.next_due.replace(day=1 + i % 3)
+        db.session.commit()
+        token = u.generate_auth_token()
+        expected = [t.id for t in sorted(tasks, key=lambda t: (t.next_due, t.id))]
+
+        seen = []
+        cursor = ''
+        while cursor is not None:
+            response = self.post(f'/api/getTasks?per_page=10&family_cursor={cursor}', token)
+            self.assertEqual(response.status_code, 200)
+            page = response.get_json()['familyTasks']
+            self.assertLessEqual(len(page), 10)
+            seen += [t['id'] for t in page]
+            cursor = response.get_json()['familyTasksCursor']
+        self.assertEqual(seen, expected)
+
+        # Personal tasks are paginated independently.
+        response = self.post('/api/getTasks?per_page=5', token)
+        self.assertEqual(len(response.get_json()['tasks']), 5)
+        self.assertIsNotNone(response.get_json()['tasksCursor'])
+        self.assertTrue(all(t['assignee'] == 'u' for t in response.get_json()['tasks']))
+
+        # Test invalid cursor.
+        response = self.post('/api/getTasks?family_cursor=bum_cursor', token)
+        self.assertEqual(response.status_code, 400)
+
+        # Test unpaginated requests return everything.
+        response = self.post('/api/getTasks', token)
+        self.assertEqual(len(response.get_json()['familyTasks']), 25)
+        self.assertNotIn('familyTasksCursor', response.get_json())
+
+    # Test /api/tasks rejects subtasks which are not a list of 1 to 5 names,
+    #   sent as a list or a string literal.
+    def test_new_task_subtasks(self):
+        u,f,u2 = load_family()
+        token = u.generate_auth_token()
+        for subtasks in ('"5"', '{"s":1}', '[1,2]', '[""]', '["s","s","s","s","s","s"]',
+                         '"[\'s\'"', '[]', '"[]"'):
+            body = '{"taskname":"t","period":"d","assignee":1,"subtasks":%s}' % subtasks
+            response = self.post('/api/tasks', token, body)
+            self.assertEqual(response.status_code, 400, subtasks)
+        self.assertEqual(Task.query.count(), 0)
+
+        body = '{"taskname":"t","period":"d","assignee":1,"subtasks":["s1","s2"]}'
+        response = self.post('/api/tasks', token, body)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([s.subtask_name for s in Task.query.one().subtasks],
+                         ['s1', 's2'])
+
+    # Test the /api/tasks/bulk route.
+    def test_new_tasks_bulk(self):
+        u,f,u2 = load_family()
+        token = u.generate_auth_token()
+
+        # Test a user without leader permissions.
+        body = '{"tasks":[{"taskname":"a","period":"d","assignee":1,"subtasks":["s"]}]}'
+        response = self.post('/api/tasks/bulk', u2.generate_auth_token(), body)
+        self.assertEqual(response.status_code, 403)
+
+        # Test one invalid task rejects the whole batch.
+        body = str({'tasks':[
+            {'taskname':'a', 'period':'d', 'assignee':1, 'subtasks':['s']},
+            {'taskname':'b', 'assignee':1, 'subtasks':['s']}]})
+        response = self.post('/api/tasks/bulk', token, body)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['index'], 1)
+        self.assertEqual(Task.query.count(), 0)
+
+        # Test a task without subtasks.
+        body = str({'tasks':[{'taskname':'a', 'period':'d', 'assignee':1}]})
+        response = self.post('/api/tasks/bulk', token, body)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Task.query.count(), 0)
+        body = str({'tasks':[{'taskname':'a', 'period':'d', 'assignee':1,
+                              'subtasks':[]}]})
+        response = self.post('/api/tasks/bulk', token, body)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Task.query.count(), 0)
+
+        # Test too many subtasks.
+        body = str({'tasks':[{'taskname':'a', 'period':'d', 'assignee':1,
+                              'subtasks':['s'] * 6}]})
+        response = self.post('/api/tasks/bulk', token, body)
+        self.assertEqual(response.status_code, 400)
+
+        # Test a valid batch, with list and string literal subtasks.
+        body = str({'tasks':[
+            {'taskname':'a', 'period':'d', 'assignee':1, 'subtasks':['s1', 's2']},
+            {'taskname':'b', 'period':'w', 'assignee':2, 'subtasks':"['s3']"}]})
+        before = len(get_debug_queries())
+        response = self.post('/api/tasks/bulk', token, body)
+        inserts = [q for q in get_debug_queries()[before:]
+                   if q.statement.startswith('INSERT INTO subtasks')]
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(inserts), 1)
+        ids = response.get_json()['ids']
+        self.assertEqual([Task.query.get(i).taskname for i in ids], ['a', 'b'])
+        self.assertEqual([s.subtask_name for s in Task.query.get(ids[0]).subtasks],
+                         ['s1', 's2'])
+        self.assertEqual(Task.query.get(ids[1]).assigned_user, u2)
+        self.assertEqual(Subtask.query.count(), 3)
+
+        # Test the queries do not grow with the batch, besides the task inserts
+        #   which fetch each new id.
+        def count_queries(size):
+            body = str({'tasks':[{'taskname':f't{i}', 'period':'d',
+                                  'assignee':1 + i % 2, 'subtasks':['s1', 's2']}
+                                 for i in range(size)]}).replace("'", '"')
+            db.session.expire_all()
+            before = len(get_debug_queries())
+            response = self.post('/api/tasks/bulk', token, body)
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.get_json()['ids']), size)
+            return len([q for q in get_debug_queries()[before:]
+                        if not q.statement.startswith('INSERT INTO tasks')])
+        self.assertEqual(count_queries(2), count_queries(20))
+
+    # Test the /api/subtasks/complete route.
+    def test_change_subtasks_complete(self):
+        u,f,u2 = load_family()
+        t1, t2 = load_tasks([u, u2], 2)
+        s1, s2 = t1.subtasks.all()
+        s3, s4 = t2.subtasks.all()
+        first_due = t1.next_due
+        token = u2.generate_auth_token()
+
+        # Test invalid bodies and unknown subtasks.
+        response = self.post('/api/subtasks/complete', token, '{"subtasks":[]}')
+        self.assertEqual(response.status_code, 400)
+        response = self.post('/api/subtasks/complete', token,
+                json.dumps({'subtasks':[{'id':s1.id, 'is_complete':True},
+                                        {'id':99, 'is_complete':True}]}))
+        self.assertEqual(response.status_code, 404)
+
+        # Test partial completion of one task and full completion of another.
+        body = json.dumps({'subtasks':[{'id':s1.id, 'is_complete':True},
+                                       {'id':s3.id, 'is_complete':True},
+                                       {'id':s4.id, 'is_complete':True}]})
+        with CommitCounter() as commits:
+            response = self.post('/api/subtasks/complete', token, body)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(commits.count, 1)
+        snapshots = {t['id']:t for t in response.get_json()['tasks']}
+        self.assertEqual([s['is_complete'] for s in snapshots[t1.id]['subtasks']],
+                         [True, False])
+        self.assertEqual([s['is_complete'] for s in snapshots[t2.id]['subtasks']],
+                         [False, False])
+        self.assertEqual(t1.next_due, first_due)
+        self.assertGreater(t2.next_due, first_due)
+
+        # Test unticking.
+        body = json.dumps({'subtasks':[{'id':s1.id, 'is_complete':False}]})
+        response = self.post('/api/subtasks/complete', token, body)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(s1.is_complete)
+
+    # Test /api/subtasks/complete only reaches subtasks in the user's family,
+    #   or on their own tasks for a user without a family.
+    def test_change_subtasks_complete_scope(self):
+        u,f,u2 = load_family()
+        f2 = Family(family_name='f2')
+        db.session.add(f2)
+        db.session.commit()
+        other = User(username='o', email='o', password='o', family_id=f2.id,
+                     confirmed=True)
+        loner = User(username='l', email='l', password='l', confirmed=True)
+        loner2 = User(username='l2', email='l2', password='l2', confirmed=True)
+        db.session.add_all([other, loner, loner2])
+        db.session.commit()
+        t1, t2, t3 = load_tasks([u, loner, loner2], 3)
+        s1 = t1.subtasks.first()
+        s2 = t2.subtasks.first()
+        s3 = t3.subtasks.first()
+
+        # Test a user in another family cannot reach the family's subtasks.
+        response = self.post('/api/subtasks/complete',
+                other.generate_auth_token(),
+                json.dumps({'subtasks':[{'id':s1.id, 'is_complete':True}]}))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(s1.is_complete)
+
+        # Test a user without a family cannot reach another such user's
+        #   subtasks, nor a family's, but can reach their own.
+        token = loner.generate_auth_token()
+        for st in (s3, s1):
+            response = self.post('/api/subtasks/complete', token,
+                    json.dumps({'subtasks':[{'id':st.id, 'is_complete':True}]}))
+            self.assertEqual(response.status_code, 404)
+            self.assertFalse(st.is_complete)
+        response = self.post('/api/subtasks/complete', token,
+                json.dumps({'subtasks':[{'id':s2.id, 'is_complete':True}]}))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(s2.is_complete)
+
+    # Test the /api/tasks/changes route.
+    def test_task_changes(self):
+        u,f,u2 = load_family()
+        tasks = load_tasks([u, u2], 3)
+        token = u.generate_auth_token()
+
+        # Test missing cursor returns a full snapshot.
+        response = self.post('/api/tasks/changes', token)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_json()['reset'])
+        self.assertEqual(len(response.get_json()['tasks']), 3)
+        cursor = response.get_json()['cursor']
+
+        # Test idle polling returns nothing without task queries.
+        before = len(get_debug_queries())
+        response = self.post(f'/api/tasks/changes?since={cursor}', token)
+        queries = get_debug_queries()[before:]
+        self.assertFalse(response.get_json()['reset'])
+        self.assertEqual(response.get_json()['tasks'], [])
+        self.assertEqual(response.get_json()['subtasks'], [])
+        self.assertEqual(response.get_json()['cursor'], cursor)
+        self.assertFalse(any('FROM tasks' in q.statement for q in queries))
+
+        # Test a subtask change.
+        st = tasks[0].subtasks.first()
+        self.post(f'/api/change_subtask_complete/{st.id}', token)
+        response = self.post(f'/api/tasks/changes?since={cursor}', token)
+        self.assertEqual(response.get_json()['tasks'], [])
+        self.assertEqual([s['id'] for s in response.get_json()['subtasks']], [st.id])
+        self.assertTrue(response.get_json()['subtasks'][0]['is_complete'])
+        cursor = response.get_json()['cursor']
+
+        # Test deletions are returned as tombstones.
+        deleted = tasks[1]
+        subtask_ids = [s.id for s in deleted.subtasks]
+        self.post(f'/api/delete_task/{deleted.id}', token)
+        response = self.post(f'/api/tasks/changes?since={cursor}', token)
+        self.assertEqual(response.get_json()['deletedTasks'], [deleted.id])
+        self.assertEqual(sorted(response.get_json()['deletedSubtasks']), subtask_ids)
+        cursor = response.get_json()['cursor']
+
+        # Test a new task.
+        self.post('/api/tasks', token,
+                '{"taskname":"new","period":"d","assignee":1,"subtasks":"[\'s\']"}')
+        response = self.post(f'/api/tasks/changes?since={cursor}', token)
+        self.assertEqual([t['taskname'] for t in response.get_json()['tasks']], ['new'])
+        self.assertEqual(len(response.get_json()['tasks'][0]['subtasks']), 1)
+
+        # Test a cursor from another family resets.
+        response = self.post('/api/tasks/changes?since=99-1', token)
+        self.assertTrue(response.get_json()['reset'])
+        self.assertEqual(len(response.get_json()['tasks']), 3)
+
+    # Test a reset returns tasks never stamped with a revision, as those made
+    #   before revisions were added.
+    def test_task_changes_unstamped(self):
+        u,f,u2 = load_family()
+        tasks = load_tasks([u], 1)
+        Task.query.update({Task.revision:0})
+        Subtask.query.update({Subtask.revision:0})
+        db.session.commit()
+        token = u.generate_auth_token()
+        response = self.post('/api/tasks/changes', token)
+        self.assertTrue(response.get_json()['reset'])
+        self.assertEqual([t['id'] for t in response.get_json()['tasks']],
+                         [tasks[0].id])
+        self.assertEqual(len(response.get_json()['tasks'][0]['subtasks']),
+                         tasks[0].subtasks.count())
+        self.assertEqual(response.get_json()['subtasks'], [])
+
+    # Test pruning expired tombstones resets cursors synced before them.
+    def test_task_changes_pruned(self):
+        u,f,u2 = load_family()
+        tasks = load_tasks([u], 3)
+        token = u.generate_auth_token()
+        old_cursor = self.post('/api/tasks/changes', token).get_json()['cursor']
+        self.post(f'/api/delete_task/{tasks[0].id}', token)
+        cursor = self.post('/api/tasks/changes', token).get_json()['cursor']
+        self.post(f'/api/delete_task/{tasks[1].id}', token)
+
+        # Only the tombstones past the retention are pruned.
+        version = int(cursor.partition('-')[2])
+        Tombstone.query.filter(Tombstone.revision <= version)\
+                .update({Tombstone.created:datetime(2000, 1, 1)},
+                        synchronize_session=False)
+        db.session.commit()
+        self.assertEqual(Tombstone.expire(self.app.config['TOMBSTONE_RETENTION']),
+                         3)
+        self.assertEqual(Tombstone.query.count(), 3)
+        self.assertEqual(Tombstone.expire(self.app.config['TOMBSTONE_RETENTION']),
+                         0)
+
+        # A cursor before the pruned tombstones resets, one after them does not.
+        response = self.post(f'/api/tasks/changes?since={old_cursor}', token)
+        self.assertTrue(response.get_json()['reset'])
+        self.assertEqual([t['id'] for t in response.get_json()['tasks']],
+                         [tasks[2].id])
+        response = self.post(f'/api/tasks/changes?since={cursor}', token)
+        self.assertFalse(response.get_json()['reset'])
+        self.assertEqual(response.get_json()['deletedTasks'], [tasks[1].id])
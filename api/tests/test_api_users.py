@@ -52,23 +52,36 @@ class APITestCase(unittest.TestCase):
 
     # Test the /api/users/int route.
     def test_get_user(self):
-        u,f = load_user(True, True)
+        u,f,u2 = load_user(True, True, True)
+        stranger = User(username='s', email='s', password='s', confirmed=True)
+        db.session.add(stranger)
+        db.session.commit()
 
-        # Test for invalid id.
-        response = self.client.post('/api/users/0',
+        # Test without a token.
+        response = self.client.post(f'/api/users/{u.id}',
                 data=json.dumps({
                     'auth':
                         {"email_or_token":''}
                     }),
                 content_type='application/json')
-        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.status_code, 401)
 
         # Test for invalid id.
-        response = self.client.post(f'/api/users/{u.id}',
-                data=json.dumps({
-                    'auth':
-                        {"email_or_token":''}
-                    }),
-                content_type='application/json')
+        headers = {'Authorization':f'Bearer {u.generate_auth_token()}'}
+        response = self.client.get('/api/users/0', headers=headers)
+        self.assertEqual(response.status_code, 404)
+
+        # Test the user and their family are returned.
+        for user in (u, u2):
+            response = self.client.get(f'/api/users/{user.id}', headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.get_json()['username'], user.username)
+
+        # Test users outside the family are forbidden.
+        response = self.client.get(f'/api/users/{stranger.id}', headers=headers)
+        self.assertEqual(response.status_code, 403)
+        headers = {'Authorization':f'Bearer {stranger.generate_auth_token()}'}
+        response = self.client.get(f'/api/users/{u.id}', headers=headers)
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(f'/api/users/{stranger.id}', headers=headers)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.get_json()['username'], u.username)
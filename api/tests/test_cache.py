@@ -0,0 +1,196 @@
+import unittest
+import time
+from flask_sqlalchemy import get_debug_queries
+from app import create_app, db, task_cache, auth_cache
+from app.cache import CacheBackend, MemoryCache, family_key, user_key
+from app.models import User, Role, Family, Task, Subtask, Permission
+
+
+# Test the task list cache.
+class TaskCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.f = Family(family_name='f')
+        db.session.add(self.f)
+        db.session.commit()
+        self.u = User(username='u', family=self.f)
+        db.session.add(self.u)
+        db.session.commit()
+        self.t = Task(taskname='t', period='d', assigned_user=self.u)
+        db.session.add(self.t)
+        db.session.commit()
+        self.st = Subtask(subtask_name='s', task_id=self.t.id)
+        db.session.add(self.st)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    # Test LRU eviction and the counters.
+    def test_memory_cache_lru(self):
+        cache = MemoryCache(max_entries=2)
+        cache.set('a', 1, 1)
+        cache.set('b', 2, 1)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3, 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['entries'], 2)
+
+    # Test a backend missing part of the interface fails when it is created.
+    def test_incomplete_backend(self):
+        class GetOnly(CacheBackend):
+            def get(self, key):
+                return None
+        with self.assertRaises(TypeError):
+            GetOnly()
+
+    # Test the memory cap and expiry.
+    def test_memory_cache_limits(self):
+        cache = MemoryCache(max_bytes=10, ttl=0.01)
+        cache.set('big', 'x', 11)
+        self.assertIsNone(cache.get('big'))
+        cache.set('a', 'x', 6)
+        cache.set('b', 'x', 6)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['bytes'], 6)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+    # Test cached task lists are served without queries.
+    def test_cached_task_lists(self):
+        family_tasks = self.f.get_family_tasks_json()
+        user_tasks = self.u.get_tasks_json()
+        self.assertEqual(family_tasks[0]['subtasks'][0]['subtask_name'], 's')
+        before = len(get_debug_queries())
+        self.assertEqual(self.f.get_family_tasks_json(), family_tasks)
+        self.assertEqual(self.u.get_tasks_json(), user_tasks)
+        self.assertEqual(len(get_debug_queries()), before)
+
+    # Test commits invalidate the family and user entries.
+    def test_invalidation(self):
+        self.f.get_family_tasks_json()
+        self.u.get_tasks_json()
+        self.st.is_complete = True
+        db.session.commit()
+        self.assertIsNone(task_cache.backend.get(family_key(self.f.id)))
+        self.assertIsNone(task_cache.backend.get(user_key(self.u.id)))
+        self.assertTrue(self.f.get_family_tasks_json()[0]['subtasks'][0]['is_complete'])
+
+        # Rolled back writes keep the cache.
+        self.u.get_tasks_json()
+        self.st.is_complete = False
+        db.session.flush()
+        db.session.rollback()
+        self.assertIsNotNone(task_cache.backend.get(user_key(self.u.id)))
+
+    # Test task writes for a user without a family are served at once.
+    def test_invalidation_without_family(self):
+        u = User(username='u2')
+        db.session.add(u)
+        db.session.commit()
+        self.assertEqual(u.get_tasks_json(), [])
+        t = Task(taskname='t2', period='d', assigned_user=u)
+        db.session.add(t)
+        db.session.commit()
+        st = Subtask(subtask_name='s2', task_id=t.id)
+        db.session.add(st)
+        db.session.commit()
+        self.assertEqual([task['id'] for task in u.get_tasks_json()], [t.id])
+        st.is_complete = True
+        db.session.commit()
+        self.assertTrue(u.get_tasks_json()[0]['subtasks'][0]['is_complete'])
+        self.assertIsNone(task_cache.backend.get(user_key(u.id)))
+
+    # Test a list built before a commit, but stored after the commit
+    #   invalidated it, is not served.
+    def test_stale_build(self):
+        version = self.f.version
+        stale = self.f.get_family_tasks_json()
+        self.st.is_complete = True
+        db.session.commit()
+        task_cache.get_or_set(family_key(self.f.id), version, lambda: stale)
+        task_cache.get_or_set(user_key(self.u.id), version, lambda: stale)
+        self.assertTrue(self.f.get_family_tasks_json()[0]['subtasks'][0]['is_complete'])
+        self.assertTrue(self.u.get_tasks_json()[0]['subtasks'][0]['is_complete'])
+
+    # Test cached auth tokens are verified without queries.
+    def test_auth_cache_hit(self):
+        token = self.u.generate_auth_token()
+        user_id, family_id = self.u.id, self.f.id
+        self.assertEqual(User.verify_auth_token(token), self.u)
+        db.session.expunge_all()
+        before = len(get_debug_queries())
+        user = User.verify_auth_token(token)
+        self.assertEqual(len(get_debug_queries()), before)
+        self.assertEqual((user.id, user.family_id), (user_id, family_id))
+        self.assertTrue(user.can(Permission.COMPLETE))
+        self.assertFalse(user.can(Permission.ADMIN))
+        self.assertEqual(len(get_debug_queries()), before)
+
+        # Attributes left out of the token claims are loaded when used.
+        self.assertEqual(user.username, 'u')
+        self.assertEqual(user.family.family_name, 'f')
+        stats = auth_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertIsNone(User.verify_auth_token('bad'))
+        self.assertIsNone(User.verify_auth_token(None))
+
+    # Test user changes drop their cached tokens.
+    def test_auth_cache_invalidation(self):
+        token = self.u.generate_auth_token()
+        User.verify_auth_token(token)
+        other = Family(family_name='other')
+        db.session.add(other)
+        self.u.family = other
+        self.u.role = Role.query.filter_by(name='Leader').first()
+        db.session.commit()
+        other_id = other.id
+        db.session.expunge_all()
+        before = len(get_debug_queries())
+        user = User.verify_auth_token(token)
+        self.assertGreater(len(get_debug_queries()), before)
+        self.assertEqual(user.family_id, other_id)
+        self.assertEqual(auth_cache.stats()['stale'], 1)
+        self.assertTrue(User.verify_auth_token(token).can(Permission.ADD_USER))
+
+        # Password changes also drop the token.
+        stale = auth_cache.stats()['stale']
+        user.password = 'new'
+        db.session.commit()
+        User.verify_auth_token(token)
+        self.assertEqual(auth_cache.stats()['stale'], stale + 1)
+
+    # Test user generations are dropped once no cached token can be checked
+    #   against them.
+    def test_auth_cache_generations(self):
+        auth_cache.ttl = 0.1
+        auth_cache.invalidate_users([1, 2])
+        self.assertEqual(auth_cache.generation(1), 1)
+        time.sleep(0.11)
+        auth_cache.invalidate_users([2, 3])
+        self.assertEqual(auth_cache.stats()['generations'], 3)
+        time.sleep(0.11)
+        auth_cache.invalidate_users([4])
+        self.assertEqual(auth_cache.stats()['generations'], 3)
+        self.assertEqual([auth_cache.generation(i) for i in (1, 2, 3, 4)],
+                         [0, 2, 1, 1])
+
+    # Test tokens are not served from the cache after they expire.
+    def test_auth_cache_expiry(self):
+        token = self.u.generate_auth_token(expires_in=1)
+        self.assertIsNotNone(User.verify_auth_token(token))
+        time.sleep(2)
+        self.assertIsNone(User.verify_auth_token(token))
@@ -0,0 +1,90 @@
+import unittest
+import json
+from datetime import date, datetime
+from app import create_app, db, fragment_cache
+from app.encoding import ResponseEncoder, Fragment, jsonify, orjson
+from app.models import User, Role, Family, Task, Subtask
+
+
+# Test encoding responses and task fragments.
+class EncodingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    # Test each encoder matches the Flask encoding, with fragments spliced in.
+    def test_encoders(self):
+        names = ['json'] + (['orjson'] if orjson is not None else [])
+        value = {'b':[1, 2.5, None, True], 'a':'é"', 'd':date(2021, 1, 2),
+                 't':datetime(2021, 1, 2, 3, 4, 5)}
+        expected = json.loads(self.app.json_encoder().encode(value))
+        for name in names:
+            self.app.config['JSON_ENCODER'] = name
+            encoder = ResponseEncoder(self.app)
+            self.assertEqual(json.loads(encoder.dumps(value)), expected)
+
+            fragment = encoder.fragment({'x':[1], 'y':'z'})
+            self.assertIsInstance(fragment, Fragment)
+            self.assertEqual(fragment, {'x':[1], 'y':'z'})
+            fragment.encoded = b'{"spliced":true}'
+            self.assertEqual(json.loads(encoder.dumps(
+                    {'list':[fragment, {'n':[fragment]}], 'v':(1,)})),
+                    {'list':[{'spliced':True}, {'n':[{'spliced':True}]}], 'v':[1]})
+
+    # Test jsonify answers with the response encoder.
+    def test_jsonify(self):
+        with self.app.test_request_context():
+            response = jsonify({'a':1})
+            self.assertEqual(response.mimetype, 'application/json')
+            self.assertEqual(response.get_json(), {'a':1})
+            self.assertEqual(jsonify(a=1, b=[2]).get_json(), {'a':1, 'b':[2]})
+            self.assertEqual(jsonify(1, 2).get_json(), [1, 2])
+
+    # Test task fragments are reused until the task or a subtask changes.
+    def test_task_fragments(self):
+        f = Family(family_name='f')
+        u = User(username='u', family=f)
+        db.session.add_all([f, u])
+        db.session.commit()
+        t = Task(taskname='t', period='d', assigned_user=u)
+        db.session.add(t)
+        db.session.commit()
+        st = Subtask(subtask_name='s', task_id=t.id)
+        db.session.add(st)
+        db.session.commit()
+
+        first = Task.list_to_json([t])
+        self.assertEqual(first, [t.to_json([st])])
+        self.assertEqual(first[0]['subtasks'],
+                         [{'id':st.id, 'task_id':t.id, 'subtask_name':'s',
+                           'is_complete':False}])
+        self.assertIs(Task.list_to_json([t])[0], first[0])
+
+        # A changed subtask rebuilds the task fragment.
+        st.is_complete = True
+        db.session.commit()
+        second = Task.list_to_json([t])
+        self.assertIsNot(second[0], first[0])
+        self.assertTrue(json.loads(second[0].encoded)['subtasks'][0]['is_complete'])
+
+        # A renamed assignee rebuilds it without a new task revision.
+        u.username = 'v'
+        db.session.commit()
+        self.assertEqual(json.loads(Task.list_to_json([t])[0].encoded)['assignee'], 'v')
+
+        # Rows without revisions are not cached.
+        fragment_cache.clear()
+        self.assertIsNone(t.fragment_key([(st.id, None)], datetime.today()))
+        st.to_fragment()
+        self.assertEqual(fragment_cache.stats()['entries'], 1)
+        t.revision = None
+        self.assertIsNone(t.fragment_key([(st.id, st.revision)], datetime.today()))
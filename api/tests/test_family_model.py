@@ -1,7 +1,8 @@
 import unittest
 import time
 from app import create_app, db
-from app.models import User, Role, Permission, AnonymousUser, Family
+from app.models import User, Role, Permission, AnonymousUser, Family, Task, \
+        Subtask
 
 # Test the user model.
 class UserModelTestCase(unittest.TestCase):
@@ -33,3 +34,132 @@ class UserModelTestCase(unittest.TestCase):
 
         f.add_member(u)
         assertTrue(u.family.id==f.id)
+
+    # Tests the roster counts the leaders of the family alone.
+    def test_roster(self):
+        f1 = Family(family_name='f1')
+        f2 = Family(family_name='f2')
+        leader = Role.query.filter_by(name='Leader').first()
+        db.session.add_all([f1, f2,
+                User(username='a', family=f1, role=leader),
+                User(username='b', family=f1, role=leader),
+                User(username='c', family=f1),
+                User(username='d', family=f2, role=leader)])
+        db.session.commit()
+        rows = Family.roster(f1.id)
+        self.assertEqual([(row.username, row.role_name, row.leaders)
+                          for row in rows],
+                         [('a', 'Leader', 2), ('b', 'Leader', 2), ('c', 'User', 2)])
+        self.assertEqual(Family.roster(f2.id)[0].leaders, 1)
+
+    # Tests that family writes increment the family version.
+    def test_version(self):
+        f = Family(family_name='f')
+        f2 = Family(family_name='f2')
+        db.session.add_all([f, f2])
+        db.session.commit()
+        self.assertEqual(f.version, 0)
+
+        # Joining a family
+        u = User(username='u', family=f)
+        db.session.add(u)
+        db.session.commit()
+        self.assertGreater(f.version, 0)
+
+        # Tasks and subtasks
+        version = f.version
+        t = Task(taskname='t', period='d', assigned_user=u)
+        db.session.add(t)
+        db.session.commit()
+        self.assertGreater(f.version, version)
+        version = f.version
+        st = Subtask(subtask_name='s', task_id=t.id)
+        db.session.add(st)
+        db.session.commit()
+        self.assertGreater(f.version, version)
+        version = f.version
+        st.is_complete = True
+        db.session.commit()
+        self.assertGreater(f.version, version)
+
+        # Changes outside the roster do not bump the version.
+        version = f.version
+        u.password = 'x'
+        u.confirmed = True
+        db.session.commit()
+        self.assertEqual(f.version, version)
+
+        # Moving families bumps both families.
+        u.family = f2
+        db.session.commit()
+        self.assertGreater(f.version, version)
+        self.assertGreater(f2.version, 0)
+
+    # Tests tasks follow the family of their assigned user.
+    def test_task_family(self):
+        f1 = Family(family_name='f1')
+        f2 = Family(family_name='f2')
+        db.session.add_all([f1, f2])
+        db.session.commit()
+        u1 = User(username='u1', family=f1)
+        u2 = User(username='u2', family=f2)
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        t = Task(taskname='t', period='d', assigned_user=u1)
+        db.session.add(t)
+        db.session.commit()
+        self.assertEqual(t.family_id, f1.id)
+
+        # Reassigning the task.
+        t.assigned_user = u2
+        db.session.commit()
+        self.assertEqual(t.family_id, f2.id)
+        self.assertEqual(f2.get_family_tasks(), [t])
+
+        # Moving the user to another family by id.
+        u2.family_id = f1.id
+        db.session.commit()
+        self.assertEqual(t.family_id, f1.id)
+        self.assertEqual(f1.get_family_tasks(), [t])
+        self.assertEqual(f2.get_family_tasks(), [])
+
+        # Removing the user from the family.
+        u2.family = None
+        db.session.commit()
+        self.assertIsNone(t.family_id)
+        self.assertEqual(f1.get_family_tasks(), [])
+
+    # Tests clients of both families sync a task moved with its user.
+    def test_task_family_changes(self):
+        f1 = Family(family_name='f1')
+        f2 = Family(family_name='f2')
+        u = User(username='u', family=f1)
+        t = Task(taskname='t', period='d', assigned_user=u)
+        db.session.add_all([f1, f2, u, t])
+        db.session.commit()
+        st = Subtask(subtask_name='s', task_id=t.id)
+        db.session.add(st)
+        db.session.commit()
+        v1, v2 = f1.version, f2.version
+
+        u.family = f2
+        db.session.commit()
+        tasks, subtasks, tombstones = f1.get_changes_since(v1)
+        self.assertEqual((tasks, subtasks), ([], []))
+        self.assertEqual(sorted((d.kind, d.object_id) for d in tombstones),
+                         [('subtasks', st.id), ('tasks', t.id)])
+        tasks, subtasks, tombstones = f2.get_changes_since(v2)
+        self.assertEqual((tasks, subtasks, tombstones), ([t], [st], []))
+        self.assertEqual((t.revision, st.revision), (f2.version, f2.version))
+
+        # Reassigning a task to a member of another family.
+        u2 = User(username='u2', family=f1)
+        db.session.add(u2)
+        db.session.commit()
+        v1, v2 = f1.version, f2.version
+        t.assigned_user = u2
+        db.session.commit()
+        self.assertEqual(f1.get_changes_since(v1)[:2], ([t], [st]))
+        self.assertEqual([(d.kind, d.object_id) for d in
+                          f2.get_changes_since(v2)[2] if d.kind == 'tasks'],
+                         [('tasks', t.id)])
@@ -0,0 +1,113 @@
+import unittest
+import json
+import os
+import subprocess
+import sys
+from werkzeug.security import generate_password_hash
+from app import create_app, db, password_hasher
+from app.hashing import PasswordHasher, stored_method
+from app.models import User, Role
+try:
+    import gevent
+except ImportError:
+    gevent = None
+
+
+# This verifies passwords from several greenlets in a gevent patched process,
+#   as the gevent workers run by the Procfile do, while another greenlet
+#   ticks. It prints the results, the pool type, the longest gap between
+#   ticks, and how long one hash takes on its own.
+GEVENT_LOGINS = '''
+from gevent import monkey
+monkey.patch_all()
+import json, time
+import gevent
+from app import create_app
+from app.hashing import PasswordHasher
+app = create_app('testing')
+app.config.update(PASSWORD_HASH_METHOD='pbkdf2:sha256:200000',
+                  PASSWORD_HASH_WORKERS=2)
+hasher = PasswordHasher(app)
+start = time.perf_counter()
+password_hash = hasher.hash('secret')
+hash_time = time.perf_counter() - start
+ticks = []
+def tick():
+    while True:
+        ticks.append(time.perf_counter())
+        gevent.sleep(0.001)
+gevent.spawn(tick)
+logins = [gevent.spawn(hasher.verify, password_hash, password)
+          for password in ('secret', 'wrong') * 4]
+gevent.joinall(logins)
+pool = type(hasher.pool).__module__
+hasher.shutdown()
+print(json.dumps({'results':[login.value for login in logins],
+                  'pool':pool,
+                  'gap':max(b - a for a, b in zip(ticks, ticks[1:])),
+                  'hash':hash_time}))
+'''
+
+
+# Test password hashing and rehashing on login.
+class PasswordHashingTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    # Test hashing and verifying in worker processes.
+    def test_pool(self):
+        self.app.config['PASSWORD_HASH_WORKERS'] = 2
+        hasher = PasswordHasher(self.app)
+        try:
+            password_hash = hasher.hash('secret')
+            self.assertTrue(password_hash.startswith('pbkdf2:sha256:1000$'))
+            self.assertTrue(hasher.verify(password_hash, 'secret'))
+            self.assertFalse(hasher.verify(password_hash, 'wrong'))
+            self.assertFalse(hasher.verify(None, 'secret'))
+            self.assertIsNotNone(hasher.pool)
+        finally:
+            hasher.shutdown()
+
+    # Test hashing under gevent runs on threads and does not stall the other
+    #   greenlets of the worker.
+    @unittest.skipUnless(gevent, 'gevent is not installed')
+    def test_gevent_pool(self):
+        api = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.run([sys.executable, '-c', GEVENT_LOGINS], cwd=api,
+                                capture_output=True, check=True, timeout=60,
+                                env=dict(os.environ, PYTHONPATH=api)).stdout
+        result = json.loads(output.splitlines()[-1])
+        self.assertEqual(result['results'], [True, False] * 4)
+        self.assertEqual(result['pool'], 'gevent.threadpool')
+        self.assertLess(result['gap'], result['hash'] / 2)
+
+    # Test the stored form of configured methods.
+    def test_stored_method(self):
+        self.assertEqual(stored_method('pbkdf2:sha256'), 'pbkdf2:sha256:150000')
+        self.assertEqual(stored_method('pbkdf2:sha256:1000'), 'pbkdf2:sha256:1000')
+        self.assertFalse(password_hasher.needs_rehash(password_hasher.hash('x')))
+        self.assertTrue(password_hasher.needs_rehash(
+                generate_password_hash('x', 'pbkdf2:sha256:500')))
+
+    # Test hashes with old parameters are replaced on login.
+    def test_rehash_on_login(self):
+        u = User(username='u', email='u')
+        u.password_hash = generate_password_hash('secret', 'pbkdf2:sha256:500')
+        db.session.add(u)
+        db.session.commit()
+
+        self.assertIsNone(User.verify_api_credentials('u', 'wrong'))
+        self.assertTrue(u.password_hash.startswith('pbkdf2:sha256:500$'))
+        self.assertEqual(User.verify_api_credentials('u', 'secret'), u)
+        self.assertTrue(u.password_hash.startswith('pbkdf2:sha256:1000$'))
+        self.assertTrue(u.verify_password('secret'))
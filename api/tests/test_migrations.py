@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+from flask_migrate import Migrate, upgrade, downgrade
+from app import create_app, db
+
+
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'migrations')
+
+
+# Test the migrations against a file backed SQLite database, which runs them
+#   the same way as flask db upgrade and flask deploy.
+class MigrationsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(handle)
+        self.app = create_app('testing')
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + self.path
+        Migrate(self.app, db, directory=MIGRATIONS)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        db.session.remove()
+        db.engine.dispose()
+        self.app_context.pop()
+        os.remove(self.path)
+
+    # Test the whole chain upgrades to head and downgrades back to base.
+    def test_upgrade_downgrade(self):
+        upgrade(directory=MIGRATIONS)
+        self.assertIn('tasks', db.engine.table_names())
+        downgrade(directory=MIGRATIONS, revision='base')
+        self.assertNotIn('tasks', db.engine.table_names())
+
+    # Test the task family id migration backfills the family of each
+    #   assigned user and drops the column again on downgrade.
+    def test_task_family_id(self):
+        upgrade(directory=MIGRATIONS, revision='0d6a2f4c8b13')
+        db.engine.execute("INSERT INTO families (id, family_name) "
+                          "VALUES (1, 'family')")
+        db.engine.execute("INSERT INTO users (id, username, family_id) "
+                          "VALUES (1, 'john', 1), (2, 'susan', NULL)")
+        db.engine.execute("INSERT INTO tasks (id, taskname, assigned_user_id) "
+                          "VALUES (1, 'dishes', 1), (2, 'laundry', 2)")
+        upgrade(directory=MIGRATIONS, revision='6e1c9a3f5b27')
+        rows = db.engine.execute(
+            'SELECT id, family_id FROM tasks ORDER BY id').fetchall()
+        self.assertEqual([tuple(row) for row in rows], [(1, 1), (2, None)])
+        indexes = [index['name'] for index in
+                   db.inspect(db.engine).get_indexes('tasks')]
+        self.assertIn('ix_tasks_family_id_next_due_id', indexes)
+        downgrade(directory=MIGRATIONS, revision='0d6a2f4c8b13')
+        columns = [column['name'] for column in
+                   db.inspect(db.engine).get_columns('tasks')]
+        self.assertNotIn('family_id', columns)
@@ -0,0 +1,152 @@
+import unittest
+import json
+import time
+from datetime import datetime
+from app import create_app, db, mail, email_outbox
+from app.emails import send_email
+from app.models import User, Role, OutboxEmail
+from tests.smtp import SMTPStandIn
+
+
+# Test emails are queued in the outbox and sent with retries.
+class OutboxTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.u = User(username='u', email='u@x.io', password='u')
+        db.session.add(self.u)
+        db.session.commit()
+        self.smtp = SMTPStandIn().__enter__()
+        self.smtp.configure(self.app, mail)
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        email_outbox.shutdown()
+        self.smtp.__exit__()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    # Queue an email to the recipient.
+    def queue(self, recipient):
+        return send_email(recipient, 'Confirm Registration',
+                          'auth/mail/confirm_user_api',
+                          user=self.u, token='t')
+
+    # Test emails are written in the transaction which sends them.
+    def test_queued(self):
+        response = self.client.post('/api/auth/registration',
+                data=json.dumps({'body':{'username':'w', 'email':'w@x.io',
+                                         'password':'w'}}),
+                content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        email = OutboxEmail.query.one()
+        self.assertEqual(email.recipient, 'w@x.io')
+        self.assertIn('Confirm Registration', email.subject)
+        self.assertEqual(self.smtp.messages, [])
+
+        # Rolled back emails are not sent.
+        self.queue('v@x.io')
+        db.session.rollback()
+        self.assertEqual(OutboxEmail.query.count(), 1)
+
+    # Test due emails are sent and removed from the outbox.
+    def test_drain(self):
+        self.queue('u@x.io')
+        self.queue('v@x.io')
+        db.session.commit()
+        self.assertEqual(email_outbox.drain(), 2)
+        self.assertEqual([m[1] for m in self.smtp.messages],
+                         [['u@x.io'], ['v@x.io']])
+        self.assertIn('Confirm Registration', self.smtp.messages[0][2]['Subject'])
+        self.assertEqual(OutboxEmail.query.count(), 0)
+        self.assertEqual(email_outbox.drain(), 0)
+
+        stats = email_outbox.stats()
+        self.assertEqual((stats['pending'], stats['sent']), (0, 2))
+        self.assertIsNotNone(stats['latency']['p95'])
+
+    # Test refused emails are retried with backoff, and then failed.
+    def test_retry(self):
+        self.smtp.reject.add('bad@x.io')
+        self.queue('bad@x.io')
+        self.queue('u@x.io')
+        db.session.commit()
+        self.assertEqual(email_outbox.drain(), 2)
+        self.assertEqual(len(self.smtp.messages), 1)
+        email = OutboxEmail.query.one()
+        self.assertEqual((email.status, email.attempts), ('pending', 1))
+        self.assertIsNotNone(email.error)
+        delay = (email.next_attempt - datetime.today()).total_seconds()
+        self.assertAlmostEqual(delay, email_outbox.backoff, delta=5)
+
+        # The email is not due again until its backoff ends.
+        self.assertEqual(email_outbox.drain(), 0)
+        for attempt in range(email_outbox.max_attempts - 1):
+            email.next_attempt = datetime.today()
+            db.session.commit()
+            self.assertEqual(email_outbox.drain(), 1)
+            email = OutboxEmail.query.one()
+        self.assertEqual(email.status, 'failed')
+        stats = email_outbox.stats()
+        self.assertEqual((stats['pending'], stats['failed'], stats['failures']),
+                         (0, 1, 1))
+        self.assertEqual(stats['retried'], email_outbox.max_attempts - 1)
+
+    # Test emails are retried when the mail server cannot be reached.
+    def test_unreachable(self):
+        self.app.config['MAIL_PORT'] = 1
+        mail.init_app(self.app)
+        self.queue('u@x.io')
+        db.session.commit()
+        self.assertEqual(email_outbox.drain(), 1)
+        self.assertEqual(OutboxEmail.query.one().attempts, 1)
+        self.assertEqual(email_outbox.stats()['retried'], 1)
+
+    # Test claimed emails are not claimed again until their lease ends.
+    def test_claim(self):
+        self.queue('u@x.io')
+        db.session.commit()
+        self.assertEqual(len(OutboxEmail.claim(10, 60, 5)), 1)
+        self.assertEqual(OutboxEmail.claim(10, 60, 5), [])
+
+        # Emails out of attempts are failed instead of claimed.
+        email = OutboxEmail.query.one()
+        email.next_attempt = datetime.today()
+        email.attempts = 5
+        db.session.commit()
+        self.assertEqual(OutboxEmail.claim(10, 60, 5), [])
+        self.assertEqual(OutboxEmail.query.one().status, 'failed')
+        self.assertEqual(email_outbox.drain(), 0)
+
+    # Test an email which cannot be sent does not hold back the others.
+    def test_bad_email(self):
+        send_email('u@x.io', 'bad\nsubject', 'auth/mail/confirm_user_api',
+                   user=self.u, token='t')
+        self.queue('v@x.io')
+        db.session.commit()
+        self.assertEqual(email_outbox.drain(), 2)
+        self.assertEqual([m[1] for m in self.smtp.messages], [['v@x.io']])
+        email = OutboxEmail.query.one()
+        self.assertEqual((email.recipient, email.attempts), ('u@x.io', 1))
+        self.assertEqual(email_outbox.drain(), 0)
+        self.assertEqual(len(self.smtp.messages), 1)
+
+    # Test the worker pool sends emails once they are committed.
+    def test_workers(self):
+        email_outbox.workers = 1
+        self.queue('u@x.io')
+        db.session.commit()
+        for i in range(50):
+            if self.smtp.messages:
+                break
+            time.sleep(0.1)
+        self.assertEqual([m[1] for m in self.smtp.messages], [['u@x.io']])
+
+
+if __name__ == '__main__':
+    unittest.main()
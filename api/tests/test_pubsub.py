@@ -0,0 +1,168 @@
+import unittest
+import json
+from app import create_app, db, events
+from datetime import datetime, timedelta
+from app.models import User, Role, Family, Task, Subtask, FamilyEvent
+from app.pubsub import LocalBroker, DatabaseBroker
+
+
+# Test the family task event broker and stream.
+class PubSubTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        events.heartbeat = 0.01
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    # Test fan out to every subscriber of a channel.
+    def test_local_broker(self):
+        broker = LocalBroker(queue_size=1)
+        s1 = broker.subscribe('a')
+        s2 = broker.subscribe('a')
+        s3 = broker.subscribe('b')
+        broker.publish('a', {'type':'x'})
+        self.assertEqual(s1.get_nowait(), {'type':'x'})
+        self.assertEqual(s2.get_nowait(), {'type':'x'})
+        self.assertTrue(s3.empty())
+
+        # Full queues drop messages rather than blocking the publisher.
+        broker.publish('a', {'type':'y'})
+        broker.publish('a', {'type':'z'})
+        self.assertEqual(s1.get_nowait(), {'type':'y'})
+        self.assertTrue(s1.empty())
+
+        broker.unsubscribe('a', s1)
+        broker.unsubscribe('a', s2)
+        self.assertEqual(broker.subscriber_count('a'), 0)
+
+    # Return a database broker polled by the test, standing in for the broker
+    #   of one worker process.
+    def database_broker(self):
+        self.app.config['EVENT_POLL'] = None
+        broker = DatabaseBroker(queue_size=10)
+        broker.init_app(self.app)
+        return broker
+
+    # Test events published in one process reach subscribers in another.
+    def test_database_broker(self):
+        publisher, broker = self.database_broker(), self.database_broker()
+        publisher.publish('a', {'type':'old'})
+        s1 = broker.subscribe('a')
+        s2 = broker.subscribe('b')
+        broker.deliver()
+        publisher.publish('a', {'type':'x'})
+        publisher.publish('b', {'type':'y'})
+        self.assertTrue(s1.empty())
+        broker.deliver()
+        broker.deliver()
+        self.assertEqual(s1.get_nowait(), {'type':'x'})
+        self.assertEqual(s2.get_nowait(), {'type':'y'})
+        self.assertTrue(s1.empty() and s2.empty())
+
+        # An id committed after newer ids is still delivered, until its grace
+        #   has passed.
+        events = FamilyEvent.__table__
+        newest = FamilyEvent.newest_id()
+        db.session.execute(events.insert().values(
+                id=newest + 2, channel='a', message='{"type":"late"}',
+                created=datetime.today()))
+        db.session.commit()
+        broker.deliver()
+        self.assertEqual(s1.get_nowait(), {'type':'late'})
+        self.assertEqual(broker.floor, newest)
+        db.session.execute(events.insert().values(
+                id=newest + 1, channel='a', message='{"type":"early"}',
+                created=datetime.today()))
+        db.session.commit()
+        broker.deliver()
+        self.assertEqual(s1.get_nowait(), {'type':'early'})
+        self.assertTrue(s1.empty())
+        self.assertEqual(broker.floor, newest + 2)
+
+        broker.gap_grace = 0
+        db.session.execute(events.insert().values(
+                id=newest + 4, channel='a', message='{"type":"z"}',
+                created=datetime.today()))
+        db.session.commit()
+        broker.deliver()
+        self.assertEqual(s1.get_nowait(), {'type':'z'})
+        self.assertEqual(broker.floor, newest + 4)
+
+        # Expired events are deleted.
+        FamilyEvent.query.update({FamilyEvent.created:
+                                  datetime.today() - timedelta(minutes=5)})
+        db.session.commit()
+        broker.deliver()
+        self.assertEqual(FamilyEvent.query.count(), 0)
+
+        # Without subscribers nothing is read.
+        broker.unsubscribe('a', s1)
+        broker.unsubscribe('b', s2)
+        broker.deliver()
+        self.assertIsNone(broker.floor)
+
+    # Test the model hooks publish to the family channel.
+    def test_model_events(self):
+        f = Family(family_name='f')
+        db.session.add(f)
+        db.session.commit()
+        u = User(username='u', family=f)
+        db.session.add(u)
+        db.session.commit()
+        t = Task(taskname='t', period='d', assigned_user=u)
+        db.session.add(t)
+        db.session.commit()
+        st = Subtask(subtask_name='s', task_id=t.id)
+        db.session.add(st)
+        db.session.commit()
+        subscriber = events.broker.subscribe(f'family:{f.id}')
+
+        st.complete()
+        self.assertEqual(subscriber.get_nowait(), {'type':'subtask-complete',
+                'task_id':t.id, 'subtask_id':st.id})
+        self.assertEqual(subscriber.get_nowait(), {'type':'task-complete',
+                'task_id':t.id})
+        t.delete()
+        self.assertEqual(subscriber.get_nowait(), {'type':'task-deleted',
+                'task_id':t.id})
+
+    # Test the /api/tasks/stream route.
+    def test_stream(self):
+        f = Family(family_name='f')
+        db.session.add(f)
+        db.session.commit()
+        u = User(username='u', family=f, email='u', password='u')
+        db.session.add(u)
+        db.session.commit()
+        token = u.generate_auth_token()
+
+        response = self.client.get('/api/tasks/stream')
+        self.assertEqual(response.status_code, 401)
+
+        response = self.client.get(f'/api/tasks/stream?token={token}',
+                                   buffered=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        chunks = iter(response.response)
+        self.assertEqual(next(chunks), b'retry: 5000\n\n')
+        self.assertEqual(next(chunks), b': keep-alive\n\n')
+        self.assertEqual(events.broker.subscriber_count(f'family:{f.id}'), 1)
+
+        events.publish_family(f.id, 'member-change', user_id=u.id)
+        chunk = next(chunks).decode('utf-8')
+        self.assertTrue(chunk.startswith('event: member-change\n'))
+        self.assertEqual(json.loads(chunk.split('data: ')[1]),
+                         {'type':'member-change', 'user_id':u.id})
+
+        # Closing the stream removes the subscriber.
+        response.close()
+        self.assertEqual(events.broker.subscriber_count(f'family:{f.id}'), 0)
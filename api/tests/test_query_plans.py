@@ -0,0 +1,85 @@
+import unittest
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.models import User, Role, Family, Task, Subtask, Tombstone
+
+
+# Return the SQLite query plan of a query, one line per plan step.
+def query_plan(query):
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    params = [compiled.params[name] for name in compiled.positiontup]
+    cursor = db.session.connection().connection.cursor()
+    cursor.execute('EXPLAIN QUERY PLAN ' + str(compiled), params)
+    return [row[3] for row in cursor.fetchall()]
+
+
+# Test the task queries are served by indexes.
+class QueryPlanTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.f = Family(family_name='f')
+        db.session.add(self.f)
+        db.session.commit()
+        self.u = User(username='u', family=self.f)
+        db.session.add(self.u)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    # Test no query used to list or sync tasks scans a whole table.
+    def test_no_table_scans(self):
+        leader = Role.query.filter_by(name='Leader').first()
+        queries = [
+            self.f.family_tasks_query().order_by(Task.next_due.asc()),
+            self.f.overdue_tasks_query(),
+            self.f.tasks_due_within_query(7),
+            self.u.tasks.order_by(Task.next_due.asc()),
+            self.f.members.filter_by(role=leader),
+            Subtask.query.filter(Subtask.task_id.in_([1, 2]))\
+                    .order_by(Subtask.id.asc()),
+            Subtask.query.join(Task)\
+                    .filter(Task.family_id == self.f.id, Subtask.revision > 0),
+            Tombstone.query.filter(Tombstone.family_id == self.f.id,
+                                   Tombstone.revision > 0)]
+        for query in queries:
+            plan = query_plan(query)
+            self.assertTrue(plan)
+            for step in plan:
+                self.assertFalse(step.startswith('SCAN'), plan)
+
+    # Test family task queries are read in order from the family index.
+    def test_family_task_index(self):
+        queries = [
+            self.f.family_tasks_query().order_by(Task.next_due.asc(), Task.id.asc()),
+            self.f.overdue_tasks_query(),
+            self.f.tasks_due_within_query(7)]
+        for query in queries:
+            plan = query_plan(query)
+            self.assertIn('ix_tasks_family_id_next_due_id', plan[0])
+            self.assertFalse(any('TEMP B-TREE' in step for step in plan), plan)
+
+    # Test the overdue and due soon queries.
+    def test_due_queries(self):
+        now = datetime(2021, 3, 10, 12)
+        due = [now - timedelta(days=2), now - timedelta(hours=1),
+               now + timedelta(days=1), now + timedelta(days=6),
+               now + timedelta(days=8)]
+        tasks = [Task(taskname=str(i), period='d', assigned_user=self.u,
+                      today=next_due) for i, next_due in enumerate(due)]
+        other = Family(family_name='other')
+        stranger = User(username='stranger', family=other)
+        db.session.add_all(tasks + [other, stranger,
+                Task(taskname='x', period='d', assigned_user=stranger,
+                     today=now - timedelta(days=1))])
+        db.session.commit()
+
+        self.assertEqual(self.f.overdue_tasks_query(now).all(), tasks[:2])
+        self.assertEqual(self.f.tasks_due_within_query(7, now).all(), tasks[2:4])
@@ -0,0 +1,82 @@
+import unittest
+from calendar import monthrange
+from datetime import datetime, timedelta
+from dateutil.relativedelta import relativedelta
+from app.exceptions import ValidationError
+from app.recurrence import parse_period, first_due, next_due
+
+# Periods covered by the property tests.
+PERIODS = ('d', '3d', 'w', 'w@0', '2w@3', 'm', 'm@15', 'm@31', '3m@29')
+
+
+# Reference implementation which steps a day at a time through the days
+#   that are occurrences of a period.
+def reference_is_occurrence(recurrence, day, start=None):
+    count, unit, anchor = recurrence
+    if unit == 'd':
+        return start is None or (day - start).days % count == 0
+    if unit == 'w':
+        if start is None:
+            return day.weekday() == anchor
+        return (day - start).days % (7 * count) == 0
+    months = (day.year - start.year) * 12 + day.month - start.month if start else 0
+    return months % count == 0 and \
+            day.day == min(anchor, monthrange(day.year, day.month)[1])
+
+
+def reference_first_due(period, today):
+    recurrence = parse_period(period)
+    day = today
+    while not reference_is_occurrence(recurrence, day):
+        day += timedelta(days=1)
+    return day
+
+
+def reference_next_due(period, due, today):
+    recurrence = parse_period(period)
+    if recurrence.unit == 'm':
+        target = today + relativedelta(months=recurrence.count)
+    else:
+        target = today + timedelta(days=recurrence.count *
+                                   (7 if recurrence.unit == 'w' else 1))
+    day = max(due, target)
+    while not (reference_is_occurrence(recurrence, day, due) and
+               (day > target if recurrence.unit == 'm' else day >= target)):
+        day += timedelta(days=1)
+    return day
+
+
+# Test the recurrence calculator against the reference implementation.
+class RecurrenceTestCase(unittest.TestCase):
+
+    # Test parsing of valid and invalid periods.
+    def test_parse_period(self):
+        self.assertEqual(parse_period('d'), (1, 'd', None))
+        self.assertEqual(parse_period('w'), (1, 'w', 5))
+        self.assertEqual(parse_period('12m@31'), (12, 'm', 31))
+        for period in (None, '', 'y', '0d', '100d', 'd@1', 'w@7', 'm@0', 'm@32'):
+            with self.assertRaises(ValidationError):
+                parse_period(period)
+
+    # Test every day over 20 years, for tasks completed early, on time and
+    #   late.
+    def test_against_reference(self):
+        start = datetime(2010, 1, 1, 23, 59, 59)
+        for period in PERIODS:
+            for i in range(20 * 365 + 5):
+                today = start + timedelta(days=i)
+                self.assertEqual(first_due(period, today),
+                                 reference_first_due(period, today))
+                for offset in (-9, 0, 5, 45):
+                    due = reference_first_due(period, today - timedelta(days=offset))
+                    self.assertEqual(next_due(period, due, today),
+                                     reference_next_due(period, due, today),
+                                     (period, due, today))
+
+    # Test a task untouched for years is caught up in one step.
+    def test_long_overdue(self):
+        today = datetime(2030, 6, 12, 23, 59, 59)
+        self.assertEqual(next_due('w', datetime(2001, 1, 6, 23, 59, 59), today),
+                         datetime(2030, 6, 22, 23, 59, 59))
+        self.assertEqual(next_due('m@31', datetime(2001, 1, 31, 23, 59, 59), today),
+                         datetime(2030, 7, 31, 23, 59, 59))
@@ -0,0 +1,145 @@
+import unittest
+import json
+import time
+from flask_sqlalchemy import get_debug_queries
+from app import create_app, db, tokens, auth_cache, token_revocations
+from app.models import User, Role, Family, Permission, TokenRevocation
+from app.revocation import TokenRevocations, ALL_USERS
+
+
+# Test auth token claims and their revocation.
+class RevocationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.f = Family(family_name='f')
+        self.u = User(username='u', email='u', password='u', family=self.f,
+                      role=Role.named('Leader'), confirmed=True)
+        db.session.add(self.u)
+        db.session.commit()
+        self.client = self.app.test_client(use_cookies=True)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    # Returns the user of a token verified with empty caches, and the number
+    #   of queries it took.
+    def verify(self, token):
+        auth_cache.clear()
+        db.session.expunge_all()
+        before = len(get_debug_queries())
+        user = User.verify_auth_token(token)
+        return user, len(get_debug_queries()) - before
+
+    # Test tokens carry the claims which authorize the user without queries.
+    def test_claims(self):
+        token = self.u.generate_auth_token()
+        claims = tokens.verify('auth', token)
+        self.assertEqual((claims['id'], claims['role_id'], claims['family_id']),
+                         (self.u.id, self.u.role_id, self.f.id))
+        self.assertEqual(claims['permissions'], self.u.role.permissions)
+
+        before = len(get_debug_queries())
+        user, queries = self.verify(token)
+        self.assertEqual(user.family_id, self.f.id)
+        self.assertTrue(user.can(Permission.ADD_USER))
+        self.assertFalse(user.is_administrator())
+        self.assertEqual(len(get_debug_queries()), before)
+
+        # Tokens without claims are refused.
+        self.assertIsNone(User.verify_auth_token(
+                tokens.issue('auth', {'id':self.u.id}, 60)))
+
+    # Test a role or family change reloads the user of older tokens once.
+    def test_stale_claims(self):
+        token = self.u.generate_auth_token()
+        self.u.role = Role.default_role()
+        db.session.commit()
+        user, queries = self.verify(token)
+        self.assertGreater(queries, 0)
+        self.assertFalse(user.can(Permission.ADD_USER))
+
+        # The reloaded user is cached, and a new token is current.
+        db.session.expunge_all()
+        before = len(get_debug_queries())
+        self.assertFalse(User.verify_auth_token(token).can(Permission.ADD_USER))
+        self.assertEqual(len(get_debug_queries()), before)
+        self.assertEqual(self.verify(User.query.get(1).generate_auth_token())[1], 0)
+
+        # Removal from the family is seen by older tokens.
+        token = User.query.get(1).generate_auth_token()
+        User.query.get(1).family_id = None
+        db.session.commit()
+        user, queries = self.verify(token)
+        self.assertIsNone(user.family_id)
+
+        # A role change makes every token stale.
+        token = User.query.get(1).generate_auth_token()
+        Role.named('User').add_permission(Permission.UNCOMPLETE)
+        db.session.commit()
+        self.assertGreater(self.verify(token)[1], 0)
+
+    # Test password resets and deletions revoke older tokens.
+    def test_revoked(self):
+        token = self.u.generate_auth_token()
+        reset = self.u.generate_reset_token()
+        response = self.client.post('/api/auth/processPasswordReset',
+                data=json.dumps({'body':{'token':reset, 'password':'v'}}),
+                content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(self.verify(token)[0])
+        token = User.query.get(1).generate_auth_token()
+        self.assertIsNotNone(self.verify(token)[0])
+
+        # Rehashing a password on login does not revoke tokens.
+        self.app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+        self.assertIsNotNone(User.verify_api_credentials('u', 'v'))
+        self.assertIsNotNone(self.verify(token)[0])
+
+        db.session.delete(User.query.get(1))
+        db.session.commit()
+        self.assertIsNone(self.verify(token)[0])
+
+    # Test other workers read revocations from the db.
+    def test_sync(self):
+        token = self.u.generate_auth_token()
+        issued = tokens.verify('auth', token)['issued']
+        worker = TokenRevocations(self.app)
+        worker.sync(force=True)
+        self.assertFalse(worker.is_revoked(self.u.id, issued))
+
+        self.u.password = 'v'
+        db.session.commit()
+        self.assertFalse(worker.is_revoked(self.u.id, issued))
+        worker.sync(force=True)
+        self.assertTrue(worker.is_revoked(self.u.id, issued))
+
+        # Workers sync on their own once the interval passes.
+        worker.interval = 0
+        Role.named('User').add_permission(Permission.UNCOMPLETE)
+        db.session.commit()
+        self.assertTrue(worker.is_stale(self.u.id + 1, issued))
+        self.assertFalse(worker.is_stale(self.u.id + 1, time.time()))
+
+    # Test revocations older than any token are removed.
+    def test_prune(self):
+        db.session.add(TokenRevocation(user_id=ALL_USERS, changed_at=1.0,
+                                       updated_at=1.0))
+        db.session.commit()
+        token_revocations.sync(force=True)
+        self.assertEqual(token_revocations.stats(), {'revoked':0, 'changed':0})
+
+        self.u.password = 'v'
+        db.session.commit()
+        self.assertEqual([r.user_id for r in TokenRevocation.query.all()],
+                         [self.u.id])
+
+
+if __name__ == '__main__':
+    unittest.main()
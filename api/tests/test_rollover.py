@@ -0,0 +1,77 @@
+import unittest
+from datetime import date, datetime, timedelta
+from app import create_app, db, task_cache
+from app.cache import family_key
+from app.models import User, Role, Family, Task
+from app.recurrence import first_due, roll_forward
+from app.rollover import next_due_dates, roll_overdue_tasks
+
+
+# Test the nightly rollover of overdue tasks.
+class RolloverTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    # Test the vectorized due dates match recurrence.roll_forward for series
+    #   starting every few days over several years.
+    def test_next_due_dates(self):
+        periods = ('d', '3d', 'w', '2w@0', 'm', 'm@31', '3m@15')
+        offsets = (0, 1, 6, 7, 13, 30, 31, 59, 400)
+        for period in periods:
+            dues, todays = [], []
+            for i in range(0, 3 * 366, 5):
+                due = first_due(period, datetime(2019, 12, 1, 23, 59, 59)
+                                + timedelta(days=i))
+                dues.extend([due] * len(offsets))
+                todays.extend(due + timedelta(days=offset) for offset in offsets)
+            for due, today in zip(dues, todays):
+                rolled = next_due_dates([period], [due], today.date()).astype(datetime)
+                self.assertEqual(rolled[0], roll_forward(period, due, today),
+                                 (period, due, today))
+            mixed = next_due_dates([period] * len(dues), dues, date(2021, 3, 17))
+            self.assertEqual(list(mixed.astype(datetime)),
+                             [roll_forward(period, due, datetime(2021, 3, 17))
+                              for due in dues])
+
+    # Test overdue tasks are rolled and the family sees the change.
+    def test_roll_overdue_tasks(self):
+        f = Family(family_name='f')
+        db.session.add(f)
+        db.session.commit()
+        u = User(username='u', family=f)
+        db.session.add(u)
+        db.session.commit()
+        past = datetime(2021, 2, 10, 23, 59, 59)
+        tasks = [Task(taskname=p, period=p, assigned_user=u, today=past)
+                 for p in ('d', 'w', 'm', '2w@0', 'm@31')]
+        current = Task(taskname='current', period='d', assigned_user=u,
+                       today=datetime(2021, 3, 17, 23, 59, 59))
+        db.session.add_all(tasks + [current])
+        db.session.commit()
+        version = f.version
+        f.get_family_tasks_json()
+
+        self.assertEqual(roll_overdue_tasks(date(2021, 3, 17), chunk_size=2), 5)
+        self.assertEqual([t.next_due for t in tasks],
+                         [datetime(2021, 3, 17, 23, 59, 59),
+                          datetime(2021, 3, 20, 23, 59, 59),
+                          datetime(2021, 4, 1, 23, 59, 59),
+                          datetime(2021, 3, 29, 23, 59, 59),
+                          datetime(2021, 3, 31, 23, 59, 59)])
+        self.assertEqual(current.next_due, datetime(2021, 3, 17, 23, 59, 59))
+        self.assertGreater(f.version, version)
+        self.assertEqual(tasks[-1].revision, f.version)
+        self.assertIsNone(task_cache.backend.get(family_key(f.id)))
+
+        # Nothing is left to roll.
+        self.assertEqual(roll_overdue_tasks(date(2021, 3, 17)), 0)
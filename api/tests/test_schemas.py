@@ -0,0 +1,95 @@
+import unittest
+import json
+from app import create_app, db
+from app.api.schemas import Schema, decode_literal
+from app.exceptions import ValidationError
+from app.models import User, Role
+
+
+# Test decoding and validating request bodies.
+class SchemaTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+        u = User(username='u', email='u', password='u', confirmed=True)
+        db.session.add(u)
+        db.session.commit()
+        self.token = u.generate_auth_token()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def post(self, url, body):
+        return self.client.post(url,
+                data=json.dumps({'auth':{'email_or_token':self.token},
+                                 'body':body}),
+                content_type='application/json')
+
+    # Test fields are checked for presence and type.
+    def test_validate(self):
+        schema = Schema(optional=('note',), id=(int, str), name=(str, None),
+                        note=str, done=bool)
+        body = {'id':1, 'name':None, 'done':True, 'extra':[1]}
+        self.assertIs(schema.validate(body), body)
+        schema.validate({'id':'1', 'name':'n', 'note':'', 'done':False})
+        for body in ({'name':'n', 'done':True},
+                     {'id':1.5, 'name':'n', 'done':True},
+                     {'id':True, 'name':'n', 'done':True},
+                     {'id':1, 'name':'n', 'done':1},
+                     {'id':1, 'name':'n', 'done':True, 'note':None},
+                     ['id'],
+                     None):
+            with self.assertRaises(ValidationError):
+                schema.validate(body)
+
+    # Test legacy string bodies are decoded as JSON or python literals.
+    def test_decode_literal(self):
+        self.assertEqual(decode_literal('{"a":[1, true, null]}'),
+                         {'a':[1, True, None]})
+        self.assertEqual(decode_literal("{'a':[1, True, None]}"),
+                         {'a':[1, True, None]})
+        for value in ('{"a":', 'open("f")', '{"a":1} + {}', ''):
+            with self.assertRaises(ValidationError):
+                decode_literal(value)
+        value = '(' + ' '*self.app.config['LEGACY_BODY_MAX_LENGTH'] + ')'
+        with self.assertRaises(ValidationError):
+            decode_literal(value)
+
+    # Test routes accept JSON object bodies and legacy string bodies.
+    def test_routes(self):
+        for body in ({'familyName':'a'}, '{"familyName":"b"}', "{'familyName':'c'}"):
+            response = self.post('/api/auth/createFamily', body)
+            self.assertEqual(response.status_code, 201)
+
+        response = self.post('/api/auth/changePassword',
+                             {'oldPass':'u', 'newPass':'v'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(User.query.get(1).verify_password('v'))
+        self.token = response.get_json()['token']
+
+        # Malformed and invalid bodies are bad requests.
+        for body in ('{"familyName":', {'familyName':1}, {}, [], None):
+            response = self.post('/api/auth/createFamily', body)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.get_json()['error'], 'bad request')
+
+    # Test routes accept a top level JSON object as the body, with the token
+    #   sent in the Authorization header.
+    def test_top_level_body(self):
+        headers = {'Authorization':f'Bearer {self.token}'}
+        response = self.client.post('/api/auth/createFamily', headers=headers,
+                                    json={'familyName':'x'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(User.query.get(1).family.family_name, 'x')
+
+        for body in ({'familyName':1}, {}, ['familyName']):
+            response = self.client.post('/api/auth/createFamily',
+                                        headers=headers, json=body)
+            self.assertEqual(response.status_code, 400)
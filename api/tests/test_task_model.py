@@ -1,5 +1,6 @@
 import unittest
 import time
+from unittest import mock
 from app import create_app, db
 from app.models import User, Role, Permission, Task, Subtask, Family
 from datetime import datetime, timedelta, date
@@ -91,6 +92,24 @@ class TaskModelTestCase(unittest.TestCase):
         t = Task(period='m',today = today)
         self.assertTrue(is_date(t.next_due,datetime(day=1,month=1,year=2001)))
 
+    # Tests the default due dates follow the current day, rather than the day
+    #   the module was imported.
+    def test_today_default(self):
+        class LaterDatetime(datetime):
+            @classmethod
+            def today(cls):
+                return cls(2021, 1, 10, 8, 30)
+
+        td,tw,tm = load_tasks()
+        td.next_due = datetime(month=1, day=1, year=2021)
+        td.update_next_due(today=datetime(month=1, day=1, year=2020))
+        self.assertTrue(is_date(td.next_due,datetime(month=1, day=1, year=2021)))
+        with mock.patch('app.models.datetime', LaterDatetime):
+            td.update_next_due()
+            t = Task(period='d')
+        self.assertTrue(is_date(td.next_due,datetime(month=1, day=11, year=2021)))
+        self.assertEqual(t.next_due, datetime(2021, 1, 10, 23, 59, 59))
+
     # Tests update_next_due.
     def test_update_next_due(self):
         td,tw,tm = load_tasks()
@@ -240,3 +259,65 @@ class TaskModelTestCase(unittest.TestCase):
         self.assertFalse(s1.is_complete)
         self.assertFalse(s2.is_complete)
         self.assertFalse(is_date(t.next_due,first_due))
+
+    # Test task completion is committed as one transaction.
+    def test_completion_commits(self):
+        td,tw,tm = load_tasks()
+        subtasks = [Subtask(task_id=tw.id) for i in range(5)]
+        db.session.add_all(subtasks)
+        db.session.commit()
+        for st in subtasks[:4]:
+            st.complete()
+        first_due = tw.next_due
+
+        commits = []
+        on_commit = commits.append
+        db.event.listen(db.engine, 'commit', on_commit)
+        try:
+            subtasks[4].complete()
+        finally:
+            db.event.remove(db.engine, 'commit', on_commit)
+        self.assertEqual(len(commits), 1)
+        self.assertGreater(tw.next_due, first_due)
+        for st in subtasks:
+            self.assertFalse(st.is_complete)
+            self.assertEqual(st.revision, tw.revision)
+
+    # Test the subtask counters follow adds, ticks and deletes.
+    def test_subtask_counts(self):
+        td,tw,tm = load_tasks()
+        subtasks = [Subtask(task_id=tw.id) for i in range(3)]
+        db.session.add_all(subtasks)
+        db.session.commit()
+        self.assertEqual((tw.subtask_count, tw.completed_count), (3, 0))
+
+        subtasks[0].complete()
+        subtasks[1].complete()
+        self.assertEqual((tw.subtask_count, tw.completed_count), (3, 2))
+        subtasks[1].uncomplete()
+        self.assertEqual((tw.subtask_count, tw.completed_count), (3, 1))
+
+        # Deleting a complete subtask removes it from both counters.
+        db.session.delete(subtasks[0])
+        db.session.commit()
+        self.assertEqual((tw.subtask_count, tw.completed_count), (2, 0))
+
+        # Completing the task resets the completed counter.
+        subtasks[1].complete()
+        subtasks[2].complete()
+        self.assertEqual((tw.subtask_count, tw.completed_count), (2, 0))
+
+    # Test repair_counts() recomputes wrong counters.
+    def test_repair_counts(self):
+        td,tw,tm = load_tasks()
+        db.session.add_all([Subtask(task_id=td.id, is_complete=True),
+                            Subtask(task_id=td.id),
+                            Subtask(task_id=tw.id)])
+        db.session.commit()
+        Task.query.update({Task.subtask_count:9, Task.completed_count:9})
+        db.session.commit()
+        self.assertEqual(Task.repair_counts(batch_size=2), 3)
+        self.assertEqual((td.subtask_count, td.completed_count), (2, 1))
+        self.assertEqual((tw.subtask_count, tw.completed_count), (1, 0))
+        self.assertEqual((tm.subtask_count, tm.completed_count), (0, 0))
+        self.assertEqual(Task.repair_counts(), 0)
@@ -0,0 +1,83 @@
+import unittest
+import time
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+from app import create_app, db, tokens
+from app.tokens import TokenSigner
+from app.models import User, Role
+
+
+# Test issuing and verifying signed tokens.
+class TokenSignerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    # Test tokens verify for their own purpose only.
+    def test_purposes(self):
+        token = tokens.issue('confirm', {'confirm':1}, 60)
+        self.assertEqual(tokens.verify('confirm', token), {'confirm':1})
+        self.assertIsNone(tokens.verify('reset', token))
+        self.assertIsNone(tokens.verify('auth', token))
+
+        data, header = tokens.verify('confirm', token, return_header=True)
+        self.assertEqual(data, {'confirm':1})
+        self.assertIn('exp', header)
+
+        # Tokens signed with the bare secret key are rejected.
+        s = Serializer(self.app.config['SECRET_KEY'], 60)
+        self.assertIsNone(tokens.verify('confirm',
+                                        s.dumps({'confirm':1}).decode('utf-8')))
+
+    # Test malformed and expired tokens are rejected.
+    def test_invalid(self):
+        token = tokens.issue('auth', {'id':1}, 60)
+        self.assertIsNone(tokens.verify('auth', token[:-2]))
+        self.assertIsNone(tokens.verify('auth', 'bum_token'))
+        self.assertIsNone(tokens.verify('auth', None))
+        self.assertIsNone(tokens.verify('auth', ''))
+
+        token = tokens.issue('auth', {'id':1}, 1)
+        time.sleep(2)
+        self.assertIsNone(tokens.verify('auth', token))
+
+    # Test one serializer is kept per purpose and expiry.
+    def test_memoized(self):
+        s = tokens.serializer('auth', 60)
+        self.assertIs(tokens.serializer('auth', 60), s)
+        self.assertIsNot(tokens.serializer('auth', 30), s)
+        self.assertIsNot(tokens.serializer('reset', 60), s)
+
+        # Tokens depend on the secret key.
+        token = tokens.issue('auth', {'id':1}, 60)
+        self.app.config['SECRET_KEY'] = 'other-secret'
+        signer = TokenSigner(self.app)
+        self.assertIsNone(signer.verify('auth', token))
+        self.assertEqual(signer.verify('auth', signer.issue('auth', {'id':1}, 60)),
+                         {'id':1})
+
+    # Test the user tokens are issued for their routes.
+    def test_user_tokens(self):
+        u = User(email='u@example.com', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        self.assertEqual(User.verify_auth_token(u.generate_auth_token()), u)
+        self.assertIsNone(User.verify_auth_token(u.generate_reset_token()))
+        self.assertIsNone(User.verify_auth_token(u.generate_confirmation_token()))
+
+        response = self.app.test_client().post(
+                f'/api/auth/validateResetRequest/{u.generate_confirmation_token()}',
+                json={'auth':{'email_or_token':''}, 'body':''})
+        self.assertEqual(response.status_code, 401)
+        response = self.app.test_client().post(
+                f'/api/auth/validateResetRequest/{u.generate_reset_token()}',
+                json={'auth':{'email_or_token':''}, 'body':''})
+        self.assertEqual(response.status_code, 200)
@@ -1,5 +1,6 @@
 import unittest
 import time
+from flask_sqlalchemy import get_debug_queries
 from app import create_app, db
 from app.models import User, Role, Permission, AnonymousUser
 
@@ -102,3 +103,48 @@ class UserModelTestCase(unittest.TestCase):
         self.assertFalse(u.can(Permission.CREATE))
         self.assertFalse(u.can(Permission.ADD_USER))
         self.assertFalse(u.can(Permission.ADMIN))
+
+    # Test roles and permissions are resolved from the registry without
+    #   querying the db.
+    def test_role_registry(self):
+        u = User(email='u@example.com')
+        db.session.add(u)
+        db.session.commit()
+        u_id = u.id
+        db.session.expunge_all()
+        u = User.query.get(u_id)
+        before = len(get_debug_queries())
+        leader = Role.named('Leader')
+        self.assertEqual(leader, Role.query.filter_by(name='Leader').first())
+        before += 1
+        self.assertIs(Role.named('Leader'), leader)
+        self.assertIsNone(Role.named('Nobody'))
+        self.assertTrue(u.can(Permission.COMPLETE))
+        self.assertFalse(u.can(Permission.ADD_USER))
+        self.assertFalse(u.is_administrator())
+        u.role = leader
+        self.assertTrue(u.can(Permission.ADD_USER))
+        self.assertEqual(len(get_debug_queries()), before)
+
+        # Changing a role reloads the registry.
+        leader.remove_permission(Permission.ADD_USER)
+        db.session.commit()
+        self.assertFalse(Role.registry().by_name['Leader']\
+                         .has_permission(Permission.ADD_USER))
+        Role.insert_roles()
+        self.assertTrue(Role.registry().by_name['Leader']\
+                        .has_permission(Permission.ADD_USER))
+        with self.assertRaises(TypeError):
+            Role.registry().by_name['Leader'] = None
+
+        # Roles changed by another process are picked up once the registry
+        #   expires.
+        roles = Role.__table__
+        db.session.execute(roles.update().where(roles.c.name == 'Leader')
+                           .values(permissions=Permission.COMPLETE))
+        db.session.commit()
+        self.assertTrue(Role.registry().by_name['Leader']\
+                        .has_permission(Permission.ADD_USER))
+        self.app.config['ROLE_REGISTRY_TTL'] = 0
+        self.assertFalse(Role.registry().by_name['Leader']\
+                         .has_permission(Permission.ADD_USER))